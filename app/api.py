@@ -0,0 +1,199 @@
+# app/api.py
+
+import datetime
+import json
+
+from flask import Blueprint, Response, abort, g, jsonify, request, stream_with_context
+
+import core
+from money import from_cents, to_cents
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+FIELDS = ('date', 'category', 'amount', 'description')
+STREAM_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+MAX_HISTORY_DAYS = 10 * 366
+
+
+def transaction_json(txn_id, row):
+    # Amounts that aren't finite numbers (old hand-edited rows) go out as the
+    # text they were stored as: NaN and Infinity aren't JSON.
+    cents = to_cents(row[2])
+    amount = from_cents(cents) if cents is not None else row[2]
+    return {'id': txn_id, 'date': row[0], 'category': row[1], 'amount': amount, 'description': row[3]}
+
+
+def parse_row(item):
+    # Returns [date, category, amount, description] or aborts with a 400.
+    if not isinstance(item, dict) or any(name not in item for name in FIELDS):
+        abort(400, description='each transaction needs %s' % ', '.join(FIELDS))
+    if not core.validate_date(str(item['date'])):
+        abort(400, description='invalid date %r, use YYYY-MM-DD' % item['date'])
+    if to_cents(item['amount']) is None:
+        abort(400, description='invalid amount %r' % (item['amount'],))
+    return [str(item['date']), str(item['category']), float(item['amount']), str(item['description'])]
+
+
+def parse_id(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        abort(400, description='invalid id %r' % (value,))
+    return value
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def json_error(error):
+    return jsonify(error=error.description), error.code
+
+
+@api.route('/transactions', methods=['GET'])
+def list_transactions():
+    """Streams matching transactions as NDJSON, newest first, a page at a time."""
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    category = request.args.get('category') or None
+    # The body is sent after the view returns, outside the user selected for the request.
+    user = g.get('finance_user')
+
+    def generate():
+        with core.use_user(user):
+            cursor = None
+            while True:
+                page = core.page_transactions(cursor, STREAM_PAGE_SIZE, start, end, category)
+                for txn_id, row in page:
+                    yield json.dumps(transaction_json(txn_id, row)) + '\n'
+                if len(page) < STREAM_PAGE_SIZE:
+                    break
+                cursor = (page[-1][1][0], page[-1][0])
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@api.route('/transactions/<int:txn_id>', methods=['GET'])
+def get_transaction(txn_id):
+    row = core.get_transaction(txn_id)
+    if row is None:
+        abort(404, description='no transaction %d' % txn_id)
+    return jsonify(transaction_json(txn_id, row))
+
+
+@api.route('/transactions/batch', methods=['POST'])
+def batch():
+    """Applies {"create": [...], "update": [...], "delete": [ids]} in one storage transaction."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, description='expected a JSON object')
+    creates = body.get('create') or []
+    updates = body.get('update') or []
+    deletes = body.get('delete') or []
+    if not all(isinstance(items, list) for items in (creates, updates, deletes)):
+        abort(400, description='create, update and delete must be lists')
+    if len(creates) + len(updates) + len(deletes) > MAX_BATCH_SIZE:
+        abort(400, description='at most %d changes per batch' % MAX_BATCH_SIZE)
+    creates = [parse_row(item) for item in creates]
+    updates = [(parse_id(item.get('id') if isinstance(item, dict) else None), parse_row(item)) for item in updates]
+    deletes = [parse_id(txn_id) for txn_id in deletes]
+    try:
+        created = core.apply_batch(creates, updates, deletes)
+    except KeyError as e:
+        abort(404, description='no transaction %s, nothing was applied' % e.args[0])
+    return jsonify(created=created, updated=len(updates), deleted=len(deletes))
+
+
+@api.route('/summary', methods=['GET'])
+def summary():
+    initial_balance = core.get_initial_balance()
+    return jsonify(
+        initial_balance=initial_balance,
+        net_savings=core.calculate_net_savings(),
+        category_totals=core.get_category_totals(),
+    )
+
+
+@api.route('/budgets', methods=['GET'])
+def budgets():
+    """Budget vs. actual for ?month=YYYY-MM (default: the current month)."""
+    month = request.args.get('month') or None
+    if month is not None and not core.validate_date(month + '-01'):
+        abort(400, description='invalid month %r, use YYYY-MM' % month)
+    return jsonify(budgets=core.check_budget_vs_spending(month))
+
+
+@api.route('/budgets', methods=['POST'])
+def set_budget():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or 'category' not in body or 'amount' not in body:
+        abort(400, description='expected {"category": ..., "amount": ...}')
+    cents = to_cents(body['amount'])
+    if cents is None:
+        abort(400, description='invalid amount %r' % body['amount'])
+    amount = from_cents(cents)
+    core.set_budget(str(body['category']), amount)
+    return jsonify(category=str(body['category']), amount=amount)
+
+
+@api.route('/budgets/alerts', methods=['GET'])
+def budget_alerts():
+    """The most recent threshold alerts, oldest first."""
+    return jsonify(alerts=core.get_budget_engine().recent_alerts())
+
+
+@api.route('/recurring', methods=['GET'])
+def recurring():
+    """Recurring charges (weekly, monthly or annual), biggest monthly cost first."""
+    return jsonify(recurring=core.find_recurring())
+
+
+def date_arg(name, default=None):
+    # Returns the query argument as a YYYY-MM-DD string (zero-padded), or aborts with a 400.
+    value = request.args.get(name) or default
+    if value is None:
+        return None
+    if not core.validate_date(value):
+        abort(400, description='invalid %s %r, use YYYY-MM-DD' % (name, value))
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date().isoformat()
+
+
+@api.route('/balance', methods=['GET'])
+def balance():
+    """The balance at the end of ?date= (default: today), and the change over ?start=...&end= if given."""
+    date = date_arg('date', datetime.date.today().isoformat())
+    result = {'date': date, 'balance': core.get_balance(date)}
+    start, end = date_arg('start'), date_arg('end')
+    if start is not None or end is not None:
+        if start is None or end is None:
+            abort(400, description='start and end go together')
+        result.update(start=start, end=end, change=core.get_period_total(start, end))
+    return jsonify(result)
+
+
+@api.route('/balance/history', methods=['GET'])
+def balance_history():
+    """The balance at the end of each day from ?start= to ?end=.
+
+    They default to the last transaction and to MAX_HISTORY_DAYS before
+    it (or the first transaction, if that is later), so the answer is
+    bounded even when nothing is asked for.
+    """
+    start, end = date_arg('start'), date_arg('end')
+    if start is None or end is None:
+        span = core.get_date_span()
+        if span is None:
+            return jsonify(balances=[])
+        if end is None:
+            end = max(span[1], start or span[1])
+        if start is None:
+            last = datetime.date.fromisoformat(end).toordinal()
+            earliest = datetime.date.fromordinal(max(last - MAX_HISTORY_DAYS + 1, 1))
+            start = min(max(span[0], earliest.isoformat()), end)
+    days = (datetime.date.fromisoformat(end) - datetime.date.fromisoformat(start)).days
+    if not 0 <= days < MAX_HISTORY_DAYS:
+        abort(400, description='start to end must be 0 to %d days' % (MAX_HISTORY_DAYS - 1))
+    history = core.get_balance_history(start, end)
+    return jsonify(balances=[{'date': date, 'balance': total} for date, total in history])
+
+
+@api.route('/monthly', methods=['GET'])
+def monthly():
+    return jsonify(months=[{'month': month, 'total': total} for month, total in core.get_monthly_totals().items()])
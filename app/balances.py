@@ -0,0 +1,165 @@
+# app/balances.py
+"""Net amounts per day with prefix sums, for balances at any date.
+
+DailyTotals keeps a Fenwick tree over a window of day ordinals, so the
+net amount of everything dated on or before a day, and so of any date
+range, takes O(log days), and adding, editing or removing a row takes
+O(log days) whatever its date. A plain per-day array sits next to the
+tree for daily curves. The window starts around the days it was fitted
+on and doubles, with an O(days) rebuild, when a row lands outside it.
+
+Only days from FIRST_DATE to LAST_DATE are on the timeline. A typo such
+as 0024-01-05 is still a valid date, but letting it in would stretch the
+window across two thousand years, so rows dated outside that range are
+left off, like rows with no date at all.
+"""
+
+import datetime
+from array import array
+
+from money import sum_by_code
+
+MIN_WINDOW = 1024  # days
+FIRST_DATE = '1900-01-01'
+LAST_DATE = '2199-12-31'
+FIRST_DAY = datetime.date.fromisoformat(FIRST_DATE).toordinal()
+LAST_DAY = datetime.date.fromisoformat(LAST_DATE).toordinal()
+
+
+def on_timeline(ordinal):
+    return FIRST_DAY <= ordinal <= LAST_DAY
+
+
+def _lowbit(i):
+    return i & -i
+
+
+class DailyTotals:
+    """Net cents and row counts per day, with O(log days) prefix sums.
+
+    Not thread-safe: the stores that own one update and read it under
+    their own lock.
+    """
+
+    def __init__(self):
+        self.origin = 0  # ordinal of day slot 0
+        self.days = array('q')  # net cents per day slot
+        self.counts = array('q')  # rows per day slot
+        self.tree = array('q')  # tree[i - 1] holds the days (i - lowbit(i), i], 1-based
+
+    def __len__(self):
+        return len(self.days)
+
+    # --- Building ---
+
+    def fit(self, ordinals, cents):
+        """Rebuilds from parallel sequences of day ordinals and cents; days off the timeline are skipped."""
+        import numpy as np
+
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        kept = (ordinals >= FIRST_DAY) & (ordinals <= LAST_DAY)
+        if not kept.all():
+            ordinals, cents = ordinals[kept], np.asarray(cents, dtype=np.int64)[kept]
+        if not len(ordinals):
+            self.origin, self.days, self.counts, self.tree = 0, array('q'), array('q'), array('q')
+            return
+        first, last = int(ordinals.min()), int(ordinals.max())
+        size = MIN_WINDOW
+        while size < (last - first + 1) * 2:
+            size *= 2
+        # Room on both sides for rows dated just before or after what we have.
+        origin = first - (size - (last - first + 1)) // 2
+        days, counts = sum_by_code(ordinals - origin, cents, size)
+        self._build(origin, np.array(days, dtype=np.int64), np.array(counts, dtype=np.int64))
+
+    def _build(self, origin, days, counts):
+        import numpy as np
+
+        # tree[i - 1] = prefix[i] - prefix[i - lowbit(i)], every node at once.
+        prefix = np.concatenate(([0], np.cumsum(days)))
+        slots = np.arange(1, len(days) + 1)
+        tree = prefix[slots] - prefix[slots - (slots & -slots)]
+        self.origin = origin
+        self.days = array('q', days.tobytes())
+        self.counts = array('q', counts.tobytes())
+        self.tree = array('q', tree.astype(np.int64).tobytes())
+
+    def _grow(self, ordinal):
+        import numpy as np
+
+        if not self.days:
+            empty = np.zeros(MIN_WINDOW, dtype=np.int64)
+            self._build(ordinal - MIN_WINDOW // 2, empty, empty)
+            return
+        first, last = min(ordinal, self.origin), max(ordinal, self.origin + len(self.days) - 1)
+        size = len(self.days)
+        while size < (last - first + 1) * 2:
+            size *= 2
+        origin = first - (size - (last - first + 1)) // 2
+        days = np.zeros(size, dtype=np.int64)
+        counts = np.zeros(size, dtype=np.int64)
+        offset = self.origin - origin
+        days[offset:offset + len(self.days)] = np.frombuffer(self.days, dtype=np.int64)
+        counts[offset:offset + len(self.counts)] = np.frombuffer(self.counts, dtype=np.int64)
+        self._build(origin, days, counts)
+
+    # --- Updates ---
+
+    def add(self, ordinal, cents, count=1):
+        """Adds `cents` (and `count` rows) to a day; pass negatives to take a row away."""
+        if not on_timeline(ordinal):
+            return
+        slot = ordinal - self.origin
+        if not 0 <= slot < len(self.days):
+            self._grow(ordinal)
+            slot = ordinal - self.origin
+        self.days[slot] += cents
+        self.counts[slot] += count
+        tree = self.tree
+        i = slot + 1
+        while i <= len(tree):
+            tree[i - 1] += cents
+            i += _lowbit(i)
+
+    # --- Queries ---
+
+    def through(self, ordinal):
+        """Returns the net cents of every day up to and including `ordinal`."""
+        slot = min(ordinal - self.origin, len(self.tree) - 1)
+        total = 0
+        tree = self.tree
+        i = slot + 1
+        while i > 0:
+            total += tree[i - 1]
+            i -= _lowbit(i)
+        return total
+
+    def between(self, first, last):
+        """Returns the net cents of the days from `first` to `last`, inclusive."""
+        if last < first:
+            return 0
+        return self.through(last) - self.through(first - 1)
+
+    def span(self):
+        """Returns the (first, last) ordinals that have rows, or None."""
+        import numpy as np
+
+        if not self.counts:
+            return None
+        used = np.flatnonzero(np.frombuffer(self.counts, dtype=np.int64))
+        if not len(used):
+            return None
+        return self.origin + int(used[0]), self.origin + int(used[-1])
+
+    def curve(self, first, last):
+        """Returns the running net cents at the end of each day from `first` to `last`."""
+        import numpy as np
+
+        if last < first:
+            return []
+        days = np.zeros(last - first + 1, dtype=np.int64)
+        low, high = max(first, self.origin), min(last, self.origin + len(self.days) - 1)
+        if low <= high:
+            window = np.frombuffer(self.days, dtype=np.int64)
+            days[low - first:high - first + 1] = window[low - self.origin:high - self.origin + 1]
+        return (np.cumsum(days) + self.through(first - 1)).tolist()
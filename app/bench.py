@@ -0,0 +1,459 @@
+# app/bench.py
+"""Synthetic ledgers and a benchmark suite for the storage and reporting paths.
+
+Generate a reproducible ledger, or time the hot paths against one:
+
+    python app/bench.py generate --rows 1000000 --seed 1 --format ledger --out /tmp/transactions.csv
+    python app/bench.py run --rows 100000 --seed 1 --out before.json
+    python app/bench.py run --rows 100000 --seed 1 --baseline before.json
+    python app/bench.py imports
+    python app/bench.py stress --processes 4 --threads 4 --rows 200
+
+`run` works in a scratch directory, so the real data files are never
+touched. It writes the same synthetic rows to every store, times each
+benchmark `--repeat` times, and prints the results as JSON. With
+--baseline it also compares median times against an earlier run's JSON,
+and exits with status 1 if any benchmark got slower than --tolerance allows.
+
+`imports` runs the everyday paths (adding and listing transactions, the
+web index page) in a fresh interpreter under `python -X importtime`. It
+fails if they load pandas, matplotlib or pyarrow, or take longer to import
+than their budget.
+
+`stress` has several processes, each with several threads, append rows
+to one ledger file and then update every row they added. It checks that
+no write was lost, and compares throughput with group commit on and off.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from money import from_cents
+
+BATCH_SIZE = 100000
+
+# category -> (share of rows, median amount in dollars, spread, merchants).
+# Amounts are log-normal around the median; Income is the only positive one.
+CATEGORY_MIX = {
+    'Groceries': (0.26, 45.0, 0.6, ['Whole Foods', 'Trader Joes', 'Safeway', 'Costco', 'Aldi']),
+    'Dining': (0.18, 22.0, 0.7, ['Chipotle', 'Starbucks', 'Local Diner', 'Sushi Bar', 'Pizza Place']),
+    'Transport': (0.14, 18.0, 0.8, ['Uber', 'Lyft', 'Shell', 'Chevron', 'Metro Card']),
+    'Shopping': (0.12, 60.0, 1.0, ['Amazon', 'Target', 'Best Buy', 'IKEA', 'Etsy']),
+    'Entertainment': (0.08, 25.0, 0.8, ['Netflix', 'Spotify', 'Cinema', 'Steam', 'Concert Tickets']),
+    'Utilities': (0.07, 90.0, 0.4, ['Electric Co', 'Water Dept', 'Gas Utility', 'Internet Provider']),
+    'Health': (0.05, 40.0, 0.9, ['Pharmacy', 'Dentist', 'Clinic', 'Gym Membership']),
+    'Rent': (0.03, 1500.0, 0.15, ['Landlord']),
+    'Income': (0.07, 1800.0, 0.3, ['Payroll', 'Freelance Client', 'Interest']),
+}
+
+
+# --- Synthetic data ---
+
+def synthetic_batches(rows, seed=0, start='2020-01-01', years=5, batch_size=BATCH_SIZE):
+    """Yields lists of (date, category, cents, description) tuples, dates ascending.
+
+    The rows spread evenly over `years` from `start`. Categories and amounts
+    follow CATEGORY_MIX. The same rows, seed and batch_size always give the
+    same output.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    names = list(CATEGORY_MIX)
+    shares = np.array([CATEGORY_MIX[name][0] for name in names])
+    shares /= shares.sum()
+    medians = np.log([CATEGORY_MIX[name][1] for name in names])
+    spreads = np.array([CATEGORY_MIX[name][2] for name in names])
+    signs = np.array([1 if name == 'Income' else -1 for name in names])
+    first = np.datetime64(start, 'D')
+    days = int(round(365.25 * years))
+    for begin in range(0, rows, batch_size):
+        end = min(begin + batch_size, rows)
+        size = end - begin
+        dates = (first + np.arange(begin, end, dtype=np.int64) * days // max(rows, 1)).astype(str).tolist()
+        codes = rng.choice(len(names), size=size, p=shares)
+        cents = np.round(signs[codes] * rng.lognormal(medians[codes], spreads[codes]) * 100).astype(np.int64)
+        picks = rng.integers(0, 1 << 30, size=size)
+        descriptions = [CATEGORY_MIX[names[code]][3][pick % len(CATEGORY_MIX[names[code]][3])]
+                        for code, pick in zip(codes.tolist(), picks.tolist())]
+        yield list(zip(dates, [names[code] for code in codes.tolist()], cents.tolist(), descriptions))
+
+
+def write_ledger(path, batches):
+    """Writes rows in the Ledger's transactions file format (see core.DATA_FILE)."""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        for batch in batches:
+            writer.writerows((date, category, '%.2f' % from_cents(cents), description)
+                             for date, category, cents, description in batch)
+
+
+def write_export(path, batches):
+    """Writes rows as the date,amount,category,description,type CSV that core.import_from_csv reads."""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['date', 'amount', 'category', 'description', 'type'])
+        for batch in batches:
+            writer.writerows((date, '%.2f' % from_cents(cents), category, description,
+                              'credit' if cents > 0 else 'debit')
+                             for date, category, cents, description in batch)
+
+
+def write_finance_csv(path, batches):
+    """Writes rows in core.CSV's format: dd-mm-yyyy dates, amount before category."""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['date', 'amount', 'category', 'description'])
+        for batch in batches:
+            writer.writerows(('%s-%s-%s' % (date[8:], date[5:7], date[:4]), '%.2f' % from_cents(cents),
+                              category, description)
+                             for date, category, cents, description in batch)
+
+
+def sqlite_batches(batches):
+    """Reshapes batches for SQLiteStorage.append_many."""
+    for batch in batches:
+        yield [(date, cents, category, description, 'credit' if cents > 0 else 'debit')
+               for date, category, cents, description in batch]
+
+
+def write_sqlite(path, batches):
+    from storage import SQLiteStorage
+
+    storage = SQLiteStorage(path)
+    try:
+        return storage.append_many(sqlite_batches(batches), rebuild_indexes=True)
+    finally:
+        storage.close()
+
+
+WRITERS = {
+    'ledger': write_ledger,
+    'export': write_export,
+    'finance': write_finance_csv,
+    'sqlite': write_sqlite,
+}
+
+
+# --- Benchmarks ---
+
+def measure(func, repeat, setup=None):
+    """Runs func(*setup()) `repeat` times; only the call itself is timed."""
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return {
+        'runs': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'max': max(times),
+    }
+
+
+def benchmarks(rows, seed):
+    """Writes the synthetic data into the current directory and returns {name: (func, setup)}.
+
+    core and the web app keep their files at relative paths, so the caller
+    should chdir to a scratch directory first.
+    """
+    import pandas as pd
+
+    import core
+    from ledger import Ledger
+
+    os.makedirs('data', exist_ok=True)
+    write_ledger(core.DATA_FILE, synthetic_batches(rows, seed))
+    write_sqlite(core.DB_FILE, synthetic_batches(rows, seed))
+    write_finance_csv(core.CSV.CSV_FILE, synthetic_batches(rows, seed))
+    write_export('export.csv', synthetic_batches(rows, seed))
+    frame = pd.DataFrame([row for batch in synthetic_batches(rows, seed) for row in batch],
+                         columns=['date', 'category', 'cents', 'description'])
+    frame['amount'] = frame.pop('cents') / 100
+    start, middle = frame['date'].iloc[0], frame['date'].iloc[len(frame) // 2]
+
+    def dmy(date):
+        return '%s-%s-%s' % (date[8:], date[5:7], date[:4])
+
+    def on(backend, func):
+        def run(*args):
+            core.STORAGE_BACKEND = backend
+            return func(*args)
+        return run
+
+    cases = {}
+    for backend in ('csv', 'sqlite'):
+        cases[backend + '.get_transactions'] = (on(backend, lambda: list(core.get_transactions())), None)
+        cases[backend + '.calculate_net_savings'] = (on(backend, core.calculate_net_savings), None)
+        cases[backend + '.get_category_totals'] = (on(backend, core.get_category_totals), None)
+    cases['ledger.load'] = (lambda: Ledger(os.path.abspath(core.DATA_FILE)).records(), None)
+    # A fresh Ledger answers totals with a scan of the file instead of loading it.
+    cases['ledger.cold_totals'] = (lambda: Ledger(os.path.abspath(core.DATA_FILE)).category_totals(), None)
+    cases['CSV.get_transactions'] = (
+        lambda: core.CSV.get_transactions(dmy(start), dmy(middle), date_sorted=True), None)
+    cases['analyze_spending'] = (core.analyze_spending, lambda: (frame.copy(),))
+    imports = iter(range(1 << 30))
+
+    def import_into(database):
+        # Each import goes into an empty database of its own.
+        main_database, core.DB_FILE = core.DB_FILE, database
+        try:
+            core.import_from_csv('export.csv')
+        finally:
+            core.DB_FILE = main_database
+
+    cases['import_from_csv'] = (import_into, lambda: ('import-%d.db' % next(imports),))
+
+    def client():
+        import web
+
+        web.app.config['TESTING'] = True
+        return web, web.app.test_client()
+
+    def get(path, clear_charts=False):
+        def run():
+            web, test_client = client()
+            if clear_charts:
+                web.chart_cache.clear()
+            response = test_client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError('GET %s answered %s' % (path, response.status_code))
+            response.close()
+        return on('csv', run)
+
+    cases['web./'] = (get('/'), None)
+    cases['web./edit'] = (get('/edit?id=%d' % (rows // 2)), None)
+    cases['web./report.png'] = (get('/report.png', clear_charts=True), None)
+    return cases
+
+
+def run_suite(rows, seed, repeat, only=None):
+    """Returns the JSON-ready results of every benchmark whose name contains `only`."""
+    import numpy as np
+    import pandas as pd
+
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='finance-bench-') as workdir:
+        os.chdir(workdir)
+        try:
+            cases = benchmarks(rows, seed)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                for name, (func, setup) in cases.items():
+                    if only and only not in name:
+                        continue
+                    results[name] = measure(func, repeat, setup)
+        finally:
+            os.chdir(cwd)
+    return {
+        'meta': {
+            'rows': rows,
+            'seed': seed,
+            'repeat': repeat,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+        },
+        'results': results,
+    }
+
+
+NOISE_FLOOR = 0.001  # slowdowns smaller than this many seconds are timer noise
+
+
+def compare(current, baseline, tolerance):
+    """Prints median times against a baseline run; returns the names that regressed."""
+    regressed = []
+    print('%-28s %11s %11s %7s' % ('benchmark', 'base ms', 'now ms', 'ratio'), file=sys.stderr)
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        ratio = result['median'] / before['median'] if before['median'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance and result['median'] - before['median'] > NOISE_FLOOR:
+            regressed.append(name)
+            flag = '  slower'
+        print('%-28s %11.2f %11.2f %7.2f%s' % (name, before['median'] * 1000, result['median'] * 1000, ratio, flag),
+              file=sys.stderr)
+    return regressed
+
+
+# --- Import-time budget ---
+
+# Modules that only reports and charts may load.
+HEAVY_MODULES = ('pandas', 'matplotlib', 'pyarrow')
+
+# name -> (code run in a scratch directory, import-time budget in ms)
+IMPORT_CHECKS = {
+    'core add/list': ('''
+import core
+core.add_transaction('2024-01-01', 'Groceries', '-12.50', 'import check')
+list(core.get_transactions())
+core.page_transactions()
+core.calculate_net_savings()
+core.get_category_totals()
+''', 250),
+    'web index': ('''
+import web
+web.app.test_client().get('/')
+''', 600),
+}
+
+
+def import_times(code, cwd):
+    """Runs `code` under -X importtime; returns {top-level module: cumulative microseconds}."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd, env=env,
+                            capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented under the module that triggered them.
+        if not name[1:].startswith(' '):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def check_imports(slack=1.0):
+    """Runs IMPORT_CHECKS; prints a line per check and returns the names that failed."""
+    failed = []
+    for name, (code, budget_ms) in IMPORT_CHECKS.items():
+        with tempfile.TemporaryDirectory(prefix='finance-imports-') as workdir:
+            os.makedirs(os.path.join(workdir, 'data'))
+            times = import_times(code, workdir)
+        total_ms = sum(times.values()) / 1000
+        heavy = sorted(module for module in times if module.split('.')[0] in HEAVY_MODULES)
+        ok = not heavy and total_ms <= budget_ms * slack
+        if not ok:
+            failed.append(name)
+        print('%-4s %-16s %7.1f ms (budget %d ms)%s' % (
+            'ok' if ok else 'FAIL', name, total_ms, budget_ms * slack,
+            '; loads ' + ', '.join(heavy) if heavy else ''))
+    return failed
+
+
+# --- Concurrent writers ---
+
+def _stress_worker(path, worker, threads, rows, group_commit, barrier):
+    from ledger import Ledger
+
+    ledger = Ledger(path)
+    ledger.group_commit = group_commit
+
+    def write(thread):
+        for i in range(rows):
+            tag = 'w%d-t%d-%d' % (worker, thread, i)
+            txn_id = ledger.append(['2024-01-01', 'Stress', '1.00', tag])
+            if not ledger.update(txn_id, ['2024-01-01', 'Stress', '2.00', tag]):
+                raise RuntimeError('row %d (%s) vanished before its update' % (txn_id, tag))
+
+    barrier.wait()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(write, range(threads)))
+
+
+def stress(processes, threads, rows, group_commit):
+    """Runs one stress round on a fresh ledger; returns a JSON-ready result."""
+    from ledger import Ledger
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(prefix='finance-stress-') as workdir:
+        path = os.path.join(workdir, 'transactions.csv')
+        barrier = context.Barrier(processes + 1)
+        workers = [context.Process(target=_stress_worker,
+                                   args=(path, worker, threads, rows, group_commit, barrier))
+                   for worker in range(processes)]
+        for worker in workers:
+            worker.start()
+        barrier.wait()  # time the writes, not interpreter startup
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        found = Ledger(path).rows()
+    expected = {'w%d-t%d-%d' % (w, t, i) for w in range(processes) for t in range(threads) for i in range(rows)}
+    tags = [row[3] for row in found]
+    writes = 2 * len(expected)
+    return {
+        'group_commit': group_commit,
+        'seconds': elapsed,
+        'writes_per_second': writes / elapsed,
+        'failed_workers': sum(1 for worker in workers if worker.exitcode),
+        'missing': len(expected - set(tags)),
+        'duplicates': len(tags) - len(set(tags)),
+        'lost_updates': sum(1 for row in found if row[2] != '2.00'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate', help='write a synthetic ledger')
+    generate.add_argument('--rows', type=int, default=100000)
+    generate.add_argument('--seed', type=int, default=0)
+    generate.add_argument('--format', choices=sorted(WRITERS), default='ledger')
+    generate.add_argument('--out', required=True)
+    run = commands.add_parser('run', help='time the storage and reporting paths')
+    run.add_argument('--rows', type=int, default=100000)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--repeat', type=int, default=5)
+    run.add_argument('--only', help='run only the benchmarks whose name contains this')
+    run.add_argument('--out', help='also write the JSON results here')
+    run.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    run.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    imports = commands.add_parser('imports', help='check what the everyday paths import, and how fast')
+    imports.add_argument('--slack', type=float, default=1.0, help='multiplies every import-time budget')
+    stress_test = commands.add_parser('stress', help='concurrent writers on one ledger file')
+    stress_test.add_argument('--processes', type=int, default=4)
+    stress_test.add_argument('--threads', type=int, default=4, help='writer threads per process')
+    stress_test.add_argument('--rows', type=int, default=200, help='rows each thread appends, then updates')
+    args = parser.parse_args(argv)
+
+    if args.command == 'stress':
+        results = [stress(args.processes, args.threads, args.rows, group_commit)
+                   for group_commit in (False, True)]
+        print(json.dumps(results, indent=2))
+        broken = any(r['failed_workers'] or r['missing'] or r['duplicates'] or r['lost_updates'] for r in results)
+        return 1 if broken else 0
+    if args.command == 'imports':
+        return 1 if check_imports(args.slack) else 0
+    if args.command == 'generate':
+        WRITERS[args.format](args.out, synthetic_batches(args.rows, args.seed))
+        return 0
+    results = run_suite(args.rows, args.seed, args.repeat, args.only)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as file:
+            file.write(text + '\n')
+    if args.baseline:
+        with open(args.baseline) as file:
+            if compare(results, json.load(file), args.tolerance):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# app/budgets.py
+
+import collections
+import threading
+
+from money import from_cents, to_cents
+
+THRESHOLDS = (0.8, 1.0)
+
+
+class BudgetEngine:
+    """Monthly per-category budgets checked against a transaction store.
+
+    Spend for a (month, category) is the size of its net amount, read from
+    the store's running month/category totals, so checking a month costs
+    the same however long the history is. The engine listens to the
+    store's writes: for each budgeted (month, category) a write touched it
+    works out the spend before and after from the rows that changed, and
+    raises an alert for every threshold crossed on the way up.
+    """
+
+    def __init__(self, storage, budget_store, thresholds=THRESHOLDS, max_alerts=100):
+        self.storage = storage
+        self.budget_store = budget_store  # where budgets are kept, see SQLiteStorage.set_budget
+        self.thresholds = tuple(sorted(thresholds))
+        self.alerts = collections.deque(maxlen=max_alerts)
+        self.subscribers = []  # called with each alert dict as it is raised
+        self._lock = threading.Lock()
+        storage.listeners.append(self.changed)
+
+    # --- Budgets ---
+
+    def budgets(self):
+        """Returns {category: monthly budget in cents}.
+
+        Read from the budget store on every call, not cached: the CLI or
+        another worker process may have set a budget since. The table has a
+        row per budgeted category, so this is one small indexed read.
+        """
+        return {category: to_cents(amount) for category, amount in self.budget_store.budgets().items()
+                if to_cents(amount)}
+
+    def set_budget(self, category, amount):
+        self.budget_store.set_budget(category, amount)
+
+    # --- Budget vs. actual ---
+
+    def _spent(self, totals, category):
+        return abs(to_cents(totals.get(category, 0)))
+
+    def status(self, month):
+        """Returns budget vs. actual for each budgeted category in one 'YYYY-MM' month."""
+        totals = self.storage.month_category_totals(month)
+        status = []
+        for category, budget in sorted(self.budgets().items()):
+            spent = self._spent(totals, category)
+            status.append({
+                'category': category,
+                'budget': from_cents(budget),
+                'spent': from_cents(spent),
+                'remaining': from_cents(budget - spent),
+                'used': spent / budget,
+            })
+        return status
+
+    # --- Alerts ---
+
+    def changed(self, touched):
+        """Store listener: checks the thresholds for the (month, category) pairs a write touched."""
+        budgets = self.budgets()
+        deltas = {}
+        for old, new in touched:
+            for row, sign in ((old, -1), (new, 1)):
+                if row is None or row[1] not in budgets:
+                    continue
+                cents = to_cents(row[2])
+                if cents is not None:
+                    key = (str(row[0])[:7], row[1])
+                    deltas[key] = deltas.get(key, 0) + sign * cents
+        raised = []
+        for (month, category), delta in deltas.items():
+            if not delta:
+                continue
+            after = to_cents(self.storage.month_category_totals(month).get(category, 0))
+            before, after = abs(after - delta), abs(after)
+            budget = budgets[category]
+            for threshold in self.thresholds:
+                if before < threshold * budget <= after:
+                    raised.append({
+                        'month': month,
+                        'category': category,
+                        'threshold': threshold,
+                        'budget': from_cents(budget),
+                        'spent': from_cents(after),
+                    })
+        with self._lock:
+            self.alerts.extend(raised)
+        for alert in raised:
+            for subscriber in self.subscribers:
+                subscriber(alert)
+        return raised
+
+    def recent_alerts(self):
+        with self._lock:
+            return list(self.alerts)
@@ -0,0 +1,359 @@
+# app/charts.py
+
+import atexit
+import datetime
+import hashlib
+import html
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from money import from_cents, to_cents
+from records import date_ordinal
+
+# Charts render in a small pool of processes so a slow render never holds the
+# GIL (or a web thread's CPU) that form submissions need. 0 renders inline.
+CHART_WORKERS = int(os.environ.get('FINANCE_CHART_WORKERS', min(4, os.cpu_count() or 1)))
+# Renders allowed to be running or queued at once; past that render() raises
+# ChartBusy, which the web app turns into a 503 instead of piling up work.
+CHART_QUEUE_LIMIT = int(os.environ.get('FINANCE_CHART_QUEUE', max(CHART_WORKERS, 1) * 4))
+RENDER_TIMEOUT = 30
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(CHART_QUEUE_LIMIT)
+
+
+class ChartBusy(Exception):
+    """Raised when CHART_QUEUE_LIMIT renders are already in flight."""
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: forking a threaded web server can deadlock.
+                _pool = ProcessPoolExecutor(CHART_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+@atexit.register
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def render(func, *args):
+    """Runs a module-level render function in the chart pool and returns its bytes."""
+    if CHART_WORKERS <= 0:
+        return func(*args)
+    if not _slots.acquire(blocking=False):
+        raise ChartBusy()
+    try:
+        return _get_pool().submit(func, *args).result(timeout=RENDER_TIMEOUT)
+    finally:
+        _slots.release()
+
+
+def data_etag(*parts):
+    """Returns a short digest of the data a chart is drawn from."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+
+# --- Renderers ---
+# Module-level functions of plain data, so any of them can run in the pool.
+
+def _figure(**kwargs):
+    # Imported here so that only processes that actually draw load matplotlib.
+    from matplotlib.figure import Figure
+
+    # Figure objects carry their own state, unlike the pyplot state machine,
+    # so renders on different threads don't trample each other.
+    return Figure(**kwargs)
+
+
+def _save(fig, format, dpi=None, **kwargs):
+    buf = io.BytesIO()
+    fig.savefig(buf, format=format, dpi=dpi or 'figure', **kwargs)
+    return buf.getvalue()
+
+
+def _no_data(ax):
+    ax.text(0.5, 0.5, "No data", ha='center', va='center')
+    ax.set_axis_off()
+
+
+def _pie(ax, category_totals):
+    # Wedges need positive sizes; expenses are usually stored as negatives.
+    category_totals = {name: abs(total) for name, total in category_totals.items() if total}
+    if category_totals:
+        ax.pie(category_totals.values(), labels=category_totals.keys(), autopct='%1.1f%%', startangle=90)
+        ax.set_title("Spending by Category")
+    else:
+        _no_data(ax)
+
+
+def _monthly_bars(ax, monthly_totals):
+    if not monthly_totals:
+        _no_data(ax)
+        return
+    months, totals = list(monthly_totals), list(monthly_totals.values())
+    ax.bar(months, totals, color='skyblue', edgecolor='black', label='Net')
+    if len(totals) >= 3:
+        average = [sum(totals[max(0, i - 2):i + 1]) / len(totals[max(0, i - 2):i + 1]) for i in range(len(totals))]
+        ax.plot(months, average, color='tab:red', label='3-month average')
+    ax.set_title("Monthly Net")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Amount ($)")
+    ax.tick_params(axis='x', rotation=45)
+    ax.legend()
+
+
+def render_category_pie(category_totals, format='png', dpi=None):
+    fig = _figure()
+    _pie(fig.subplots(), category_totals)
+    return _save(fig, format, dpi)
+
+
+def render_monthly_bars(monthly_totals, format='png', dpi=None):
+    """Net amount per month, with its three-month moving average."""
+    fig = _figure(figsize=(10, 5), layout='tight')
+    _monthly_bars(fig.subplots(), monthly_totals)
+    return _save(fig, format, dpi)
+
+
+def render_cash_flow(monthly_flows, format='png', dpi=None):
+    """Income and expenses per month from {month: (income, expenses)}."""
+    fig = _figure(figsize=(10, 5), layout='tight')
+    ax = fig.subplots()
+    if monthly_flows:
+        months = list(monthly_flows)
+        ax.plot(months, [income for income, _ in monthly_flows.values()], label="Income", color='g', marker='o')
+        ax.plot(months, [abs(expenses) for _, expenses in monthly_flows.values()], label="Expenses", color='r', marker='o')
+        ax.set_title("Income and Expenses Over Time")
+        ax.set_xlabel("Month")
+        ax.set_ylabel("Amount ($)")
+        ax.tick_params(axis='x', rotation=45)
+        ax.grid(True)
+        ax.legend()
+    else:
+        _no_data(ax)
+    return _save(fig, format, dpi)
+
+
+def render_balance(balances, format='png', dpi=None):
+    """The balance at the end of each day from [(YYYY-MM-DD, balance)]."""
+    fig = _figure(figsize=(10, 5), layout='tight')
+    ax = fig.subplots()
+    if balances:
+        ax.plot([datetime.date.fromisoformat(date) for date, _ in balances], [total for _, total in balances])
+        ax.set_title("Balance")
+        ax.set_ylabel("Amount ($)")
+        ax.grid(True)
+        fig.autofmt_xdate()
+    else:
+        _no_data(ax)
+    return _save(fig, format, dpi)
+
+
+def render_spending_report(category_totals, monthly_totals, format='png', dpi=300):
+    """The category pie and monthly bars side by side, as core.plot_spending() draws them."""
+    fig = _figure(figsize=(14, 6), layout='tight')
+    ax1, ax2 = fig.subplots(1, 2)
+    _pie(ax1, category_totals)
+    _monthly_bars(ax2, monthly_totals)
+    fig.suptitle('Personal Finance Analysis', fontsize=16)
+    return _save(fig, format, dpi, bbox_inches='tight')
+
+
+# --- Report packs ---
+
+# Chart name -> (render function, the report_data() entry it draws).
+REPORT_CHARTS = {
+    'categories': (render_category_pie, 'category_totals'),
+    'monthly': (render_monthly_bars, 'monthly_totals'),
+    'cash_flow': (render_cash_flow, 'monthly_flows'),
+    'balance': (render_balance, 'balances'),
+}
+
+
+def report_data(storage, initial_balance=0.0, start_month=None, end_month=None, name='all'):
+    """Reads everything a report draws from `storage` in one pass over its running totals.
+
+    Months are 'YYYY-MM' and inclusive. The result is plain data, cheap to
+    send to the chart pool.
+    """
+    months = {month: total for month, total in storage.monthly_totals().items()
+              if date_ordinal(month + '-01')
+              and (start_month is None or month >= start_month) and (end_month is None or month <= end_month)}
+    flows, category_cents = {}, {}
+    for month in months:
+        totals = storage.month_category_totals(month)
+        flows[month] = (sum(total for total in totals.values() if total > 0),
+                        sum(total for total in totals.values() if total < 0))
+        for category, total in totals.items():
+            category_cents[category] = category_cents.get(category, 0) + to_cents(total)
+    if start_month is None and end_month is None:
+        category_totals = storage.category_totals()
+    else:
+        category_totals = {category: from_cents(total) for category, total in category_cents.items()}
+    start = start_month + '-01' if start_month else None
+    end = None
+    if end_month:
+        year, month = map(int, end_month.split('-'))
+        end = (datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)).isoformat()
+    return {
+        'name': name,
+        'start_month': start_month,
+        'end_month': end_month,
+        'initial_balance': initial_balance,
+        'category_totals': category_totals,
+        'monthly_totals': months,
+        'monthly_flows': flows,
+        'balances': [(date, initial_balance + total) for date, total in storage.daily_balances(start, end)],
+    }
+
+
+def render_reports(reports, formats=('png',), dpi=None, charts=None):
+    """Renders every chart of every report_data() dict in one batch.
+
+    All the renders go to the chart pool at once, so a pack of many
+    reports keeps every worker busy. Returns one {file name: bytes} dict
+    per report, e.g. 'categories.png'; 'html' in `formats` adds a
+    'report.html' page with the charts inline as SVG.
+    """
+    charts = list(charts or REPORT_CHARTS)
+    images = [format for format in formats if format != 'html']
+    if 'html' in formats and 'svg' not in images:
+        images.append('svg')
+    jobs = [(index, name, format) for index in range(len(reports)) for name in charts for format in images]
+
+    def job_args(index, name, format):
+        func, key = REPORT_CHARTS[name]
+        return func, reports[index][key], format, dpi
+
+    if CHART_WORKERS <= 0:
+        rendered = [func(*args) for func, *args in (job_args(*job) for job in jobs)]
+    else:
+        pool = _get_pool()
+        rendered = [future.result() for future in [pool.submit(*job_args(*job)) for job in jobs]]
+    files = [{} for _ in reports]
+    for (index, name, format), data in zip(jobs, rendered):
+        files[index]['%s.%s' % (name, format)] = data
+    for index, data in enumerate(reports):
+        if 'html' in formats:
+            files[index]['report.html'] = report_html(data, {name: files[index]['%s.svg' % name] for name in charts})
+        if 'svg' not in formats:
+            for name in charts:
+                files[index].pop('%s.svg' % name, None)
+    return files
+
+
+def report_html(data, svgs):
+    """Returns a standalone HTML page for one report_data() dict and its {chart name: SVG bytes}."""
+    period = data['name'] if data['start_month'] is None and data['end_month'] is None else '%s to %s' % (
+        data['start_month'] or 'start', data['end_month'] or 'now')
+    rows = ''.join('<tr><td>%s</td><td>%.2f</td></tr>' % (html.escape(str(category)), total)
+                   for category, total in sorted(data['category_totals'].items(), key=lambda item: item[1]))
+    parts = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>Finance report: %s</title>'
+             % html.escape(period), '<style>body{font-family:sans-serif;margin:2em}svg{max-width:100%;height:auto}'
+             'td{padding:0 1em}</style></head><body>', '<h1>Finance report: %s</h1>' % html.escape(period)]
+    if data['balances']:
+        parts.append('<p>Closing balance: %.2f</p>' % data['balances'][-1][1])
+    for name, svg in svgs.items():
+        # Drop the XML prolog and doctype so the SVG can sit inline.
+        text = svg.decode('utf-8')
+        parts.append('<section>%s</section>' % text[text.find('<svg'):])
+    parts.append('<h2>By category</h2><table>%s</table></body></html>' % rows)
+    return '\n'.join(parts).encode('utf-8')
+
+
+def write_reports(reports, directory, formats=('png',), dpi=None):
+    """Renders reports and writes each one's files to `directory`/<report name>/; returns the paths."""
+    paths = []
+    for data, files in zip(reports, render_reports(reports, formats, dpi)):
+        folder = os.path.join(directory, data['name'])
+        os.makedirs(folder, exist_ok=True)
+        for filename, content in files.items():
+            path = os.path.join(folder, filename)
+            with open(path, 'wb') as file:
+                file.write(content)
+            paths.append(path)
+    return paths
+
+
+class ChartCache:
+    """LRU cache of rendered chart bytes, bounded by entry count and total size.
+
+    Keys should include a data_etag() of the chart's input, so an entry is
+    only ever rebuilt after a write changed that input. Concurrent misses on
+    the same key wait for a single render instead of each starting one.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+                self.misses += 1
+        if not owner:
+            return future.result()
+        try:
+            data = render()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        self.put(key, data)
+        with self._lock:
+            del self._pending[key]
+        future.set_result(data)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,267 @@
+# app/cli.py
+"""Command-line interface for scripts, cron jobs and pipelines.
+
+    python app/cli.py add 2024-05-01 Groceries -42.10 "Weekly shop"
+    python app/cli.py import --format ndjson < transactions.ndjson
+    python app/cli.py export --start 2024-01-01 > 2024.csv
+    python app/cli.py query --category Groceries --format ndjson | jq .amount
+    python app/cli.py report --by month
+    python app/cli.py charts --by-month --format png --format html --out reports/
+
+Every command works on core.get_storage(), the same store as the GUI and
+the web app, or with --user NAME on that user's ledger. Input is read one record at a time and committed every
+--batch-size rows, and output is written a page at a time, so memory use
+does not grow with the size of the input or the ledger. Rows that fail
+validation are reported on stderr with their line number and skipped, and
+the exit status is then 1.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+import core
+import tenants
+from money import to_cents
+
+FIELDS = ('date', 'category', 'amount', 'description')
+BATCH_SIZE = 1000
+PAGE_SIZE = 1000
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def check_row(record):
+    """Returns [date, category, amount, description] from a dict, or raises InvalidRow."""
+    if not isinstance(record, dict):
+        raise InvalidRow('expected an object with %s' % ', '.join(FIELDS))
+    missing = [name for name in FIELDS if record.get(name) is None]
+    if missing:
+        raise InvalidRow('missing %s' % ', '.join(missing))
+    date = str(record['date'])
+    if not core.validate_date(date):
+        raise InvalidRow('invalid date %r, use YYYY-MM-DD' % date)
+    if to_cents(record['amount']) is None:
+        raise InvalidRow('invalid amount %r' % (record['amount'],))
+    return [date, str(record['category']), float(record['amount']), str(record['description'])]
+
+
+# --- Input ---
+
+def read_records(file, format):
+    """Yields (line number, dict or error string) for each record in a CSV or NDJSON stream."""
+    if format == 'csv':
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, 'invalid JSON: %s' % e
+
+
+def ingest(records, batch_size=BATCH_SIZE, errors=sys.stderr):
+    """Adds the valid rows of (line number, record) pairs, committing every `batch_size`.
+
+    Returns (added, rejected) counts.
+    """
+    added = rejected = 0
+    batch = []
+    for number, record in records:
+        try:
+            if isinstance(record, str):
+                raise InvalidRow(record)
+            batch.append(check_row(record))
+        except InvalidRow as e:
+            rejected += 1
+            print('line %d: %s' % (number, e), file=errors)
+            continue
+        if len(batch) >= batch_size:
+            added += len(core.apply_batch(creates=batch))
+            batch = []
+    if batch:
+        added += len(core.apply_batch(creates=batch))
+    return added, rejected
+
+
+# --- Output ---
+
+def iter_transactions(start=None, end=None, category=None, page_size=PAGE_SIZE):
+    """Yields matching (id, row) pairs, newest first, reading one page at a time."""
+    cursor = None
+    while True:
+        page = core.page_transactions(cursor, page_size, start, end, category)
+        yield from page
+        if len(page) < page_size:
+            return
+        cursor = (page[-1][1][0], page[-1][0])
+
+
+def write_rows(out, format, header, rows):
+    """Writes an iterable of equal-length tuples as text columns, CSV or NDJSON."""
+    if format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(header)
+        writer.writerows(rows)
+    elif format == 'ndjson':
+        for row in rows:
+            out.write(json.dumps(dict(zip(header, row))) + '\n')
+    else:
+        for row in rows:
+            out.write('  '.join(str(value) for value in row) + '\n')
+
+
+def amount(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+# --- Commands ---
+
+def cmd_add(args):
+    if args.date == '-':
+        return report_ingest(*ingest(read_records(sys.stdin, args.format), args.batch_size))
+    if None in (args.category, args.amount, args.description):
+        raise SystemExit('add needs DATE CATEGORY AMOUNT DESCRIPTION, or - to read rows from stdin')
+    try:
+        row = check_row(dict(zip(FIELDS, (args.date, args.category, args.amount, args.description))))
+    except InvalidRow as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(core.add_transaction(*row))
+    return 0
+
+
+def cmd_import(args):
+    if args.file == '-':
+        return report_ingest(*ingest(read_records(sys.stdin, args.format), args.batch_size))
+    with open(args.file, newline='', encoding='utf-8') as file:
+        return report_ingest(*ingest(read_records(file, args.format), args.batch_size))
+
+
+def report_ingest(added, rejected):
+    print('added %d, rejected %d' % (added, rejected), file=sys.stderr)
+    return 1 if rejected else 0
+
+
+def cmd_export(args):
+    rows = ((row[0], row[1], amount(row[2]), row[3])
+            for _, row in iter_transactions(args.start, args.end, args.category))
+    write_rows(sys.stdout, args.format, FIELDS, rows)
+    return 0
+
+
+def cmd_query(args):
+    rows = ((txn_id, row[0], row[1], amount(row[2]), row[3])
+            for txn_id, row in iter_transactions(args.start, args.end, args.category))
+    if args.limit is not None:
+        rows = (row for row, _ in zip(rows, range(args.limit)))
+    write_rows(sys.stdout, args.format, ('id',) + FIELDS, rows)
+    return 0
+
+
+def cmd_report(args):
+    if args.by == 'month':
+        totals = core.get_monthly_totals().items()
+    else:
+        totals = sorted(core.get_category_totals().items(), key=lambda item: item[1])
+    write_rows(sys.stdout, args.format, (args.by, 'total'), ((key, round(total, 2)) for key, total in totals))
+    return 0
+
+
+def cmd_charts(args):
+    import charts
+
+    for name in ('start_month', 'end_month'):
+        value = getattr(args, name)
+        if value is not None and not core.validate_date(value + '-01'):
+            raise SystemExit('invalid --%s %r, use YYYY-MM' % (name.replace('_', '-'), value))
+    reports = core.build_reports(args.start_month, args.end_month, args.by_month)
+    for path in charts.write_reports(reports, args.out, args.format or ['png'], args.dpi):
+        print(path)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--user', help="work on this user's ledger instead of the shared one")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='add one transaction, or stream them from stdin with -')
+    add.add_argument('date', help='YYYY-MM-DD, or - to read rows from stdin')
+    add.add_argument('category', nargs='?')
+    add.add_argument('amount', nargs='?')
+    add.add_argument('description', nargs='?')
+
+    imports = commands.add_parser('import', help='add transactions from a CSV or NDJSON file or stdin')
+    imports.add_argument('file', nargs='?', default='-', help='default: stdin')
+
+    for command in (add, imports):
+        command.add_argument('--format', choices=('csv', 'ndjson'), default='csv',
+                             help='CSV needs a date,category,amount,description header')
+        command.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per commit')
+
+    export = commands.add_parser('export', help='write transactions as CSV or NDJSON, newest first')
+    query = commands.add_parser('query', help='list matching transactions, newest first')
+    query.add_argument('--limit', type=int)
+    for command, default in ((export, 'csv'), (query, 'text')):
+        command.add_argument('--start', help='first date, YYYY-MM-DD')
+        command.add_argument('--end', help='last date, YYYY-MM-DD')
+        command.add_argument('--category')
+        command.add_argument('--format', choices=('text', 'csv', 'ndjson'), default=default)
+
+    report = commands.add_parser('report', help='net totals by month or category')
+    report.add_argument('--by', choices=('month', 'category'), default='month')
+    report.add_argument('--format', choices=('text', 'csv', 'ndjson'), default='text')
+
+    chart = commands.add_parser('charts', help='render report charts to files, headless')
+    chart.add_argument('--out', default='reports', help='directory, default: reports')
+    chart.add_argument('--format', action='append', choices=('png', 'svg', 'pdf', 'html'),
+                       help='repeat for several; default: png')
+    chart.add_argument('--start-month', help='YYYY-MM')
+    chart.add_argument('--end-month', help='YYYY-MM')
+    chart.add_argument('--by-month', action='store_true', help='one report per month instead of one for the range')
+    chart.add_argument('--dpi', type=int)
+    return parser
+
+
+COMMANDS = {
+    'add': cmd_add,
+    'import': cmd_import,
+    'export': cmd_export,
+    'query': cmd_query,
+    'report': cmd_report,
+    'charts': cmd_charts,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    for name in ('start', 'end'):
+        value = getattr(args, name, None)
+        if value is not None and not core.validate_date(value):
+            raise SystemExit('invalid --%s %r, use YYYY-MM-DD' % (name, value))
+    try:
+        with core.use_user(args.user):
+            return COMMANDS[args.command](args)
+    except tenants.InvalidUser as error:
+        raise SystemExit(str(error))
+    except BrokenPipeError:
+        # The reader went away (e.g. `| head`), which is not an error for us.
+        # Point stdout at devnull so the interpreter's final flush stays quiet.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+# app/columnar.py
+
+import functools
+import glob
+import hashlib
+import json
+import os
+import uuid
+
+import pandas as pd
+
+from ledger import file_lock
+
+COLUMNS = ["date", "amount", "category", "description"]
+MANIFEST = "_manifest.json"
+MAX_FILES_PER_PARTITION = 16
+
+
+@functools.lru_cache(maxsize=None)
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def month_keys(dates):
+    """Returns YYYYMM integers for a datetime Series (much cheaper than strftime)."""
+    return dates.dt.year * 100 + dates.dt.month
+
+
+def empty_frame():
+    return pd.DataFrame({
+        "date": pd.Series(dtype="datetime64[ns]"),
+        "amount": pd.Series(dtype="float64"),
+        "category": pd.Series(dtype="category"),
+        "description": pd.Series(dtype="object"),
+    })
+
+
+class ColumnarStore:
+    """Parquet copy of the transactions, one directory per month.
+
+    Columns are stored typed (datetime64 dates, float64 amounts, dictionary
+    encoded categories), so reads hand back ready-to-use frames and a month
+    range only opens the partitions inside it. The store mirrors a source
+    CSV; sync_from_csv() appends whatever was added to the CSV since the
+    last sync and rebuilds from scratch if the CSV was rewritten.
+    Needs pyarrow.
+
+    The manifest lists the files that make up each month, and readers
+    only open those. A sync writes its files first, then publishes them
+    all at once by replacing the manifest with os.replace, and only then
+    removes the files it superseded, so a reader sees the store before or
+    after a sync and never half of one. Syncs hold the source's
+    `<path>.lock` (see ledger.file_lock), so they neither overlap each
+    other nor read an append that is still being written.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    # --- Partitions ---
+
+    @staticmethod
+    def _months(files, start_month, end_month):
+        return sorted(month for month in files
+                      if (start_month is None or month >= start_month) and (end_month is None or month <= end_month))
+
+    def partitions(self, start_month=None, end_month=None):
+        """Returns the 'YYYY-MM' months present, limited to [start_month, end_month]."""
+        manifest = self._manifest()
+        return self._months(manifest["files"], start_month, end_month) if manifest else []
+
+    def read(self, start_month=None, end_month=None, columns=None):
+        for attempt in range(2):
+            manifest = self._manifest()
+            files = manifest["files"] if manifest else {}
+            try:
+                frames = [pd.read_parquet(os.path.join(self.root, "month=" + month, name), columns=columns)
+                          for month in self._months(files, start_month, end_month) for name in files[month]]
+                break
+            except FileNotFoundError:
+                # A sync replaced files after we read the manifest; the new one lists their successors.
+                if attempt:
+                    raise
+        if not frames:
+            df = empty_frame()
+            return df[columns] if columns else df
+        df = pd.concat(frames, ignore_index=True)
+        if "category" in df:
+            df["category"] = df["category"].astype("category")
+        return df
+
+    @staticmethod
+    def _write_file(directory, df):
+        # Written under a temporary name, so a part-*.parquet is always complete;
+        # it stays invisible to readers until a manifest lists it.
+        os.makedirs(directory, exist_ok=True)
+        name = "part-%s.parquet" % uuid.uuid4().hex
+        tmp_path = os.path.join(directory, ".%s.tmp" % name)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(directory, name))
+        return name
+
+    def _write_partitions(self, files, df):
+        """Adds df's rows to {month: [file names]} as new files; returns the paths that are no longer listed."""
+        df = df.dropna(subset=["date"])
+        superseded = []
+        for key, part in df.groupby(month_keys(df["date"])):
+            month = "%04d-%02d" % (key // 100, key % 100)
+            directory = os.path.join(self.root, "month=" + month)
+            part = part.reset_index(drop=True)
+            part["category"] = part["category"].astype("category")
+            names = files[month] = files.get(month, []) + [self._write_file(directory, part)]
+            if len(names) > MAX_FILES_PER_PARTITION:
+                # Small appends leave one file each; fold them back into one.
+                merged = pd.concat([pd.read_parquet(os.path.join(directory, name)) for name in names],
+                                   ignore_index=True)
+                merged["category"] = merged["category"].astype("category")
+                files[month] = [self._write_file(directory, merged)]
+                superseded.extend(os.path.join(directory, name) for name in names)
+        return superseded
+
+    # --- Syncing from CSV ---
+
+    def _manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # Stores from before the manifest listed its files are rebuilt.
+        return manifest if isinstance(manifest, dict) and "files" in manifest else None
+
+    @staticmethod
+    def _fingerprint(path, size):
+        # Hash of the bytes just before `size`, enough to tell an append from a rewrite.
+        with open(path, "rb") as f:
+            f.seek(max(size - 4096, 0))
+            return hashlib.sha1(f.read(min(size, 4096))).hexdigest()
+
+    @staticmethod
+    def _read_csv(source, date_format, chunksize):
+        for chunk in pd.read_csv(source, names=COLUMNS, header=None, usecols=range(4),
+                                 dtype={"date": str, "amount": "float64", "description": str},
+                                 chunksize=chunksize):
+            chunk["date"] = pd.to_datetime(chunk["date"], format=date_format, errors="coerce")
+            yield chunk
+
+    def sync_from_csv(self, csv_path, date_format, chunksize=200000):
+        """Brings the store up to date with csv_path (which has a header row)."""
+        if not os.path.exists(csv_path):
+            return
+        with file_lock(csv_path):
+            try:
+                size = os.path.getsize(csv_path)
+            except FileNotFoundError:
+                return
+            manifest = self._manifest()
+            if manifest and manifest["source_size"] == size \
+                    and manifest["fingerprint"] == self._fingerprint(csv_path, size):
+                return
+            if manifest and manifest["source_size"] < size \
+                    and manifest["fingerprint"] == self._fingerprint(csv_path, manifest["source_size"]):
+                files = dict(manifest["files"])
+                superseded = []
+                with open(csv_path, "rb") as f:
+                    f.seek(manifest["source_size"])
+                    for chunk in self._read_csv(f, date_format, chunksize):
+                        superseded += self._write_partitions(files, chunk)
+                self._publish(files, csv_path, size)
+                for path in superseded:
+                    os.remove(path)
+                return
+            self._rebuild(csv_path, date_format, chunksize)
+
+    def rebuild_from_csv(self, csv_path, date_format, chunksize=200000):
+        with file_lock(csv_path):
+            self._rebuild(csv_path, date_format, chunksize)
+
+    def _rebuild(self, csv_path, date_format, chunksize):
+        # The new files go in next to the old ones; the manifest swaps them in.
+        files = {}
+        size = os.path.getsize(csv_path)
+        with open(csv_path, "rb") as f:
+            f.readline()  # header
+            for chunk in self._read_csv(f, date_format, chunksize):
+                self._write_partitions(files, chunk)
+        self._publish(files, csv_path, size)
+        self._sweep(files)
+
+    def _publish(self, files, csv_path, size):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, ".%s.%s.tmp" % (MANIFEST, uuid.uuid4().hex))
+        with open(tmp_path, "w") as f:
+            json.dump({"source_size": size, "fingerprint": self._fingerprint(csv_path, size), "files": files}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.root, MANIFEST))
+
+    def _sweep(self, files):
+        # Removes whatever the manifest doesn't list: replaced files and leftovers of interrupted syncs.
+        for directory in glob.glob(os.path.join(self.root, "month=*")):
+            listed = set(files.get(os.path.basename(directory)[len("month="):], ()))
+            for name in os.listdir(directory):
+                if name not in listed:
+                    os.remove(os.path.join(directory, name))
+            if not listed:
+                os.rmdir(directory)
@@ -1,80 +1,197 @@
 # app/core.py
 
+import contextvars
 import csv
+import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
 import sqlite3
 
+# pandas and matplotlib (and columnar, which needs pandas) are imported by
+# the functions that use them: adding and listing transactions must not
+# pay for loading them.
+import metrics
+from budgets import BudgetEngine
+from ledger import Ledger, file_lock
+from money import CENTS, MAX_CENTS
+from recurring import RecurringDetector
+from storage import SQLiteStorage
+from tenants import ShardPool
+
 DATA_FILE = 'data/transactions.csv'
 INITIAL_BALANCE_FILE = 'data/initial_balance.txt'
 DB_FILE = 'finance.db'
-
+COLUMNAR_DIR = 'data/columnar'
+# Per-user shards, see tenants.py and use_user().
+USERS_DIR = 'data/users'
+# Where add_transaction & co. keep transactions: 'csv' (DATA_FILE) or 'sqlite' (DB_FILE).
+STORAGE_BACKEND = os.environ.get('FINANCE_STORAGE', 'csv')
+
+_stores = {}
+_stores_lock = threading.Lock()
+_singletons = {}
+_shards = None
+_current_shard = contextvars.ContextVar('finance_shard', default=None)
+
+def _get_store(cls, filename):
+    path = os.path.abspath(filename)
+    store = _stores.get((cls, path))
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault((cls, path), cls(path))
+    return store
+
+def _singleton(name, factory, *args):
+    """Returns the process-wide (or, inside use_user(), the user's) object `name`, made by factory(*args)."""
+    shard = _current_shard.get()
+    cache, lock = (shard.cache, shard.lock) if shard is not None else (_singletons, _stores_lock)
+    value = cache.get(name)
+    if value is None:
+        with lock:
+            value = cache.get(name)
+            if value is None:
+                value = cache[name] = factory(*args)
+    return value
+
+def get_shards():
+    """Returns the pool of per-user shards kept under USERS_DIR."""
+    global _shards
+    if _shards is None:
+        with _stores_lock:
+            if _shards is None:
+                _shards = ShardPool(os.path.abspath(USERS_DIR))
+    return _shards
+
+@contextmanager
+def use_user(user):
+    """Points get_storage(), the initial balance, budgets and the caches at `user`'s shard for the block.
+
+    With user None everything stays on the shared DATA_FILE/DB_FILE stores.
+    Raises tenants.InvalidUser for names that can't be a shard.
+    """
+    if user is None:
+        yield None
+        return
+    with get_shards().pinned(user) as shard:
+        token = _current_shard.set(shard)
+        try:
+            yield shard
+        finally:
+            _current_shard.reset(token)
+
+def get_ledger():
+    """Returns the ledger for DATA_FILE (or the current user's), creating it on first use."""
+    shard = _current_shard.get()
+    if shard is not None:
+        return shard.ledger()
+    return _get_store(Ledger, DATA_FILE)
+
+def get_sqlite_storage():
+    """Returns the SQLite storage for DB_FILE (or the current user's), creating it on first use."""
+    shard = _current_shard.get()
+    if shard is not None:
+        return shard.sqlite_storage()
+    return _get_store(SQLiteStorage, DB_FILE)
+
+def get_columnar_store():
+    """Returns the month-partitioned Parquet store kept in COLUMNAR_DIR."""
+    from columnar import ColumnarStore
+    return _get_store(ColumnarStore, COLUMNAR_DIR)
+
+def get_storage():
+    """Returns the transaction store used by the CLI, GUI and web app."""
+    if STORAGE_BACKEND == 'sqlite':
+        return get_sqlite_storage()
+    return get_ledger()
+
+@metrics.timed()
 def add_transaction(date, category, amount, description):
-    with open(DATA_FILE, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([date, category, amount, description])
+    return get_storage().append([date, category, amount, description])
 
+@metrics.timed()
 def get_transactions():
-    transactions = []
-    try:
-        with open(DATA_FILE, mode='r') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                transactions.append(row)
-    except FileNotFoundError:
-        pass
-    return transactions
+    """Returns every transaction as a record that also reads like a [date, category, amount, description] row."""
+    return get_storage().records()
+
+@metrics.timed()
+def list_transactions():
+    """Returns (id, [date, category, amount, description]) pairs for every transaction."""
+    return get_storage().items()
+
+@metrics.timed()
+def page_transactions(cursor=None, limit=50, start_date=None, end_date=None, category=None):
+    """Returns one page of (id, row) pairs, newest first; pass the last row's (date, id) as cursor."""
+    return get_storage().page(cursor, limit, start_date, end_date, category)
+
+@metrics.timed()
+def get_transaction(txn_id):
+    """Returns one transaction row by id, or None if there is no such row."""
+    return get_storage().get(txn_id)
+
+@metrics.timed()
+def apply_batch(creates=(), updates=(), deletes=()):
+    """Applies many changes at once, all or nothing; returns the ids of the created rows."""
+    return get_storage().apply_batch(creates, updates, deletes)
+
+@metrics.timed()
+def get_monthly_totals():
+    """Returns a dict of 'YYYY-MM' -> net amount, in month order."""
+    return get_storage().monthly_totals()
+
+def _initial_balance_file():
+    shard = _current_shard.get()
+    return shard.initial_balance_file if shard is not None else INITIAL_BALANCE_FILE
 
 def get_initial_balance():
     try:
-        with open(INITIAL_BALANCE_FILE, 'r') as f:
+        with open(_initial_balance_file(), 'r') as f:
             return float(f.read().strip())
     except (FileNotFoundError, ValueError):
         return 0.0
 
 def set_initial_balance(amount):
-    with open(INITIAL_BALANCE_FILE, 'w') as f:
+    path = _initial_balance_file()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
         f.write(str(amount))
 
+@metrics.timed()
 def calculate_net_savings():
-    transactions = get_transactions()
-    total = get_initial_balance()
-    for row in transactions:
-        try:
-            total += float(row[2])
-        except (ValueError, IndexError):
-            continue
-    return total
+    return get_initial_balance() + get_storage().net()
+
+@metrics.timed()
+def get_balance(date):
+    """Returns the balance at the end of a YYYY-MM-DD date: the initial balance plus every row up to it."""
+    return get_initial_balance() + get_storage().balance_through(date)
+
+@metrics.timed()
+def get_period_total(start_date, end_date):
+    """Returns the net amount of the rows dated from start_date to end_date, inclusive."""
+    return get_storage().total_between(start_date, end_date)
+
+def get_date_span():
+    """Returns the (first, last) YYYY-MM-DD dates that have transactions, or None if none do."""
+    return get_storage().date_span()
 
+@metrics.timed()
+def get_balance_history(start_date=None, end_date=None):
+    """Returns [(date, balance)] at the end of each day, by default from the first to the last transaction."""
+    initial = get_initial_balance()
+    return [(date, initial + total) for date, total in get_storage().daily_balances(start_date, end_date)]
+
+@metrics.timed()
 def get_category_totals():
     """Returns a dict of category -> total amount spent."""
-    transactions = get_transactions()
-    totals = {}
-    for row in transactions:
-        try:
-            category = row[1]
-            amount = float(row[2])
-            totals[category] = totals.get(category, 0) + amount
-        except (IndexError, ValueError):
-            continue
-    return totals
-
-def delete_transaction(index):
-    transactions = get_transactions()
-    if 0 <= index < len(transactions):
-        del transactions[index]
-        with open(DATA_FILE, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerows(transactions)
-
-def edit_transaction(index, date, category, amount, description):
-    transactions = get_transactions()
-    if 0 <= index < len(transactions):
-        transactions[index] = [date, category, amount, description]
-        with open(DATA_FILE, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerows(transactions)
+    return get_storage().category_totals()
+
+@metrics.timed()
+def delete_transaction(txn_id):
+    return get_storage().delete(txn_id)
+
+@metrics.timed()
+def edit_transaction(txn_id, date, category, amount, description):
+    return get_storage().update(txn_id, [date, category, amount, description])
 
 
 class CSV:
@@ -84,6 +201,7 @@ class CSV:
 
     @classmethod
     def initialize_csv(cls):
+        import pandas as pd
         try:
             pd.read_csv(cls.CSV_FILE)
         except FileNotFoundError:
@@ -98,20 +216,60 @@ class CSV:
             "category": category,
             "description": description,
         }
-        with open(cls.CSV_FILE, "a", newline="") as csvfile:
+        # Under the lock the columnar sync takes, so it never reads half a row.
+        with file_lock(cls.CSV_FILE), open(cls.CSV_FILE, "a", newline="") as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=cls.COLUMNS)
             writer.writerow(new_entry)
         print("Entry added successfully")
 
+    DTYPES = {"date": str, "amount": "float64", "category": "category", "description": str}
+    CHUNK_SIZE = 100000
+
+    @classmethod
+    def iter_chunks(cls, start_date, end_date, date_sorted=False, chunksize=CHUNK_SIZE):
+        """Yields DataFrames holding only the rows dated within [start_date, end_date].
+
+        Dates are datetime objects. The file is read chunk by chunk, so memory
+        stays bounded by the chunk size. With date_sorted=True reading stops at
+        the first chunk that runs past end_date.
+        """
+        import pandas as pd
+        try:
+            reader = pd.read_csv(cls.CSV_FILE, usecols=cls.COLUMNS, dtype=cls.DTYPES,
+                                 chunksize=chunksize)
+        except FileNotFoundError:
+            return
+        with reader:
+            for chunk in reader:
+                metrics.inc('finance_rows_scanned_total', len(chunk), source='csv')
+                chunk["date"] = pd.to_datetime(chunk["date"], format=cls.FORMAT, errors="coerce")
+                mask = (chunk["date"] >= start_date) & (chunk["date"] <= end_date)
+                if mask.any():
+                    yield chunk.loc[mask, cls.COLUMNS]
+                if date_sorted and chunk["date"].iloc[-1] > end_date:
+                    break
+
     @classmethod
-    def get_transactions(cls, start_date, end_date):
-        df = pd.read_csv(cls.CSV_FILE)
-        df["date"] = pd.to_datetime(df["date"], format=CSV.FORMAT)
+    def iter_rows(cls, start_date, end_date, date_sorted=False):
+        """Yields (date, amount, category, description) tuples within the date range."""
+        for chunk in cls.iter_chunks(start_date, end_date, date_sorted):
+            yield from chunk.itertuples(index=False, name=None)
+
+    @classmethod
+    @metrics.timed()
+    def query(cls, start_date, end_date, date_sorted=False):
+        """Returns a DataFrame built from only the chunks that matched the date range."""
+        import pandas as pd
+        chunks = list(cls.iter_chunks(start_date, end_date, date_sorted))
+        if not chunks:
+            return pd.DataFrame(columns=cls.COLUMNS).astype({"date": "datetime64[ns]", "amount": "float64"})
+        return pd.concat(chunks, ignore_index=True)
+
+    @classmethod
+    def get_transactions(cls, start_date, end_date, date_sorted=False):
         start_date = datetime.strptime(start_date, CSV.FORMAT)
         end_date = datetime.strptime(end_date, CSV.FORMAT)
-
-        mask = (df["date"] >= start_date) & (df["date"] <= end_date)
-        filtered_df = df.loc[mask]
+        filtered_df = cls.query(start_date, end_date, date_sorted)
 
         if filtered_df.empty:
             print("No transactions found in the given date range.")
@@ -149,6 +307,7 @@ def add():
 
 
 def plot_transactions(df):
+    import matplotlib.pyplot as plt
     df.set_index("date", inplace=True)
 
     income_df = (
@@ -200,32 +359,19 @@ def main():
 # --- SQL Database Utilities ---
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row  # Allows dictionary-style access
-    return conn
+    # A connection of the caller's own, outside the storage's pool; close it when done.
+    return get_sqlite_storage().connect()
 
 def init_db():
-    with get_db_connection() as conn:
-        conn.execute('''CREATE TABLE IF NOT EXISTS transactions
-                     (id INTEGER PRIMARY KEY, 
-                      date TEXT, 
-                      amount REAL, 
-                      category TEXT, 
-                      description TEXT,
-                      type TEXT)''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS budgets
-                     (category TEXT PRIMARY KEY, 
-                      amount REAL)''')
+    # Opening the first connection creates the tables and indexes.
+    with get_sqlite_storage().connection():
+        pass
 
 def add_transaction_sql(date, amount, category, description, type_):
     try:
         if not validate_date(date):
             raise ValueError("Invalid date format. Use YYYY-MM-DD")
-        with get_db_connection() as conn:
-            conn.execute('''
-                INSERT INTO transactions (date, amount, category, description, type)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (date, amount, category, description, type_))
+        get_sqlite_storage().append([date, category, amount, description], type_)
         return True
     except sqlite3.Error as e:
         print(f"Database error: {e}")
@@ -236,36 +382,60 @@ def add_transaction_sql(date, amount, category, description, type_):
 
 # --- Data Analysis Utilities ---
 
+@metrics.timed()
 def analyze_spending(df):
     # Group by category and sum amounts
     spending_by_category = df.groupby('category')['amount'].sum()
     # Calculate monthly trends
+    import pandas as pd
     df['date'] = pd.to_datetime(df['date'])
-    monthly_spending = df.resample('M', on='date')['amount'].sum()
+    monthly_spending = df.groupby(df['date'].dt.to_period('M'))['amount'].sum()
+    return spending_by_category, monthly_spending
+
+@metrics.timed()
+def spending_summary():
+    """Returns (spending_by_category, monthly_spending) like analyze_spending,
+    read from the SQLite rollups instead of scanning every transaction."""
+    import pandas as pd
+    storage = get_sqlite_storage()
+    spending_by_category = pd.Series(storage.category_totals(), name='amount', dtype='float64')
+    monthly = storage.monthly_totals()
+    monthly_spending = pd.Series(list(monthly.values()), name='amount', dtype='float64',
+                                 index=pd.PeriodIndex(list(monthly), freq='M', name='date'))
     return spending_by_category, monthly_spending
 
+def rebuild_rollups():
+    get_sqlite_storage().rebuild_rollups()
+
 # --- Visualization Utilities ---
 
-def plot_spending(spending_by_category, monthly_spending):
-    plt.style.use('ggplot')
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
-    # Pie chart improvements
-    spending_by_category.plot.pie(ax=ax1, autopct='%1.1f%%', 
-                                  startangle=90, shadow=True,
-                                  explode=[0.1]*len(spending_by_category))
-    ax1.set_title('Spending by Category', pad=20)
-    # Bar chart improvements
-    monthly_spending.plot.bar(ax=ax2, color='skyblue', edgecolor='black')
-    ax2.set_title('Monthly Spending', pad=20)
-    ax2.set_ylabel('Amount ($)')
-    ax2.set_xlabel('Month')
-    ax2.tick_params(axis='x', rotation=45)
-    plt.suptitle('Personal Finance Analysis', y=1.02, fontsize=16)
-    plt.tight_layout()
-    plt.savefig('spending_report.png', dpi=300, bbox_inches='tight')
-    plt.close()
+def plot_spending(spending_by_category, monthly_spending, filename='spending_report.png'):
+    """Writes the category pie and monthly bars side by side to `filename` (PNG, SVG or PDF by extension).
+
+    The chart renders headless in the chart pool; see charts.render_reports
+    for whole report packs.
+    """
+    import charts
+    format = os.path.splitext(filename)[1].lstrip('.').lower() or 'png'
+    image = charts.render(charts.render_spending_report,
+                          {str(key): float(value) for key, value in spending_by_category.items()},
+                          {str(key): float(value) for key, value in monthly_spending.items()}, format)
+    with open(filename, 'wb') as f:
+        f.write(image)
+
+def build_reports(start_month=None, end_month=None, by_month=False):
+    """Returns charts.report_data() dicts for get_storage(): one for the range, or one per month in it."""
+    import charts
+    storage, initial = get_storage(), get_initial_balance()
+    if not by_month:
+        name = '%s_%s' % (start_month or 'start', end_month or 'now') if start_month or end_month else 'all'
+        return [charts.report_data(storage, initial, start_month, end_month, name)]
+    months = [month for month in get_monthly_totals() if validate_date(month + '-01')
+              and (start_month is None or month >= start_month) and (end_month is None or month <= end_month)]
+    return [charts.report_data(storage, initial, month, month, month) for month in months]
 
 def spending_trend_analysis(df):
+    import matplotlib.pyplot as plt
     # Add moving averages, trend lines
     df['month'] = df['date'].dt.to_period('M')
     monthly = df.groupby('month')['amount'].sum()
@@ -280,51 +450,140 @@ def generate_savings_tips(df):
     top_categories = df.groupby('category')['amount'].sum().nlargest(3)
     for cat, amount in top_categories.items():
         tips.append(f"Consider reducing spending on {cat} (${amount:.2f} monthly)")
-    # Identify recurring subscriptions
-    subs = df[df['description'].str.contains('subscription', case=False)]
-    if not subs.empty:
-        tips.append(f"Review {len(subs)} subscriptions totaling ${subs['amount'].sum():.2f}")
+    # Identify recurring charges still being billed
+    detector = RecurringDetector()
+    detector.fit_frame(df)
+    subs = [s for s in detector.series() if s['active']]
+    if subs:
+        monthly = sum(abs(s['monthly_cost']) for s in subs)
+        tips.append(f"Review {len(subs)} recurring charges totaling ${monthly:.2f} a month")
     return tips
 
+def _watching_detector(storage):
+    detector = RecurringDetector(storage.rows)
+    storage.listeners.append(detector.changed)
+    return detector
+
+def get_recurring_detector():
+    """Returns the recurring-charge detector for get_storage(), kept current as it is written to."""
+    return _singleton('recurring_detector', _watching_detector, get_storage())
+
+def find_recurring(as_of=None):
+    """Returns the recurring series in get_storage(), biggest monthly cost first."""
+    return get_recurring_detector().series(as_of=as_of)
+
 # --- Budgeting Features ---
 
+def get_budget_engine():
+    """Returns the budget engine watching get_storage()'s writes, creating it on first use.
+
+    Budgets themselves are kept in the SQLite budgets table.
+    """
+    return _singleton('budget_engine', BudgetEngine, get_storage(), get_sqlite_storage())
+
 def set_budget(category, amount):
-    conn = sqlite3.connect('finance.db')
-    c = conn.cursor()
-    # Add budget table creation in init_db()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS budgets (category TEXT PRIMARY KEY, amount REAL)
-    ''')
-    c.execute('''
-        INSERT OR REPLACE INTO budgets (category, amount)
-        VALUES (?, ?)
-    ''', (category, amount))
-    conn.commit()
-    conn.close()
-
-def check_budget_vs_spending(df):
-    # Compare actual spending vs budgets
-    pass
+    get_budget_engine().set_budget(category, amount)
+
+def check_budget_vs_spending(month=None):
+    """Returns budget vs. actual per budgeted category for a 'YYYY-MM' month (default: this one)."""
+    return get_budget_engine().status(month or datetime.now().strftime('%Y-%m'))
 
 # --- Data Export/Import ---
 
-def load_transactions():
-    # Example: Load from the CSV file used by the CSV class
-    try:
-        df = pd.read_csv(CSV.CSV_FILE)
-        return df
-    except FileNotFoundError:
-        return pd.DataFrame(columns=CSV.COLUMNS)
+@metrics.timed()
+def load_transactions(start_month=None, end_month=None):
+    """Returns the CSV class's transactions as a typed DataFrame.
+
+    start_month/end_month are inclusive 'YYYY-MM' bounds. With pyarrow
+    installed the rows come from the month-partitioned columnar store
+    (synced from CSV.CSV_FILE first), so only the months asked for are read.
+    """
+    import pandas as pd
+
+    import columnar
+    if not os.path.exists(CSV.CSV_FILE):
+        return columnar.empty_frame()
+    if columnar.pyarrow_available():
+        store = get_columnar_store()
+        store.sync_from_csv(CSV.CSV_FILE, CSV.FORMAT)
+        return store.read(start_month, end_month)
+    df = pd.read_csv(CSV.CSV_FILE, usecols=CSV.COLUMNS, dtype=CSV.DTYPES)
+    df["date"] = pd.to_datetime(df["date"], format=CSV.FORMAT, errors="coerce")
+    if start_month or end_month:
+        months = columnar.month_keys(df["date"])
+        mask = pd.Series(True, index=df.index)
+        if start_month:
+            mask &= months >= int(start_month.replace("-", ""))
+        if end_month:
+            mask &= months <= int(end_month.replace("-", ""))
+        df = df[mask].reset_index(drop=True)
+    return df
 
 def export_to_csv(filename='transactions.csv'):
     df = load_transactions()
-    df.to_csv(filename, index=False)
-
-def import_from_csv(filename):
-    df = pd.read_csv(filename)
-    for _, row in df.iterrows():
-        add_transaction_sql(row['date'], row['amount'], 
-                            row['category'], row['description'], row['type'])
+    df.to_csv(filename, index=False, date_format=CSV.FORMAT)
+
+IMPORT_CHUNK_SIZE = 50000
+IMPORT_COLUMNS = ('date', 'category', 'amount', 'description')  # 'type' is optional
+
+def _estimate_csv_rows(filename, sample_size=65536):
+    with open(filename, 'rb') as f:
+        sample = f.read(sample_size)
+    return os.path.getsize(filename) * max(sample.count(b'\n'), 1) // max(len(sample), 1)
+
+@metrics.timed()
+def import_from_csv(filename, chunksize=IMPORT_CHUNK_SIZE):
+    """Bulk-loads a CSV export into the SQLite store as one transaction.
+
+    The file is read in chunks and validated a column at a time; a file
+    without the date, category, amount and description columns raises
+    ValueError before anything is written. Returns
+    (imported_count, rejected) where rejected is a DataFrame of the skipped
+    rows with their file line number and the reason.
+    """
+    import pandas as pd
+
+    missing = [name for name in IMPORT_COLUMNS if name not in pd.read_csv(filename, nrows=0).columns]
+    if missing:
+        raise ValueError('%s has no %s column' % (filename, ', '.join(missing)))
+    rejected = []
+
+    def batches():
+        line = 2  # first data row, after the header
+        for chunk in pd.read_csv(filename, chunksize=chunksize, dtype=str, keep_default_na=False):
+            chunk.index = range(line, line + len(chunk))
+            line += len(chunk)
+            if 'type' not in chunk:
+                chunk['type'] = ''
+            dates = pd.to_datetime(chunk['date'], format='%Y-%m-%d', errors='coerce')
+            amounts = pd.to_numeric(chunk['amount'], errors='coerce').replace([float('inf'), float('-inf')], float('nan'))
+            # Cents past int64 would wrap in the cast below; to_cents() refuses them too.
+            amounts = amounts.mask((amounts * CENTS).round().abs() >= float(MAX_CENTS + 1))
+            bad_date = dates.isna()
+            bad_amount = amounts.isna() & ~bad_date
+            if bad_date.any() or bad_amount.any():
+                bad = chunk[bad_date | bad_amount].copy()
+                bad['reason'] = 'invalid amount'
+                bad.loc[bad_date[bad_date | bad_amount], 'reason'] = 'invalid date'
+                rejected.append(bad)
+                good = ~(bad_date | bad_amount)
+                chunk, amounts = chunk[good], amounts[good]
+            cents = (amounts * CENTS).round().astype('int64')
+            yield list(zip(chunk['date'].tolist(), cents.tolist(), chunk['category'].tolist(),
+                           chunk['description'].tolist(), chunk['type'].tolist()))
+
+    metrics.inc('finance_bytes_read_total', os.path.getsize(filename), source='import')
+    storage = get_sqlite_storage()
+    # Rebuilding the indexes once is cheaper than maintaining them per row
+    # when the import is big next to what is already stored.
+    rebuild_indexes = _estimate_csv_rows(filename) > storage.count_hint() // 4
+    imported = storage.append_many(batches(), rebuild_indexes=rebuild_indexes)
+    metrics.inc('finance_rows_scanned_total', imported, source='import')
+    if rejected:
+        rejected = pd.concat(rejected).rename_axis('line').reset_index()
+    else:
+        rejected = pd.DataFrame(columns=['line', 'date', 'amount', 'category', 'description', 'type', 'reason'])
+    return imported, rejected
 
 # --- Date Validation Utility ---
 
@@ -349,16 +608,10 @@ def show_menu():
 
 # --- Test Data Generation Example ---
 
-def generate_test_data():
-    import numpy as np
-    categories = ['Groceries', 'Entertainment', 'Transport', 'Utilities']
-    descriptions = ['Weekly shop', 'Movie tickets', 'Bus pass', 'Electric bill']
-    for i in range(30):
-        date = f'2024-05-{i+1:02d}'
-        amount = round(np.random.uniform(5, 100), 2)
-        category = np.random.choice(categories)
-        desc = np.random.choice(descriptions)
-        add_transaction_sql(date, amount, category, desc, 'debit')
+def generate_test_data(rows=30, seed=None):
+    """Bulk-loads `rows` synthetic transactions into the SQLite store; see bench.synthetic_batches."""
+    import bench
+    return get_sqlite_storage().append_many(bench.sqlite_batches(bench.synthetic_batches(rows, seed)))
 
 
 def main():
@@ -384,6 +637,11 @@ def main():
 
 
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        # Subcommands (add, import, export, query, report) for scripts; see cli.py.
+        import cli
+        sys.exit(cli.main())
     init_db()  # Initialize the database
     main()
 
@@ -1,11 +1,9 @@
 import tkinter as tk
 from tkinter import messagebox
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.pyplot as plt
 
 # Use core.py implementations instead of dummy functions
 from core import (
-    add_transaction_sql as add_transaction,
+    add_transaction,
     get_category_totals,
     get_transactions,
     set_initial_balance,
@@ -13,6 +11,7 @@ from core import (
     get_initial_balance,
     delete_transaction,
     edit_transaction,
+    get_transaction,
 )
 
 def add_transaction_gui():
@@ -21,10 +20,18 @@ def add_transaction_gui():
         category = category_entry.get()
         amount = amount_entry.get()
         desc = desc_entry.get()
-        add_transaction(date, category, amount, desc)
+        try:
+            add_transaction(date, category, amount, desc)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         messagebox.showinfo("Success", "Transaction added!")
 
     def show_report():
+        # matplotlib is only loaded once a report is asked for.
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        import matplotlib.pyplot as plt
+
         category_totals = get_category_totals()
         if not category_totals:
             messagebox.showinfo("No Data", "No transactions to show.")
@@ -67,12 +74,10 @@ def add_transaction_gui():
 # --- Web: Flask app (from web.py) ---
 # --- Web: Flask app (from web.py) ---
 
-from flask import Flask, request, render_template_string, send_file
+from flask import Flask, request, render_template_string, send_file, abort
+from money import to_cents
 import io
 
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend for server environments
-
 app = Flask(__name__)
 
 TEMPLATE = """
@@ -102,8 +107,8 @@ TEMPLATE = """
   Category: <input name="category" type="text" value="{{ edit_data.category if edit_data else '' }}"><br>
   Amount: <input name="amount" type="number" step="0.01" value="{{ edit_data.amount if edit_data else '' }}"><br>
   Description: <input name="description" type="text" value="{{ edit_data.description if edit_data else '' }}"><br>
-  {% if edit_index is not none %}
-    <input type="hidden" name="edit_index" value="{{ edit_index }}">
+  {% if edit_id is not none %}
+    <input type="hidden" name="edit_id" value="{{ edit_id }}">
     <input type=submit value="Update">
     <a href="/" class="action-btn">Cancel</a>
   {% else %}
@@ -123,11 +128,11 @@ TEMPLATE = """
       <td>{{ t[3] }}</td>
       <td>
         <form method="post" action="/delete" style="display:inline;">
-          <input type="hidden" name="index" value="{{ loop.index0 }}">
+          <input type="hidden" name="id" value="{{ t[4] }}">
           <button type="submit" class="action-btn">Delete</button>
         </form>
         <form method="get" action="/edit" style="display:inline;">
-          <input type="hidden" name="index" value="{{ loop.index0 }}">
+          <input type="hidden" name="id" value="{{ t[4] }}">
           <button type="submit" class="action-btn">Edit</button>
         </form>
       </td>
@@ -149,15 +154,16 @@ def set_balance():
 
 @app.route('/delete', methods=['POST'])
 def delete():
-    index = int(request.form['index'])
-    delete_transaction(index)
+    txn_id = int(request.form['id'])
+    delete_transaction(txn_id)
     return '', 303, {'Location': '/'}
 
 @app.route('/edit', methods=['GET'])
 def edit():
-    index = int(request.args['index'])
-    transactions = get_transactions()
-    t = transactions[index]
+    txn_id = int(request.args['id'])
+    t = get_transaction(txn_id)
+    if t is None:
+        abort(404)
     edit_data = {
         'date': t[0],
         'category': t[1],
@@ -166,47 +172,53 @@ def edit():
     }
     net = calculate_net_savings()
     initial_balance = get_initial_balance()
+    transactions = get_transactions()
     # Format amounts as currency strings
     formatted_transactions = []
-    for i, t in enumerate(transactions):
+    for t in transactions:
         try:
             amount_str = "${:,.2f}".format(float(t[2]))
-        except (ValueError, IndexError):
+        except (TypeError, ValueError, IndexError):
             amount_str = t[2]
-        formatted_transactions.append([t[0], t[1], amount_str, t[3]])
+        formatted_transactions.append([t[0], t[1], amount_str, t[3], t.id])
     return render_template_string(
         TEMPLATE,
         net=net,
         transactions=formatted_transactions,
         edit_data=edit_data,
-        edit_index=index,
+        edit_id=txn_id,
         initial_balance=initial_balance
     )
 
 @app.route('/report.png')
 def report():
     # Generate pie chart using category totals
+    # A bare Figure needs no GUI backend and leaves pyplot's state alone.
+    from matplotlib.figure import Figure
+
     category_totals = get_category_totals()
-    fig, ax = plt.subplots()
+    fig = Figure()
+    ax = fig.subplots()
     if category_totals:
         ax.pie(category_totals.values(), labels=category_totals.keys(), autopct='%1.1f%%', startangle=90)
         ax.set_title("Spending by Category")
     else:
         ax.text(0.5, 0.5, "No data", ha='center', va='center')
     buf = io.BytesIO()
-    plt.savefig(buf, format='png')
+    fig.savefig(buf, format='png')
     buf.seek(0)
-    plt.close(fig)
     return send_file(buf, mimetype='image/png')
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        edit_index = request.form.get('edit_index')
-        if edit_index is not None and edit_index != '':
+        edit_id = request.form.get('edit_id')
+        if to_cents(request.form['amount']) is None:
+            abort(400, description='Invalid amount %r' % request.form['amount'])
+        if edit_id is not None and edit_id != '':
             # Edit transaction
             edit_transaction(
-                int(edit_index),
+                int(edit_id),
                 request.form['date'],
                 request.form['category'],
                 request.form['amount'],
@@ -228,15 +240,15 @@ def index():
     for t in transactions:
         try:
             amount_str = "${:,.2f}".format(float(t[2]))
-        except (ValueError, IndexError):
+        except (TypeError, ValueError, IndexError):
             amount_str = t[2]
-        formatted_transactions.append([t[0], t[1], amount_str, t[3]])
+        formatted_transactions.append([t[0], t[1], amount_str, t[3], t.id])
     return render_template_string(
         TEMPLATE,
         net=net,
         transactions=formatted_transactions,
         edit_data=None,
-        edit_index=None,
+        edit_id=None,
         initial_balance=initial_balance
     )
 
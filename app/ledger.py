@@ -0,0 +1,858 @@
+# app/ledger.py
+
+import bisect
+import csv
+import io
+import itertools
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, writers in one process only
+    fcntl = None
+
+import metrics
+from balances import DailyTotals
+from money import from_cents, sum_by_code, to_cents
+from records import (EPOCH_ORDINAL, ID_BITS, ID_MASK, TransactionList, TransactionTable, date_ordinal,
+                     date_text, order_key)
+
+log = logging.getLogger(__name__)
+
+# Every record in the transactions file is one of:
+#   date,category,amount,description       legacy row, id assigned in file order
+#   id,date,category,amount,description    insert or replacement of row `id`
+#   id                                     tombstone, row `id` was deleted
+# Edits and deletes only ever append; compaction drops the dead records.
+PUT = 'put'
+DELETE = 'delete'
+
+
+def parse_cents(row):
+    return to_cents(row[2]) if len(row) > 2 else None
+
+
+def normalize_row(fields):
+    row = [str(value) for value in fields[:4]]
+    if len(fields) > 4:
+        row[3] = ','.join(row[3:] + [str(value) for value in fields[4:]])
+    return row + [''] * (4 - len(row))
+
+
+def write_row(fields):
+    # Rows we write carry their amount rounded to cents, the same value the totals use.
+    row = normalize_row(fields)
+    cents = parse_cents(row)
+    if cents is not None:
+        row[2] = '%.2f' % from_cents(cents)
+    return row
+
+
+def parse_record(fields):
+    """Returns (kind, id, row) for one CSV record; id is None for legacy rows."""
+    if fields and fields[0].isdigit():
+        if len(fields) == 1:
+            return DELETE, int(fields[0]), None
+        if len(fields) == 5:
+            return PUT, int(fields[0]), fields[1:]
+    return PUT, None, normalize_row(fields)
+
+
+def encode_records(records):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(records)
+    return buf.getvalue().encode('utf-8')
+
+
+def iter_records(file, start=0):
+    """Yields (offset, end, fields) for each CSV record of a binary file from `start`."""
+    file.seek(start)
+    offset = start
+    pending = b''
+    for line in file:
+        pending += line
+        if pending.count(b'"') % 2:
+            continue  # newline inside a quoted field, the record goes on
+        end = offset + len(pending)
+        text = pending.decode('utf-8')
+        fields = next(csv.reader([text]), []) if text.strip() else []
+        yield offset, end, fields
+        offset = end
+        pending = b''
+
+
+@contextmanager
+def file_lock(path, exclusive=True):
+    """Holds the fcntl lock on `<path>.lock` that Ledger takes, for code that shares a file without a Ledger.
+
+    Each call opens the lock file anew, so it also excludes other threads;
+    don't take it for a path that a Ledger in this thread already holds.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'ab') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class RowIndex:
+    """Sidecar file mapping row id -> byte offset of the row's latest record.
+
+    Ids are dense, so the index is a flat array of 8-byte slots at
+    HEADER.size + id * 8 and a lookup is two seeks: one here, one in the
+    data file. The header records which data file (by inode) and how many
+    of its bytes are covered; anything appended since is indexed on the
+    next lookup, and a replaced data file triggers a rebuild.
+    """
+
+    HEADER = struct.Struct('<4s4xQQQ')  # magic, inode, covered bytes, next id
+    SLOT = struct.Struct('<q')  # offset + 1, 0 when the id has no live row
+    MAGIC = b'TXI1'
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.path = data_path + '.idx'
+
+    def _read_header(self, index_file):
+        index_file.seek(0)
+        raw = index_file.read(self.HEADER.size)
+        if len(raw) != self.HEADER.size:
+            return None
+        magic, inode, covered, next_id = self.HEADER.unpack(raw)
+        if magic != self.MAGIC:
+            return None
+        return inode, covered, next_id
+
+    def _write_slot(self, index_file, txn_id, offset):
+        index_file.seek(self.HEADER.size + txn_id * self.SLOT.size)
+        index_file.write(self.SLOT.pack(offset + 1 if offset is not None else 0))
+
+    def _index_records(self, index_file, data_file, covered, next_id):
+        for offset, end, fields in iter_records(data_file, covered):
+            if fields:
+                kind, txn_id, _ = parse_record(fields)
+                if txn_id is None:
+                    txn_id = next_id
+                next_id = max(next_id, txn_id + 1)
+                self._write_slot(index_file, txn_id, offset if kind == PUT else None)
+            covered = end
+        return covered, next_id
+
+    def rebuild(self):
+        """Rescans the whole data file into a fresh index, replaced atomically."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.idx-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w+b') as index_file, open(self.data_path, 'rb') as data_file:
+                inode = os.fstat(data_file.fileno()).st_ino
+                covered, next_id = self._index_records(index_file, data_file, 0, 0)
+                index_file.seek(0)
+                index_file.write(self.HEADER.pack(self.MAGIC, inode, covered, next_id))
+            shutil.copymode(self.data_path, tmp_path)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def note_many(self, entries):
+        """Records the (kind, id, offset, end) of records we just appended back to back.
+
+        Done only if the index is current up to the first of them, with one
+        open of the index and one header write however many there are.
+        """
+        if not entries:
+            return
+        try:
+            with open(self.path, 'r+b') as index_file:
+                header = self._read_header(index_file)
+                if header is None or header[1] != entries[0][2] or header[0] != os.stat(self.data_path).st_ino:
+                    return  # left for lookup() to catch up on
+                next_id = header[2]
+                for kind, txn_id, offset, _ in entries:
+                    self._write_slot(index_file, txn_id, offset if kind == PUT else None)
+                    next_id = max(next_id, txn_id + 1)
+                index_file.seek(0)
+                index_file.write(self.HEADER.pack(self.MAGIC, header[0], entries[-1][3], next_id))
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, txn_id):
+        """Returns the row stored under `txn_id` by reading only that record, or None."""
+        if txn_id < 0:
+            return None
+        for attempt in range(2):
+            try:
+                data_file = open(self.data_path, 'rb')
+            except FileNotFoundError:
+                return None
+            with data_file:
+                st = os.fstat(data_file.fileno())
+                try:
+                    index_file = open(self.path, 'r+b')
+                except FileNotFoundError:
+                    self.rebuild()
+                    continue
+                with index_file:
+                    header = self._read_header(index_file)
+                    if header is None or header[0] != st.st_ino or header[1] > st.st_size:
+                        index_file.close()
+                        self.rebuild()
+                        continue
+                    inode, covered, next_id = header
+                    if covered < st.st_size:
+                        covered, next_id = self._index_records(index_file, data_file, covered, next_id)
+                        index_file.seek(0)
+                        index_file.write(self.HEADER.pack(self.MAGIC, inode, covered, next_id))
+                    if txn_id >= next_id:
+                        return None
+                    index_file.seek(self.HEADER.size + txn_id * self.SLOT.size)
+                    raw = index_file.read(self.SLOT.size)
+                    slot = self.SLOT.unpack(raw)[0] if len(raw) == self.SLOT.size else 0
+                if not slot:
+                    return None
+                for _, _, fields in iter_records(data_file, slot - 1):
+                    kind, found_id, row = parse_record(fields)
+                    if kind == PUT and found_id in (txn_id, None):
+                        return list(row)
+                    break
+            self.rebuild()  # the slot pointed at the wrong record
+        return None
+
+
+class _WriteRequest:
+    __slots__ = ('creates', 'updates', 'deletes', 'created', 'error', 'leader', 'done')
+
+    def __init__(self, creates, updates, deletes):
+        self.creates = creates
+        self.updates = updates
+        self.deletes = deletes
+        self.created = None
+        self.error = None
+        self.leader = False
+        self.done = threading.Event()
+
+
+class Ledger:
+    """In-memory copy of a transactions CSV with running aggregates.
+
+    The file is parsed once. When it changes underneath us, records that
+    another process appended are replayed from where we left off, and a
+    rewritten file is re-read in full. Our own writes update the rows and
+    totals in place. Totals are kept in integer cents and handed back as
+    dollars. Rows are keyed by a stable id, and edits and deletes are
+    appended as journal records that a background compaction later folds
+    away. Rows live in a records.TransactionTable, column by column.
+
+    Processes sharing the file coordinate through an fcntl lock on
+    `<path>.lock`. Writes hold it exclusively, and reads of what others
+    wrote hold it shared. Writes are group-committed: whatever queues up
+    while one commit is in flight goes out in the next one, with a single
+    write and fsync for the whole group.
+    """
+
+    compact_min_garbage = 1000
+    compact_ratio = 0.5
+    compact_max_bytes = 64 * 1024 * 1024
+    durable = True  # fsync each commit
+    group_commit = True  # False commits every write on its own, for comparison
+    scan_workers = None  # processes for cold totals scans; None: scan.SCAN_WORKERS
+
+    def __init__(self, path):
+        self.path = path
+        self.index = RowIndex(path)
+        self.listeners = []  # called with [(old row, new row)] after each write
+        self._lock = threading.RLock()
+        self._stat = None
+        self._loaded = False
+        self._scanned = None  # (stat, scan.scan_totals() result) while nothing has loaded the rows
+        self._compacting = False
+        self._lock_file = None
+        self._lock_pid = None
+        self._lock_depth = 0
+        self._queue = []
+        self._queue_lock = threading.Lock()
+        self._committing = False
+        self._reset()
+
+    def _reset(self):
+        self._table = TransactionTable()
+        self._order = None  # sorted order_key() arrays, built on first page()
+        self._next_id = 0
+        self._record_count = 0
+        self._garbage = 0
+        self._net = 0
+        self._category_totals = {}
+        self._category_counts = {}
+        self._monthly_totals = {}
+        self._monthly_counts = {}
+        self._month_category_totals = {}  # {'YYYY-MM': {category: cents}}
+        self._month_category_counts = {}
+        self._days = DailyTotals()  # net cents per day, for balances at a date
+
+    def close(self):
+        """Drops the rows and closes the lock file; the ledger reloads if it is used again."""
+        with self._lock:
+            if self._lock_file is not None:
+                self._lock_file.close()
+            self._lock_file = self._lock_pid = None
+            self._reset()
+            self._stat = self._scanned = None
+            self._loaded = False
+
+    # --- Loading ---
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """Holds the cross-process lock; callers must hold self._lock."""
+        if fcntl is None or self._lock_depth:
+            # Nested: flock() on the same file would convert the lock we hold, not stack.
+            yield
+            return
+        if self._lock_pid != os.getpid():
+            # flock() locks belong to the open file, which a forked child shares with us.
+            self._lock_file = open(self.path + '.lock', 'ab')
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        stat = self._file_stat()
+        if self._loaded and stat == self._stat:
+            return
+        if stat is None:
+            self._load(None)
+            return
+        with self._file_lock(exclusive=False):
+            stat = self._file_stat()
+            if self._loaded and self._stat and stat and stat[2] == self._stat[2] and stat[1] > self._stat[1]:
+                self._catch_up(stat)
+            elif not self._loaded or stat != self._stat:
+                self._load(stat)
+
+    def _catch_up(self, stat):
+        """Replays the records appended to the file since we last read it."""
+        consumed = self._stat[1]
+        count = 0
+        with open(self.path, 'rb') as file:
+            for offset, end, fields in iter_records(file, consumed):
+                if end > stat[1]:
+                    break  # still being written by someone who doesn't take the lock
+                if fields:
+                    self._replay(*parse_record(fields))
+                    count += 1
+                consumed = end
+        # Anything short of stat's size is picked up by the next refresh.
+        self._stat = stat if consumed == stat[1] else (None, consumed, stat[2])
+        metrics.inc('finance_rows_scanned_total', count, source='ledger')
+
+    def _load(self, stat):
+        self._reset()
+        try:
+            with open(self.path, mode='r', newline='', encoding='utf-8') as file:
+                for fields in csv.reader(file):
+                    if fields:
+                        self._replay(*parse_record(fields), aggregate=False)
+        except FileNotFoundError:
+            pass
+        self._aggregate()
+        self._stat = stat
+        self._loaded = True
+        metrics.inc('finance_rows_scanned_total', self._record_count, source='ledger')
+        metrics.inc('finance_bytes_read_total', stat[1] if stat else 0, source='ledger')
+
+    def _aggregate(self):
+        # Totals for a fresh load are reduced in one go over the table's
+        # columns rather than row by row; later writes adjust them through
+        # _apply, as do the few rows the table keeps verbatim.
+        import numpy as np
+
+        table = self._table
+        codes = np.array(table.codes)
+        live = codes >= 0
+        if table.verbatim:
+            live[list(table.verbatim)] = False
+        codes = codes[live]
+        cents = np.array(table.cents)[live]
+        days = np.array(table.dates)[live].astype(np.int64) - EPOCH_ORDINAL
+        months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        self._net = int(cents.sum())
+        self._days.fit(np.array(table.dates)[live], cents)
+        # One reduction per (month, category) pair; the per-category and
+        # per-month totals are then summed from the pairs.
+        width = max(len(table.categories), 1)
+        pairs, inverse = np.unique(months * width + codes, return_inverse=True)
+        totals, counts = sum_by_code(inverse, cents, len(pairs))
+        for pair, total, count in zip(pairs.tolist(), totals, counts):
+            month, code = divmod(pair, width)
+            month = '%04d-%02d' % (1970 + month // 12, month % 12 + 1)
+            category = table.categories[code]
+            self._month_category_totals.setdefault(month, {})[category] = total
+            self._month_category_counts.setdefault(month, {})[category] = count
+            for totals_by, counts_by, key in ((self._category_totals, self._category_counts, category),
+                                              (self._monthly_totals, self._monthly_counts, month)):
+                totals_by[key] = totals_by.get(key, 0) + total
+                counts_by[key] = counts_by.get(key, 0) + count
+        for row in table.verbatim.values():
+            self._apply(row, 1)
+
+    def _replay(self, kind, txn_id, row, aggregate=True):
+        if txn_id is None:
+            txn_id = self._next_id
+        self._next_id = max(self._next_id, txn_id + 1)
+        self._record_count += 1
+        old = self._table.get(txn_id)
+        if old is not None:
+            if aggregate:
+                self._apply(old, -1)
+            self._unorder(txn_id, old)
+            self._garbage += 1
+        if kind == DELETE:
+            self._table.remove(txn_id)
+            self._garbage += 1
+        else:
+            self._table.put(txn_id, row)
+            if aggregate:
+                self._apply(row, 1)
+            self._reorder(txn_id, row)
+        return txn_id
+
+    def _apply(self, row, sign):
+        amount = parse_cents(row)
+        if amount is None:
+            return
+        self._net += sign * amount
+        self._bump(self._category_totals, self._category_counts, row[1], sign * amount, sign)
+        self._bump(self._monthly_totals, self._monthly_counts, row[0][:7], sign * amount, sign)
+        self._bump(self._month_category_totals.setdefault(row[0][:7], {}),
+                   self._month_category_counts.setdefault(row[0][:7], {}), row[1], sign * amount, sign)
+        ordinal = date_ordinal(row[0])
+        if ordinal:
+            self._days.add(ordinal, sign * amount, sign)
+
+    @staticmethod
+    def _bump(totals, counts, key, amount, sign):
+        count = counts.get(key, 0) + sign
+        if count:
+            counts[key] = count
+            totals[key] = totals.get(key, 0) + amount
+        else:
+            counts.pop(key, None)
+            totals.pop(key, None)
+
+    # --- Ordering ---
+
+    def _build_order(self):
+        import numpy as np
+
+        table = self._table
+        codes = np.array(table.codes)
+        ids = np.flatnonzero(codes >= 0)
+        keys = np.array(table.dates)[ids].astype(np.int64) << ID_BITS | ids
+        order = np.argsort(keys)
+        keys, codes = keys[order], codes[ids][order]
+        self._order = {None: array('q', keys.tobytes())}
+        by_code = np.argsort(codes, kind='stable')
+        for group in np.split(by_code, np.flatnonzero(np.diff(codes[by_code])) + 1):
+            if len(group):
+                self._order[table.categories[codes[group[0]]]] = array('q', keys[group].tobytes())
+
+    def _reorder(self, txn_id, row):
+        if self._order is not None:
+            for name in (None, row[1]):
+                bisect.insort(self._order.setdefault(name, array('q')), order_key(row[0], txn_id))
+
+    def _unorder(self, txn_id, row):
+        if self._order is not None:
+            for name in (None, row[1]):
+                keys = self._order[name]
+                del keys[bisect.bisect_left(keys, order_key(row[0], txn_id))]
+
+    # --- Reads ---
+
+    def rows(self):
+        with self._lock:
+            self._refresh()
+            return [self._table.get(txn_id) for txn_id in self._table.ids()]
+
+    def items(self):
+        """Returns (id, row) pairs for every live row, in id (and so file) order."""
+        with self._lock:
+            self._refresh()
+            return [(txn_id, self._table.get(txn_id)) for txn_id in self._table.ids()]
+
+    def records(self):
+        """Returns every live row as a TransactionList, unaffected by later writes."""
+        with self._lock:
+            self._refresh()
+            table = self._table.snapshot()
+        return TransactionList(table, array('q', table.ids()))
+
+    def page(self, cursor=None, limit=50, start_date=None, end_date=None, category=None):
+        """Returns up to `limit` (id, row) pairs, newest first by (date, id).
+
+        cursor is the (date, id) of the last row of the previous page. The
+        rows are found by bisecting a sorted key array, so any page costs
+        O(log n + limit) however deep it is.
+        """
+        with self._lock:
+            self._refresh()
+            if self._order is None:
+                self._build_order()
+            keys = self._order.get(category, ())
+            position = len(keys)
+            if end_date is not None:
+                position = bisect.bisect_right(keys, order_key(end_date, ID_MASK))
+            if cursor is not None:
+                position = min(position, bisect.bisect_left(keys, order_key(*cursor)))
+            lowest = order_key(start_date, 0) if start_date is not None else -1
+            page = []
+            while position > 0 and len(page) < limit:
+                position -= 1
+                if keys[position] < lowest:
+                    break
+                txn_id = keys[position] & ID_MASK
+                page.append((txn_id, self._table.get(txn_id)))
+            return page
+
+    def get(self, txn_id):
+        """Returns one row by id without loading the whole file when we can avoid it."""
+        with self._lock:
+            if self._loaded and self._file_stat() == self._stat:
+                return self._table.get(txn_id)
+        return self.index.lookup(txn_id)
+
+    def _scan_totals(self):
+        """Totals in cents straight from the file, for a ledger whose rows haven't been loaded.
+
+        Summaries are often all a process wants (a report from the CLI, a
+        cron job), and scan.scan_totals() gets them without building the
+        table. Once the rows are loaded the running totals are current and
+        this returns None, as it does when the scan can't read the file.
+        """
+        if self._loaded:
+            return None
+        stat = self._file_stat()
+        if stat is None:
+            return None
+        if self._scanned is None or self._scanned[0] != stat:
+            import scan
+
+            with self._file_lock(exclusive=False):
+                stat = self._file_stat()
+                self._scanned = (stat, scan.scan_totals(self.path, stat[1], self.scan_workers))
+        return self._scanned[1]
+
+    def net(self):
+        with self._lock:
+            scanned = self._scan_totals()
+            if scanned is not None:
+                return from_cents(scanned['net'])
+            self._refresh()
+            return from_cents(self._net)
+
+    def category_totals(self):
+        with self._lock:
+            scanned = self._scan_totals()
+            if scanned is None:
+                self._refresh()
+                totals = self._category_totals
+            else:
+                totals = scanned['category_totals']
+            return {name: from_cents(total) for name, total in totals.items()}
+
+    def monthly_totals(self):
+        """Returns {'YYYY-MM': net amount} in month order."""
+        with self._lock:
+            scanned = self._scan_totals()
+            if scanned is None:
+                self._refresh()
+                totals = self._monthly_totals
+            else:
+                totals = scanned['monthly_totals']
+            return {month: from_cents(total) for month, total in sorted(totals.items())}
+
+    def month_category_totals(self, month):
+        """Returns {category: net amount} for one 'YYYY-MM' month."""
+        with self._lock:
+            self._refresh()
+            return {name: from_cents(total) for name, total in self._month_category_totals.get(month, {}).items()}
+
+    # --- Balances ---
+    # Only rows dated YYYY-MM-DD within balances.FIRST_DATE..LAST_DATE are on the
+    # timeline; net() also counts the rest.
+
+    def balance_through(self, date):
+        """Returns the net amount of the rows dated on or before a YYYY-MM-DD `date`."""
+        with self._lock:
+            self._refresh()
+            return from_cents(self._days.through(date_ordinal(date)))
+
+    def total_between(self, start_date, end_date):
+        """Returns the net amount of the rows dated from `start_date` to `end_date`, inclusive."""
+        with self._lock:
+            self._refresh()
+            return from_cents(self._days.between(date_ordinal(start_date), date_ordinal(end_date)))
+
+    def date_span(self):
+        """Returns the (first, last) YYYY-MM-DD dates that have rows on the timeline, or None."""
+        with self._lock:
+            self._refresh()
+            span = self._days.span()
+        return (date_text(span[0]), date_text(span[1])) if span is not None else None
+
+    def daily_balances(self, start_date=None, end_date=None):
+        """Returns [(date, net amount through that day)] for every day in the range.
+
+        The range defaults to the first and last days that have rows.
+        """
+        with self._lock:
+            self._refresh()
+            span = self._days.span()
+            if span is None and (start_date is None or end_date is None):
+                return []
+            first = date_ordinal(start_date) if start_date is not None else span[0]
+            last = date_ordinal(end_date) if end_date is not None else span[1]
+            if not first or not last:
+                raise ValueError('dates must be YYYY-MM-DD')
+            curve = self._days.curve(first, last)
+        return [(date_text(first + day), from_cents(total)) for day, total in enumerate(curve)]
+
+    # --- Writes ---
+
+    def append(self, row):
+        return self._submit([row], (), ())[0]
+
+    def update(self, txn_id, row):
+        try:
+            self._submit((), [(txn_id, row)], ())
+        except KeyError:
+            return False
+        return True
+
+    def delete(self, txn_id):
+        try:
+            self._submit((), (), [txn_id])
+        except KeyError:
+            return False
+        return True
+
+    def apply_batch(self, creates=(), updates=(), deletes=()):
+        """Creates, updates ((id, row) pairs) and deletes rows with a single append.
+
+        Returns the new ids. Raises KeyError and writes nothing if an update
+        or delete names an id that is not live, and ValueError if an amount
+        isn't a finite number.
+        """
+        return self._submit(list(creates), list(updates), list(deletes))
+
+    def _submit(self, creates, updates, deletes):
+        """Queues one caller's changes and returns its new ids once they are on disk.
+
+        The caller that finds no commit in flight leads: it commits
+        everything queued so far, its own changes included. Callers that
+        arrive meanwhile wait. When the commit is done, the first of them
+        is woken to lead the next group.
+        """
+        # Checked before queueing: a row that can't be totalled never reaches the file.
+        for row in itertools.chain(creates, (row for _, row in updates)):
+            if len(row) < 3 or to_cents(row[2]) is None:
+                raise ValueError('invalid amount %r' % (row[2] if len(row) > 2 else None,))
+        request = _WriteRequest(creates, updates, deletes)
+        if not self.group_commit:
+            with self._lock:
+                self._commit([request])
+        else:
+            with self._queue_lock:
+                self._queue.append(request)
+                if not self._committing:
+                    self._committing = request.leader = True
+            if not request.leader:
+                request.done.wait()  # for our group's commit, or to lead the next one
+            if request.leader:
+                with self._queue_lock:
+                    group, self._queue = self._queue, []
+                try:
+                    self._commit(group)
+                finally:
+                    for member in group:
+                        member.done.set()
+                    with self._queue_lock:
+                        if self._queue:
+                            self._queue[0].leader = True
+                            self._queue[0].done.set()
+                        else:
+                            self._committing = False
+        if request.error is not None:
+            raise request.error
+        return request.created
+
+    def _commit(self, group):
+        """Validates each request against the current file and writes the valid ones as one append.
+
+        Listeners hear about the write once it is on disk and the locks are
+        released; one that fails is logged and doesn't fail the requests.
+        """
+        touched = None
+        try:
+            with self._lock, self._file_lock(exclusive=True):
+                self._refresh()
+                changes = []
+                next_id = self._next_id
+                deleted = set()
+                for request in group:
+                    gone = set()
+                    try:
+                        request_changes = []
+                        for txn_id, row in request.updates:
+                            if txn_id not in self._table or txn_id in deleted:
+                                raise KeyError(txn_id)
+                            request_changes.append((PUT, txn_id, write_row(row)))
+                        for txn_id in request.deletes:
+                            if txn_id not in self._table or txn_id in deleted or txn_id in gone:
+                                raise KeyError(txn_id)
+                            gone.add(txn_id)
+                            request_changes.append((DELETE, txn_id, None))
+                    except KeyError as e:
+                        request.error = e
+                        continue
+                    request.created = list(range(next_id, next_id + len(request.creates)))
+                    next_id += len(request.creates)
+                    request_changes.extend((PUT, txn_id, write_row(row))
+                                           for txn_id, row in zip(request.created, request.creates))
+                    deleted |= gone
+                    changes.extend(request_changes)
+                if changes:
+                    touched = self._write(changes)
+        except BaseException as e:
+            for request in group:
+                if request.error is None:
+                    request.error = e
+            if not isinstance(e, Exception):
+                raise
+        if touched:
+            self._notify(touched)
+
+    def _notify(self, touched):
+        for listener in self.listeners:
+            try:
+                listener(touched)
+            except Exception:
+                log.exception('ledger listener %r failed', listener)
+
+    def _write(self, changes):
+        """Appends and applies the changes; returns the (old row, new row) pairs for the listeners."""
+        chunks = [encode_records([[txn_id] if kind == DELETE else [txn_id] + row])
+                  for kind, txn_id, row in changes]
+        touched = []
+        if self.listeners:
+            latest = {}
+            for kind, txn_id, row in changes:
+                old = latest[txn_id] if txn_id in latest else self._table.get(txn_id)
+                latest[txn_id] = row
+                touched.append((old, row))
+        start = self._stat[1] if self._stat else 0
+        with open(self.path, mode='ab') as file:
+            file.write(b''.join(chunks))
+            if self.durable:
+                file.flush()
+                os.fsync(file.fileno())
+        stat = self._file_stat()
+        if stat is None or stat[1] != start + sum(len(chunk) for chunk in chunks):
+            # Someone else wrote to the file at the same time, so our view
+            # is stale; the reload picks up our records along with theirs.
+            self._load(stat)
+        else:
+            self._stat = stat
+            offset = start
+            noted = []
+            for (kind, txn_id, row), chunk in zip(changes, chunks):
+                self._replay(kind, txn_id, row)
+                noted.append((kind, txn_id, offset, offset + len(chunk)))
+                offset += len(chunk)
+            self.index.note_many(noted)
+        self._maybe_compact()
+        return touched
+
+    # --- Compaction ---
+
+    def _maybe_compact(self):
+        if self._compacting or self._garbage < self.compact_min_garbage:
+            return
+        size = self._stat[1] if self._stat else 0
+        if self._garbage >= self.compact_ratio * self._record_count or size >= self.compact_max_bytes:
+            self._compacting = True
+            threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """Rewrites the file with only live rows, replacing it atomically.
+
+        Writers keep appending to the old file while the snapshot is written;
+        whatever they appended meanwhile is copied over before the rename,
+        which happens under the exclusive file lock.
+        """
+        with self._lock:
+            self._refresh()
+            snapshot = [[txn_id] + self._table.get(txn_id) for txn_id in self._table.ids()]
+            if self._next_id - 1 not in self._table and self._next_id:
+                # Keep the highest id ever issued so it is never reused.
+                snapshot.append([self._next_id - 1])
+            markers = len(snapshot) - len(self._table)
+            snapshot_size = self._stat[1] if self._stat else 0
+            snapshot_inode = self._stat[2] if self._stat else None
+            snapshot_garbage = self._garbage
+            snapshot_count = self._record_count
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.compact-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(encode_records(snapshot))
+                with self._lock, self._file_lock(exclusive=True):
+                    # Records appended since the snapshot, by anyone, are copied over below.
+                    self._refresh()
+                    if self._stat is None or self._stat[2] != snapshot_inode:
+                        return False  # compacted by another process meanwhile
+                    with open(self.path, 'rb') as file:
+                        file.seek(snapshot_size)
+                        tmp.write(file.read())
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                    shutil.copymode(self.path, tmp_path)
+                    os.replace(tmp_path, self.path)
+                    self._stat = self._file_stat()
+                    self._garbage -= snapshot_garbage - markers
+                    self._record_count -= snapshot_count - len(snapshot)
+                    self._table.vacuum()
+            self.index.rebuild()
+            return True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,98 @@
+# app/loadtest.py
+"""Concurrent-user load test for the web app.
+
+Run the app (python app/web.py) and then, for example:
+
+    python app/loadtest.py http://127.0.0.1:5000 --users 16 --requests 50
+
+Each simulated user loops over a mix of page loads, chart fetches and form
+submissions; the adds change the category totals, so charts keep getting
+re-rendered while forms are being posted. Latency percentiles are printed
+per kind of request.
+"""
+
+import argparse
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CATEGORIES = ['Groceries', 'Rent', 'Transport', 'Utilities', 'Entertainment']
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def request(base_url, kind, rng):
+    if kind == 'add':
+        data = urllib.parse.urlencode({
+            'date': '2024-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)),
+            'category': rng.choice(CATEGORIES),
+            'amount': '%.2f' % -rng.uniform(1, 200),
+            'description': 'load test',
+        }).encode()
+        req = urllib.request.Request(base_url + '/', data=data)
+    elif kind == 'chart':
+        req = urllib.request.Request(base_url + '/report.png')
+    else:
+        req = urllib.request.Request(base_url + '/')
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return kind, status, time.perf_counter() - start
+
+
+def run(base_url, users, requests_per_user, mix, seed=0):
+    results = []
+    lock = threading.Lock()
+    kinds, weights = zip(*mix.items())
+
+    def user(n):
+        rng = random.Random(seed + n)
+        for _ in range(requests_per_user):
+            result = request(base_url, rng.choices(kinds, weights)[0], rng)
+            with lock:
+                results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(users) as pool:
+        list(pool.map(user, range(users)))
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed):
+    print('%-6s %6s %6s %9s %9s %9s' % ('kind', 'count', 'errors', 'p50 ms', 'p99 ms', 'max ms'))
+    for kind in sorted({r[0] for r in results}):
+        latencies = [r[2] * 1000 for r in results if r[0] == kind]
+        errors = sum(1 for r in results if r[0] == kind and r[1] >= 400)
+        print('%-6s %6d %6d %9.1f %9.1f %9.1f' % (
+            kind, len(latencies), errors, statistics.median(latencies),
+            percentile(latencies, 99), max(latencies)))
+    print('%d requests in %.1fs, %.1f req/s' % (len(results), elapsed, len(results) / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url', help='base URL of a running web app')
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50, help='requests per user')
+    parser.add_argument('--adds', type=float, default=0.2, help='share of form submissions')
+    parser.add_argument('--charts', type=float, default=0.4, help='share of chart fetches')
+    args = parser.parse_args(argv)
+    mix = {'add': args.adds, 'chart': args.charts, 'page': max(0.0, 1 - args.adds - args.charts)}
+    results, elapsed = run(args.url.rstrip('/'), args.users, args.requests, mix)
+    report(results, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# app/metrics.py
+"""Timers and counters for the hot paths, served in Prometheus text format.
+
+Instrumentation is off unless FINANCE_METRICS is set (to anything but 0)
+when the process starts. While it is off, timed() hands back the function
+it was given, timer() returns a shared no-op context manager and inc() and
+observe() return straight away, so the instrumented code runs as if the
+metrics weren't there.
+
+Per-request profiling is separate and also opt-in. It needs
+FINANCE_PROFILE set to a directory. Requests carrying ?profile=1 then run
+under cProfile and leave a .prof dump there, named after the endpoint.
+With FINANCE_PROFILE_ALL=1 every request is profiled.
+"""
+
+import contextlib
+import functools
+import os
+import threading
+import time
+
+ENABLED = os.environ.get('FINANCE_METRICS', '0') not in ('', '0')
+PROFILE_DIR = os.environ.get('FINANCE_PROFILE') or None
+PROFILE_ALL = os.environ.get('FINANCE_PROFILE_ALL', '0') not in ('', '0')
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+_help = {
+    'finance_call_seconds': 'Time spent in instrumented core functions.',
+    'finance_rows_scanned_total': 'Rows read from a store or file, by source.',
+    'finance_bytes_read_total': 'Bytes of files parsed, by source.',
+    'finance_http_request_seconds': 'Time spent handling requests, by endpoint.',
+    'finance_http_requests_total': 'Requests answered, by endpoint and status.',
+    'finance_template_render_seconds': 'Time spent rendering page templates.',
+    'finance_chart_render_seconds': 'Time spent rendering charts, including the wait for a worker.',
+    'finance_chart_cache_hits_total': 'Chart requests served from the chart cache.',
+    'finance_chart_cache_misses_total': 'Chart requests that had to render.',
+}
+_collectors = []  # callables returning [(name, type, labels dict, value)]
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# --- Recording ---
+
+def inc(name, value=1, **labels):
+    """Adds `value` to a counter."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Records one duration in a histogram."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def timer(name, **labels):
+    """Context manager that records how long its block took."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+def timed(name='finance_call_seconds', **labels):
+    """Decorator recording each call's duration, labelled with the function's name."""
+    def decorate(func):
+        if not ENABLED:
+            return func
+        call_labels = dict(labels, function=func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, **call_labels)
+        return wrapper
+    return decorate
+
+
+def describe(name, text):
+    """Sets the # HELP line of a metric."""
+    _help[name] = text
+
+
+def collect(func):
+    """Registers a callable whose [(name, type, labels, value)] samples are read at scrape time."""
+    if ENABLED:
+        _collectors.append(func)
+    return func
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# --- Exposition ---
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                             for key, value in pairs)
+
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(value)) for key, value in _histograms.items())
+    samples = {}  # name -> (type, [lines])
+    for (name, labels), value in counters:
+        samples.setdefault(name, ('counter', []))[1].append('%s%s %s' % (name, _labels(labels), value))
+    for (name, labels), histogram in histograms:
+        lines = samples.setdefault(name, ('histogram', []))[1]
+        running = 0
+        for bound, count in zip(BUCKETS, histogram):
+            running += count
+            lines.append('%s_bucket%s %d' % (name, _labels(labels, [('le', bound)]), running))
+        lines.append('%s_bucket%s %d' % (name, _labels(labels, [('le', '+Inf')]), histogram[-2]))
+        lines.append('%s_count%s %d' % (name, _labels(labels), histogram[-2]))
+        lines.append('%s_sum%s %r' % (name, _labels(labels), histogram[-1]))
+    for collector in _collectors:
+        for name, kind, labels, value in collector():
+            samples.setdefault(name, (kind, []))[1].append(
+                '%s%s %s' % (name, _labels(sorted(labels.items())), value))
+    out = []
+    for name in sorted(samples):
+        kind, lines = samples[name]
+        if name in _help:
+            out.append('# HELP %s %s' % (name, _help[name]))
+        out.append('# TYPE %s %s' % (name, kind))
+        out.extend(lines)
+    return '\n'.join(out) + '\n'
+
+
+# --- Flask ---
+
+def instrument(app):
+    """Adds request timing, GET /metrics and opt-in profiling to a Flask app.
+
+    Only what is switched on gets hooked in, so with metrics and profiling
+    both off the app is left untouched.
+    """
+    if ENABLED:
+        _instrument_requests(app)
+    if PROFILE_DIR:
+        _instrument_profiling(app)
+
+
+def _instrument_requests(app):
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unknown'
+            observe('finance_http_request_seconds', time.perf_counter() - start,
+                    endpoint=endpoint, method=request.method)
+            inc('finance_http_requests_total', endpoint=endpoint, status=response.status_code)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def _instrument_profiling(app):
+    import cProfile
+
+    from flask import g, request
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    @app.before_request
+    def start_profile():
+        if PROFILE_ALL or request.args.get('profile') == '1':
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def dump_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            path = os.path.join(PROFILE_DIR, '%s-%d.prof' % (request.endpoint or 'unknown', time.time_ns()))
+            profiler.dump_stats(path)
+            response.headers['X-Profile'] = os.path.basename(path)
+        return response
@@ -0,0 +1,60 @@
+# app/money.py
+"""Fixed-point money helpers.
+
+Stores keep amounts as integer cents so that long sums stay exact; float
+dollars only appear at the edges (parsing input, handing totals back).
+"""
+
+import math
+
+CENTS = 100
+MAX_CENTS = 2 ** 63 - 1  # what an int64 column (array('q'), numpy, SQLite INTEGER) holds
+
+
+def to_cents(value):
+    """Returns `value` (a number or numeric string) in whole cents, or None if it isn't one.
+
+    Amounts too large for an int64 of cents count as not a number, so every
+    store can hold whatever this accepts.
+    """
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(amount):
+        return None
+    cents = int(round(amount * CENTS))
+    return cents if -MAX_CENTS <= cents <= MAX_CENTS else None
+
+
+def from_cents(cents):
+    return cents / CENTS if cents is not None else None
+
+
+def sum_by_code(codes, cents, size):
+    """Returns (totals, counts) lists indexed by code for int codes in range(size).
+
+    Sums go through np.add.at on int64 (np.bincount would go through
+    float64 weights), so the totals stay exact.
+    """
+    import numpy as np
+
+    codes = np.asarray(codes, dtype=np.int64)
+    totals = np.zeros(size, dtype=np.int64)
+    np.add.at(totals, codes, np.asarray(cents, dtype=np.int64))
+    return totals.tolist(), np.bincount(codes, minlength=size).tolist()
+
+
+def group_cents(keys, cents):
+    """Returns {key: (total, count, min, max)} for parallel sequences of keys and cents."""
+    import numpy as np
+
+    codes = {}
+    coded = np.array([codes.setdefault(key, len(codes)) for key in keys], dtype=np.int64)
+    cents = np.asarray(cents, dtype=np.int64)
+    totals, counts = sum_by_code(coded, cents, len(codes))
+    lows = np.full(len(codes), np.iinfo(np.int64).max)
+    np.minimum.at(lows, coded, cents)
+    highs = np.full(len(codes), np.iinfo(np.int64).min)
+    np.maximum.at(highs, coded, cents)
+    return {key: group for key, group in zip(codes, zip(totals, counts, lows.tolist(), highs.tolist()))}
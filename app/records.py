@@ -0,0 +1,221 @@
+# app/records.py
+"""Compact in-memory transaction rows.
+
+A TransactionTable keeps each column in a typed array indexed by row id:
+dates as day ordinals, amounts as cents, categories as codes into one list
+of interned names, and descriptions as slices of one UTF-8 pool. A row
+costs 28 bytes plus its description instead of a list of four strings.
+Rows that would not come back out unchanged (a date that isn't
+YYYY-MM-DD, an amount with fractions of a cent) are also kept verbatim.
+"""
+
+import datetime
+import functools
+import itertools
+from array import array
+from collections.abc import Sequence
+
+from money import CENTS, to_cents
+
+ID_BITS = 40
+ID_MASK = (1 << ID_BITS) - 1
+EPOCH_ORDINAL = 719163  # date(1970, 1, 1).toordinal(), day 0 of datetime64
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def date_ordinal(text):
+    """Returns the day number of a YYYY-MM-DD date, or 0 for anything else."""
+    try:
+        day = datetime.date.fromisoformat(text)
+    except (TypeError, ValueError):
+        return 0
+    return day.toordinal() if day.isoformat() == text else 0
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def date_text(ordinal):
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+
+def order_key(date, txn_id):
+    """Packs (date, id) into one int; dates that aren't YYYY-MM-DD sort first."""
+    return date_ordinal(date) << ID_BITS | txn_id
+
+
+class Transaction:
+    """One transaction, read by attribute or, like a row list, by index."""
+
+    __slots__ = ('id', 'date', 'category', 'amount', 'description')
+
+    def __init__(self, txn_id, date, category, amount, description):
+        self.id = txn_id
+        self.date = date
+        self.category = category
+        self.amount = amount
+        self.description = description
+
+    @property
+    def cents(self):
+        return to_cents(self.amount)
+
+    def __getitem__(self, index):
+        return (self.date, self.category, self.amount, self.description)[index]
+
+    def __iter__(self):
+        return iter((self.date, self.category, self.amount, self.description))
+
+    def __len__(self):
+        return 4
+
+    def __repr__(self):
+        return 'Transaction(%r, %r, %r, %r, %r)' % (self.id, self.date, self.category, self.amount, self.description)
+
+
+class TransactionList(Sequence):
+    """Read-only list of Transaction records, each built when it is read."""
+
+    def __init__(self, table, ids):
+        self._table = table
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._table.record(txn_id) for txn_id in self._ids[index]]
+        return self._table.record(self._ids[index])
+
+    def __iter__(self):
+        return map(self._table.record, self._ids)
+
+
+class TransactionTable:
+    """Column arrays for [date, category, amount, description] rows keyed by dense ids."""
+
+    def __init__(self):
+        self.dates = array('i')  # day ordinal, 0 if not a YYYY-MM-DD date
+        self.cents = array('q')
+        self.codes = array('i')  # category code, -1 if the id has no live row
+        self.desc_start = array('q')
+        self.desc_length = array('i')
+        self.pool = bytearray()
+        self.categories = []
+        self.category_codes = {}
+        self.verbatim = {}
+        self.live = 0
+
+    def __len__(self):
+        return self.live
+
+    def __contains__(self, txn_id):
+        return 0 <= txn_id < len(self.codes) and self.codes[txn_id] >= 0
+
+    def ids(self):
+        """Iterates over the live ids in ascending order."""
+        return itertools.compress(range(len(self.codes)), map((0).__le__, self.codes))
+
+    def _grow(self, size):
+        missing = size - len(self.codes)
+        if missing > 0:
+            for column in (self.dates, self.cents, self.desc_start, self.desc_length):
+                column.extend(array(column.typecode, [0]) * missing)
+            self.codes.extend(array('i', [-1]) * missing)
+
+    def _code(self, category):
+        code = self.category_codes.get(category)
+        if code is None:
+            code = self.category_codes[category] = len(self.categories)
+            self.categories.append(category)
+        return code
+
+    def put(self, txn_id, row):
+        date, category, amount, description = row
+        ordinal = date_ordinal(date)
+        # Amounts to_cents() refuses (not a number, or past int64) are kept
+        # verbatim below and left out of the totals, as a load always has.
+        cents = to_cents(amount)
+        code = self.category_codes.get(category)
+        if code is None:
+            code = self._code(category)
+        encoded = description.encode('utf-8')
+        if txn_id == len(self.codes):
+            # New ids almost always come next in line, so appending is the common case.
+            self.live += 1
+            self.dates.append(ordinal)
+            self.cents.append(cents or 0)
+            self.codes.append(code)
+            self.desc_start.append(len(self.pool))
+            self.desc_length.append(len(encoded))
+        else:
+            self._grow(txn_id + 1)
+            if self.codes[txn_id] < 0:
+                self.live += 1
+            self.dates[txn_id] = ordinal
+            self.cents[txn_id] = cents or 0
+            self.codes[txn_id] = code
+            self.desc_start[txn_id] = len(self.pool)
+            self.desc_length[txn_id] = len(encoded)
+        self.pool += encoded
+        if ordinal and cents is not None and cents / CENTS == float(amount):
+            if self.verbatim:
+                self.verbatim.pop(txn_id, None)
+        else:
+            self.verbatim[txn_id] = list(row)
+
+    def remove(self, txn_id):
+        if txn_id in self:
+            self.codes[txn_id] = -1
+            self.verbatim.pop(txn_id, None)
+            self.live -= 1
+
+    def get(self, txn_id):
+        """Returns the row stored under `txn_id` as a new list, or None."""
+        if txn_id not in self:
+            return None
+        return list(self._fields(txn_id))
+
+    def record(self, txn_id):
+        if txn_id not in self:
+            return None
+        return Transaction(txn_id, *self._fields(txn_id))
+
+    def _fields(self, txn_id):
+        row = self.verbatim.get(txn_id)
+        if row is not None:
+            return row
+        start = self.desc_start[txn_id]
+        return (
+            date_text(self.dates[txn_id]),
+            self.categories[self.codes[txn_id]],
+            '%.2f' % (self.cents[txn_id] / CENTS),
+            self.pool[start:start + self.desc_length[txn_id]].decode('utf-8'),
+        )
+
+    def snapshot(self):
+        """Returns a copy that later writes to this table don't show up in.
+
+        The pool and category list are only ever appended to, so they are
+        shared rather than copied.
+        """
+        copy = TransactionTable()
+        for name in ('dates', 'cents', 'codes', 'desc_start', 'desc_length'):
+            setattr(copy, name, array(getattr(self, name).typecode, getattr(self, name)))
+        copy.pool = self.pool
+        copy.categories = self.categories
+        copy.category_codes = self.category_codes
+        copy.verbatim = dict(self.verbatim)
+        copy.live = self.live
+        return copy
+
+    def vacuum(self):
+        """Drops the descriptions of replaced and deleted rows from the pool."""
+        pool = bytearray()
+        desc_start = array('q', bytes(len(self.desc_start) * 8))
+        for txn_id in self.ids():
+            start = self.desc_start[txn_id]
+            desc_start[txn_id] = len(pool)
+            pool += self.pool[start:start + self.desc_length[txn_id]]
+        # New objects rather than edits in place, so snapshots keep reading the old ones.
+        self.pool = pool
+        self.desc_start = desc_start
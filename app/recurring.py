@@ -0,0 +1,214 @@
+# app/recurring.py
+"""Finds recurring charges: the same merchant and category, at a steady
+interval, for about the same amount.
+
+Transactions are grouped by (normalized description, category). Within a
+group, each interval between consecutive charges is classified as weekly,
+monthly or annual, and a charge counts toward a series when its interval
+has the same period as the one before and its amount is within
+AMOUNT_TOLERANCE of the previous charge. The series that a group is in now
+is the run of such charges ending at its latest one.
+
+fit() does this for a whole history with one sort and array passes, so it
+is O(n log n). Afterwards each group keeps only a small state (its last
+charge and the run ending there), which add() extends in O(1) for charges
+that arrive in date order.
+"""
+
+import datetime
+import functools
+import re
+import threading
+
+from money import from_cents, to_cents
+from records import EPOCH_ORDINAL, date_ordinal
+
+# Period code -> (name, shortest and longest interval in days, nominal length).
+PERIODS = {
+    1: ('weekly', 6, 8, 7),
+    2: ('monthly', 27, 34, 30.44),
+    3: ('annual', 358, 372, 365.25),
+}
+AMOUNT_TOLERANCE = 0.1
+MIN_OCCURRENCES = 3
+
+_NOT_LETTERS = re.compile(r'[^a-z]+')
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def normalize_merchant(description):
+    """'NETFLIX.COM 12/05 #8841' -> 'netflix com': letters only, first four words."""
+    return ' '.join(_NOT_LETTERS.sub(' ', str(description).lower()).split()[:4])
+
+
+def classify_gap(days):
+    for period, (_, shortest, longest, _) in PERIODS.items():
+        if shortest <= days <= longest:
+            return period
+    return 0
+
+
+def amounts_close(a, b):
+    return abs(a - b) <= AMOUNT_TOLERANCE * max(abs(a), abs(b))
+
+
+class RecurringDetector:
+    """Keeps the current series of every (merchant, category) group.
+
+    With a `source` (a callable returning [date, category, amount,
+    description] rows) the detector can refit itself; changed() is a store
+    listener that feeds new rows to add() and marks the state stale for
+    edits, deletes and back-dated rows, to be refit on the next query.
+    """
+
+    def __init__(self, source=None):
+        self.source = source
+        self._groups = {}  # key -> [last date, last cents, period, run intervals, run cents, run start]
+        self._lock = threading.Lock()
+        self._version = 0
+        self.stale = source is not None
+
+    # --- Fitting ---
+
+    def fit(self, dates, cents, keys):
+        """Rebuilds every group from parallel sequences of day ordinals, cents and group keys."""
+        import numpy as np
+
+        codes = {}
+        coded = np.array([codes.setdefault(key, len(codes)) for key in keys], dtype=np.int64)
+        dates = np.asarray(dates, dtype=np.int64)
+        cents = np.asarray(cents, dtype=np.int64)
+        order = np.lexsort((dates, coded))
+        coded, dates, cents = coded[order], dates[order], cents[order]
+        n = len(coded)
+        rows = np.arange(n)
+        same = np.zeros(n, dtype=bool)
+        same[1:] = coded[1:] == coded[:-1]
+        gaps = np.zeros(n, dtype=np.int64)
+        gaps[1:] = np.diff(dates)
+        periods = np.zeros(n, dtype=np.int64)
+        for period, (_, shortest, longest, _) in PERIODS.items():
+            periods[(gaps >= shortest) & (gaps <= longest)] = period
+        previous = np.roll(cents, 1)
+        close = np.abs(cents - previous) <= AMOUNT_TOLERANCE * np.maximum(np.abs(cents), np.abs(previous))
+        # ok: the interval ending at this row is a good one; continues: and
+        # so was the one before it, with the same period.
+        ok = same & (periods > 0) & close
+        continues = np.zeros(n, dtype=bool)
+        continues[1:] = ok[1:] & ok[:-1] & (periods[1:] == periods[:-1])
+        run_start = np.maximum.accumulate(np.where(continues, -1, np.where(ok, rows - 1, rows)))
+        totals = np.cumsum(cents)
+        last = np.flatnonzero(np.append(coded[1:] != coded[:-1], True)) if n else rows
+        start = run_start[last]
+        run_cents = totals[last] - totals[start] + cents[start]
+        names = list(codes)
+        groups = {}
+        for row, code, begin, total in zip(last.tolist(), coded[last].tolist(), start.tolist(), run_cents.tolist()):
+            groups[names[code]] = [int(dates[row]), int(cents[row]), int(periods[row]) if ok[row] else 0,
+                                   row - begin, total, int(dates[begin])]
+        with self._lock:
+            self._groups = groups
+
+    def fit_rows(self, rows):
+        """fit() over [date, category, amount, description] rows; rows that don't parse are skipped."""
+        dates, cents, keys = [], [], []
+        for row in rows:
+            ordinal, amount = date_ordinal(row[0]), to_cents(row[2])
+            if ordinal and amount is not None:
+                dates.append(ordinal)
+                cents.append(amount)
+                keys.append((normalize_merchant(row[3]), row[1]))
+        self.fit(dates, cents, keys)
+
+    def fit_frame(self, df):
+        """fit() over a DataFrame with datetime 'date', 'amount', 'category' and 'description' columns."""
+        import numpy as np
+
+        df = df.dropna(subset=['date', 'amount'])
+        dates = df['date'].values.astype('datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+        cents = (df['amount'] * 100).round().astype(np.int64)
+        keys = zip(df['description'].map(normalize_merchant).tolist(), df['category'].tolist())
+        self.fit(dates, cents, list(keys))
+
+    def refresh(self):
+        """Refits from `source` if writes since the last fit could not be applied in place."""
+        if not self.stale or self.source is None:
+            return
+        version = self._version
+        rows = self.source()
+        self.fit_rows(rows)
+        with self._lock:
+            # A write that landed while we were reading leaves us stale.
+            self.stale = self._version != version
+
+    # --- Incremental updates ---
+
+    def add(self, row):
+        """Extends a group with one new row; returns False (and marks the state stale) if it is back-dated."""
+        ordinal, amount = date_ordinal(row[0]), to_cents(row[2])
+        if not ordinal or amount is None:
+            return True
+        key = (normalize_merchant(row[3]), row[1])
+        with self._lock:
+            state = self._groups.get(key)
+            if state is None:
+                self._groups[key] = [ordinal, amount, 0, 0, amount, ordinal]
+                return True
+            last_date, last_cents, period, run, run_cents, start = state
+            if ordinal < last_date:
+                self.stale = True
+                return False
+            gap_period = classify_gap(ordinal - last_date)
+            if gap_period and amounts_close(amount, last_cents):
+                if run and gap_period == period:
+                    state[:] = [ordinal, amount, period, run + 1, run_cents + amount, start]
+                else:
+                    state[:] = [ordinal, amount, gap_period, 1, last_cents + amount, last_date]
+            else:
+                state[:] = [ordinal, amount, 0, 0, amount, ordinal]
+            return True
+
+    def changed(self, touched):
+        """Store listener: appends are added in place, anything else calls for a refit."""
+        with self._lock:
+            self._version += 1
+        for old, new in touched:
+            if old is not None or new is None:
+                with self._lock:
+                    self.stale = True
+            else:
+                self.add(new)
+
+    # --- Results ---
+
+    def series(self, min_occurrences=MIN_OCCURRENCES, as_of=None):
+        """Returns the groups currently recurring at least `min_occurrences` times.
+
+        Each is a dict with the merchant, category, period, average amount,
+        occurrences, first/last/next dates, monthly cost, and whether it is
+        still active on `as_of` (default today), i.e. not overdue.
+        """
+        self.refresh()
+        as_of = (as_of or datetime.date.today()).toordinal()
+        with self._lock:
+            groups = list(self._groups.items())
+        found = []
+        for (merchant, category), (last_date, _, period, run, run_cents, start) in groups:
+            if not period or run + 1 < min_occurrences:
+                continue
+            name, _, longest, nominal = PERIODS[period]
+            amount = run_cents / (run + 1)
+            found.append({
+                'merchant': merchant,
+                'category': category,
+                'period': name,
+                'amount': from_cents(round(amount)),
+                'occurrences': run + 1,
+                'first_date': datetime.date.fromordinal(start).isoformat(),
+                'last_date': datetime.date.fromordinal(last_date).isoformat(),
+                'next_date': datetime.date.fromordinal(last_date + round(nominal)).isoformat(),
+                'monthly_cost': from_cents(round(amount * 30.44 / nominal)),
+                'active': as_of <= last_date + longest,
+            })
+        found.sort(key=lambda s: (-abs(s['monthly_cost']), s['merchant']))
+        return found
@@ -0,0 +1,337 @@
+# app/scan.py
+"""Aggregate totals read straight from the ledger's transactions file.
+
+scan_totals() memory-maps the file and never builds a row. Record and
+field boundaries come from numpy over the raw bytes: a byte is inside a
+quoted field when an odd number of quote characters precede it, so the
+newlines and commas outside quotes are the separators. Only the id, date,
+category and amount fields are decoded, a block of records at a time, and
+descriptions are skipped entirely. Journal records resolve the way
+Ledger replays them: the last record for an id wins and a tombstone
+removes the row.
+
+Records the vectorized path can't read exactly (quoted or non-ASCII key
+fields, amounts that aren't plain decimals) go through csv and
+parse_record one at a time. A file whose quoting csv would read
+differently from the parity rule makes scan_totals() return None, and the
+caller falls back to a full load.
+
+Large files are split into blocks on record boundaries, and with workers
+> 1 (or FINANCE_SCAN_WORKERS) the blocks are parsed in a process pool.
+"""
+
+import csv
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from ledger import DELETE, parse_cents, parse_record
+from money import sum_by_code, to_cents
+
+SCAN_WORKERS = int(os.environ.get('FINANCE_SCAN_WORKERS', 0))
+BLOCK_BYTES = 16 * 1024 * 1024
+MAX_DIGITS = 15  # plain decimals up to this many digits convert to the same cents as to_cents()
+MAX_ID_DIGITS = 18
+MAX_CATEGORY_BYTES = 64
+
+QUOTE, COMMA, NEWLINE, RETURN = b'"'[0], b','[0], b'\n'[0], b'\r'[0]
+
+
+class Unreadable(Exception):
+    """The file's quoting isn't what csv.reader would make of the parity rule."""
+
+
+# --- Splitting ---
+
+def split_blocks(path, size, block_bytes=BLOCK_BYTES):
+    """Returns [(start, end)] byte ranges of about `block_bytes` that begin and end on record boundaries."""
+    import numpy as np
+
+    if size <= block_bytes:
+        return [(0, size)]
+    bounds = [0]
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as view:
+        data = np.frombuffer(view, dtype=np.uint8)
+        while size - bounds[-1] > block_bytes:
+            start = bounds[-1]
+            cut = view.find(b'\n', start + block_bytes)
+            # Records start with an even number of quotes behind them; a newline
+            # after an odd number is inside a quoted field.
+            quotes = int(np.count_nonzero(data[start:cut] == QUOTE)) if cut != -1 else 0
+            while cut != -1 and quotes % 2:
+                following = view.find(b'\n', cut + 1)
+                if following != -1:
+                    quotes += int(np.count_nonzero(data[cut:following] == QUOTE))
+                cut = following
+            if cut == -1:
+                break
+            bounds.append(cut + 1)
+        del data  # the map can't close while numpy holds a view of it
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+# --- Parsing ---
+
+def _gather(data, starts, lengths, width):
+    """Returns an (n, width) uint8 matrix of each field's first bytes, zero-padded, and its mask."""
+    import numpy as np
+
+    # Filled a column at a time, each column one contiguous row of the transpose.
+    matrix = np.empty((width, len(starts)), dtype=np.uint8)
+    present = np.empty((width, len(starts)), dtype=bool)
+    for offset in range(width):
+        np.greater(lengths, offset, out=present[offset])
+        np.multiply(data.take(starts + offset, mode='clip'), present[offset], out=matrix[offset])
+    return matrix.T, present.T
+
+
+def _strings(matrix):
+    import numpy as np
+
+    width = max(matrix.shape[1], 1)
+    matrix = np.ascontiguousarray(matrix if matrix.shape[1] else np.zeros((len(matrix), 1), np.uint8))
+    return matrix.view('S%d' % width).ravel()
+
+
+def _codes(matrix):
+    """Like np.unique(_strings(matrix), return_inverse=True), sorting 64-bit hashes instead of strings."""
+    import numpy as np
+
+    keys = np.zeros(len(matrix), dtype=np.uint64)
+    for column in matrix.T:
+        keys = (keys * np.uint64(1099511628211)) ^ column  # FNV-1, wrapping like it should
+    _, first, codes = np.unique(keys, return_index=True, return_inverse=True)
+    codes = codes.ravel()
+    if not (matrix[first][codes] == matrix).all():
+        values, codes = np.unique(_strings(matrix), return_inverse=True)  # two values hashed alike
+        return values.tolist(), codes.ravel()
+    return _strings(matrix[first]).tolist(), codes
+
+
+def _decimal_cents(matrix, lengths):
+    """Returns (cents, ok) for amounts of the form -?digits[.d[d]], exactly as to_cents() rounds them."""
+    import numpy as np
+
+    width = matrix.shape[1]
+    if not width:
+        return np.zeros(len(matrix), dtype=np.int64), np.zeros(len(matrix), dtype=bool)
+    offsets = np.arange(width)
+    inside = offsets < lengths[:, None]
+    negative = matrix[:, 0] == b'-'[0]
+    first = negative.astype(np.int64)
+    dots = (matrix == b'.'[0]) & inside
+    digits = (matrix >= b'0'[0]) & (matrix <= b'9'[0]) & inside
+    dot = np.where(dots.any(axis=1), dots.argmax(axis=1), lengths)
+    digit_count = digits.sum(axis=1)
+    ok = ((dots.sum(axis=1) <= 1)
+          & (digit_count + dots.sum(axis=1) + first == lengths)
+          & (dot > first) & (lengths - dot <= 3) & (digit_count <= MAX_DIGITS))
+    # Position j holds 10**(dot - j + 1) cents before the point and 10**(dot - j + 2) after it.
+    place = dot[:, None] - offsets + np.where(offsets < dot[:, None], 1, 2)
+    place = np.where(digits & ok[:, None], place, 0)
+    values = np.where(digits & ok[:, None], matrix.astype(np.int64) - b'0'[0], 0)
+    cents = (values * 10 ** np.arange(MAX_DIGITS + 2, dtype=np.int64)[place]).sum(axis=1)
+    return np.where(negative, -cents, cents), ok
+
+
+def _parse(data):
+    """Returns (ids, tombstones, cents, has_amount, category codes, categories, month codes, months).
+
+    ids is -1 for legacy rows, which get theirs from their place in the file.
+    """
+    import numpy as np
+
+    size = len(data)
+    if not size:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty.astype(bool), empty, empty.astype(bool), empty, [], empty, []
+    quotes = data == QUOTE
+    if quotes.any():
+        parity = np.bitwise_xor.accumulate(quotes.view(np.uint8))
+        if parity[-1]:
+            raise Unreadable('unbalanced quotes')
+        outside = parity == 0
+        positions = np.flatnonzero(quotes)
+        opening = parity[positions] == 1
+        before = np.where(positions > 0, data[np.maximum(positions - 1, 0)], NEWLINE)
+        after = np.where(positions + 1 < size, data[np.minimum(positions + 1, size - 1)], NEWLINE)
+        if not (np.isin(before[opening], (COMMA, NEWLINE, QUOTE)).all()
+                and np.isin(after[~opening], (COMMA, NEWLINE, RETURN, QUOTE)).all()):
+            raise Unreadable('quote inside an unquoted field')
+        del parity, positions, before, after, opening
+    else:
+        outside = np.ones(size, dtype=bool)
+    del quotes
+    returns = np.flatnonzero((data == RETURN) & outside)
+    if len(returns) and not (data[np.minimum(returns + 1, size - 1)] == NEWLINE)[returns + 1 < size].all():
+        raise Unreadable('carriage return without a newline')
+
+    newlines = np.flatnonzero((data == NEWLINE) & outside)
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [size]))
+    ends -= (ends > starts) & (data[np.maximum(ends - 1, 0)] == RETURN)
+    keep = ends > starts  # blank lines hold no record
+    starts, ends = starts[keep], ends[keep]
+    commas = np.concatenate((np.flatnonzero((data == COMMA) & outside), [size]))
+    del outside, newlines, keep
+
+    first_comma = np.searchsorted(commas, starts)
+    comma_count = np.searchsorted(commas, ends) - first_comma
+    last = len(commas) - 1
+
+    def field(k):
+        start = starts if k == 0 else np.where(
+            comma_count >= k, commas[np.minimum(first_comma + k - 1, last)] + 1, ends)
+        end = np.where(comma_count > k, commas[np.minimum(first_comma + k, last)], ends)
+        return start, end - start
+
+    fields = [field(k) for k in range(4)]
+    n = len(starts)
+    slow = np.zeros(n, dtype=bool)
+    for start, length in fields:
+        slow |= (length > 0) & (data[np.minimum(start, max(size - 1, 0))] == QUOTE)
+
+    head, present = _gather(data, *fields[0], int(min(fields[0][1].max(initial=0), MAX_ID_DIGITS + 1)))
+    is_digit = (head >= b'0'[0]) & (head <= b'9'[0])
+    numeric = (is_digit | ~present).all(axis=1) & (fields[0][1] > 0) & (fields[0][1] <= MAX_ID_DIGITS)
+    # Longer digit runs and non-ASCII bytes (str.isdigit() takes other scripts' digits) go to parse_record.
+    slow |= (head >= 0x80).any(axis=1) | ((fields[0][1] > MAX_ID_DIGITS) & is_digit.all(axis=1))
+    tombstones = numeric & (comma_count == 0)
+    explicit = numeric & (comma_count == 4)
+    ids = np.full(n, -1, dtype=np.int64)
+    ids[explicit | tombstones] = _strings(head[explicit | tombstones]).astype(np.int64)
+
+    def pick(k):
+        # Rows with an id carry date, category and amount one field later.
+        return (np.where(explicit, fields[k + 1][0], fields[k][0]),
+                np.where(explicit, fields[k + 1][1], fields[k][1]))
+
+    date_start, date_length = pick(0)
+    category_start, category_length = pick(1)
+    amount_start, amount_length = pick(2)
+
+    month_matrix, month_present = _gather(data, date_start, np.minimum(date_length, 7), 7)
+    slow |= ((month_matrix >= 0x80) | ((month_matrix == 0) & month_present)).any(axis=1)
+    width = int(min(category_length.max(initial=0), MAX_CATEGORY_BYTES))
+    category_matrix, category_present = _gather(data, category_start, category_length, width)
+    slow |= (category_length > MAX_CATEGORY_BYTES) | ((category_matrix == 0) & category_present).any(axis=1)
+    width = int(min(amount_length.max(initial=0), MAX_DIGITS + 2))
+    amount_matrix, _ = _gather(data, amount_start, amount_length, width)
+    cents, has_amount = _decimal_cents(amount_matrix, amount_length)
+    has_amount &= ~tombstones
+    # Anything else that might still be a number (' 5', '1e3', '+2') is left to to_cents().
+    odd_amounts = ~has_amount & (amount_length > 0) & ~tombstones & ~slow
+
+    categories, category_codes = _codes(category_matrix)
+    months, month_codes = _codes(month_matrix)
+    # Slow rows' bytes may not decode (a category cut mid-character); their entries go unused.
+    category_index = {value.decode('utf-8', 'surrogateescape'): code for code, value in enumerate(categories)}
+    month_index = {value.decode('utf-8', 'surrogateescape'): code for code, value in enumerate(months)}
+    category_codes = category_codes.astype(np.int64)
+    month_codes = month_codes.astype(np.int64)
+
+    for i in np.flatnonzero(odd_amounts).tolist():
+        amount = to_cents(bytes(data[amount_start[i]:amount_start[i] + amount_length[i]]).decode('utf-8'))
+        has_amount[i] = amount is not None
+        cents[i] = amount or 0
+    for i in np.flatnonzero(slow).tolist():
+        text = bytes(data[starts[i]:ends[i]]).decode('utf-8')
+        kind, txn_id, row = parse_record(next(csv.reader([text])))
+        ids[i] = -1 if txn_id is None else txn_id
+        tombstones[i] = kind == DELETE
+        amount = None if kind == DELETE else parse_cents(row)
+        has_amount[i] = amount is not None
+        cents[i] = amount or 0
+        if kind != DELETE:
+            category_codes[i] = category_index.setdefault(row[1], len(category_index))
+            month_codes[i] = month_index.setdefault(row[0][:7], len(month_index))
+    return (ids, tombstones, cents, has_amount, category_codes, list(category_index),
+            month_codes, list(month_index))
+
+
+def scan_block(path, start, end):
+    """Parses the records in bytes [start, end) of `path`; see _parse()."""
+    import numpy as np
+
+    if end <= start:
+        return _parse(np.zeros(0, dtype=np.uint8))
+    with open(path, 'rb') as file:
+        view = mmap.mmap(file.fileno(), end, access=mmap.ACCESS_READ)
+    # The map is unmapped once the last array over it (or a traceback holding one) is gone.
+    return _parse(np.frombuffer(view, dtype=np.uint8, count=end - start, offset=start))
+
+
+# --- Totals ---
+
+def _resolve(blocks):
+    """Concatenates parsed blocks and keeps each id's last record, as Ledger replay would."""
+    import numpy as np
+
+    category_index, month_index = {}, {}
+    columns = [[] for _ in range(6)]
+    for ids, tombstones, cents, has_amount, category_codes, categories, month_codes, months in blocks:
+        category_map = np.array([category_index.setdefault(name, len(category_index)) for name in categories],
+                                dtype=np.int64)
+        month_map = np.array([month_index.setdefault(name, len(month_index)) for name in months], dtype=np.int64)
+        for column, values in zip(columns, (ids, tombstones, cents, has_amount,
+                                            category_map[category_codes] if len(categories) else category_codes,
+                                            month_map[month_codes] if len(months) else month_codes)):
+            column.append(values)
+    ids, tombstones, cents, has_amount, category_codes, month_codes = (
+        np.concatenate(column) if column else np.zeros(0, dtype=np.int64) for column in columns)
+    tombstones = tombstones.astype(bool)
+    has_amount = has_amount.astype(bool)
+
+    # A legacy row takes the next id after every id seen before it, so with
+    # L legacy rows so far the next id is max(0, max(id + 1 - L at that id)) + L.
+    legacy = ids < 0
+    seen = np.cumsum(legacy)
+    floor = np.maximum.accumulate(np.where(legacy, np.iinfo(np.int64).min // 2, ids + 1 - seen))
+    ids = np.where(legacy, np.maximum(floor, 0) + seen - 1, ids)
+
+    _, from_end = np.unique(ids[::-1], return_index=True)
+    latest = len(ids) - 1 - from_end
+    latest = latest[~tombstones[latest]]
+    counted = latest[has_amount[latest]]
+    return (len(latest), cents[counted], category_codes[counted], list(category_index),
+            month_codes[counted], list(month_index))
+
+
+def _totals_by(codes, cents, names):
+    totals, counts = sum_by_code(codes, cents, len(names))
+    return {name: total for name, total, count in zip(names, totals, counts) if count}
+
+
+def scan_totals(path, size=None, workers=None, block_bytes=BLOCK_BYTES):
+    """Returns {'rows', 'net', 'category_totals', 'monthly_totals'} in cents, or None.
+
+    Only the first `size` bytes are read (default: the whole file), so a
+    caller holding the ledger lock can pin what it scans. None means the
+    file needs csv's reading of it; see the module docstring.
+    """
+    if workers is None:
+        workers = SCAN_WORKERS
+    if size is None:
+        size = os.path.getsize(path)
+    blocks = split_blocks(path, size, block_bytes)
+    try:
+        if workers > 1 and len(blocks) > 1:
+            with ProcessPoolExecutor(min(workers, len(blocks)),
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                parsed = list(pool.map(scan_block, [path] * len(blocks), *zip(*blocks)))
+        else:
+            parsed = [scan_block(path, start, end) for start, end in blocks]
+    except (Unreadable, UnicodeDecodeError):
+        return None
+    rows, cents, category_codes, categories, month_codes, months = _resolve(parsed)
+    metrics.inc('finance_rows_scanned_total', rows, source='scan')
+    metrics.inc('finance_bytes_read_total', size, source='scan')
+    return {
+        'rows': rows,
+        'net': int(cents.sum()),
+        'category_totals': _totals_by(category_codes, cents, categories),
+        'monthly_totals': dict(sorted(_totals_by(month_codes, cents, months).items())),
+    }
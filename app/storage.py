@@ -0,0 +1,634 @@
+# app/storage.py
+
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+from balances import FIRST_DATE, LAST_DATE, on_timeline
+from money import from_cents, group_cents, to_cents
+from records import Transaction, date_ordinal, date_text
+
+log = logging.getLogger(__name__)
+
+# Amounts are integer cents, so sums in SQL and in the rollups are exact.
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS transactions
+       (id INTEGER PRIMARY KEY,
+        date TEXT,
+        amount_cents INTEGER,
+        category TEXT,
+        description TEXT,
+        type TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS budgets
+       (category TEXT PRIMARY KEY,
+        amount_cents INTEGER)''',
+)
+
+# Databases from before the switch to cents hold REAL dollar `amount`
+# columns; their tables are copied over once and the rollups rebuilt.
+MIGRATE_TO_CENTS = {
+    'transactions': (
+        '''INSERT INTO transactions (id, date, amount_cents, category, description, type)
+           SELECT id, date, CAST(ROUND(amount * 100) AS INTEGER), category, description, type
+           FROM transactions_old'''),
+    'budgets': (
+        '''INSERT INTO budgets (category, amount_cents)
+           SELECT category, CAST(ROUND(amount * 100) AS INTEGER) FROM budgets_old'''),
+}
+
+# Monthly per-category/type aggregates, kept in step with `transactions` by
+# the triggers below so every write updates them in its own transaction.
+ROLLUP_TABLE = '''CREATE TABLE IF NOT EXISTS rollups
+       (month TEXT,
+        category TEXT,
+        type TEXT,
+        total_cents INTEGER,
+        count INTEGER,
+        min_cents INTEGER,
+        max_cents INTEGER,
+        PRIMARY KEY (month, category, type))'''
+
+_ROLLUP_ADD = '''
+        INSERT INTO rollups (month, category, type, total_cents, count, min_cents, max_cents)
+        VALUES (COALESCE(substr(NEW.date, 1, 7), ''), COALESCE(NEW.category, ''), COALESCE(NEW.type, ''),
+                NEW.amount_cents, 1, NEW.amount_cents, NEW.amount_cents)
+        ON CONFLICT (month, category, type) DO UPDATE SET
+            total_cents = total_cents + excluded.total_cents,
+            count = count + 1,
+            min_cents = MIN(min_cents, excluded.min_cents),
+            max_cents = MAX(max_cents, excluded.max_cents);'''
+
+# Removing a row that held the group's min or max means asking the
+# (category, date) index for the new extremes of that month only.
+_ROLLUP_REMOVE = '''
+        UPDATE rollups SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+        WHERE month = COALESCE(substr(OLD.date, 1, 7), '') AND category = COALESCE(OLD.category, '')
+          AND type = COALESCE(OLD.type, '');
+        UPDATE rollups SET
+            min_cents = (SELECT MIN(amount_cents) FROM transactions
+                          WHERE category IS OLD.category AND date >= substr(OLD.date, 1, 7)
+                            AND date < substr(OLD.date, 1, 7) || '~' AND COALESCE(type, '') = COALESCE(OLD.type, '')),
+            max_cents = (SELECT MAX(amount_cents) FROM transactions
+                          WHERE category IS OLD.category AND date >= substr(OLD.date, 1, 7)
+                            AND date < substr(OLD.date, 1, 7) || '~' AND COALESCE(type, '') = COALESCE(OLD.type, ''))
+        WHERE month = COALESCE(substr(OLD.date, 1, 7), '') AND category = COALESCE(OLD.category, '')
+          AND type = COALESCE(OLD.type, '') AND (OLD.amount_cents <= min_cents OR OLD.amount_cents >= max_cents);
+        DELETE FROM rollups
+        WHERE month = COALESCE(substr(OLD.date, 1, 7), '') AND category = COALESCE(OLD.category, '')
+          AND type = COALESCE(OLD.type, '') AND count <= 0;'''
+
+# Net cents per day and per month of the rows dated on the timeline (see
+# balances.py), as the ledger's DailyTotals counts them: a balance is then
+# whole months up to the date's month plus at most a month of days.
+DAY_TABLES = (
+    '''CREATE TABLE IF NOT EXISTS day_totals
+       (day TEXT PRIMARY KEY,
+        total_cents INTEGER,
+        count INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS month_totals
+       (month TEXT PRIMARY KEY,
+        total_cents INTEGER,
+        count INTEGER)''',
+)
+
+
+def _on_timeline(column):
+    # Same test as records.date_ordinal() and balances.on_timeline(): a real YYYY-MM-DD date
+    # in range. date(x) alone lets 2024-02-30 through; through julianday() it becomes 03-01.
+    return "date(julianday(%s)) IS %s AND %s BETWEEN '%s' AND '%s'" % (column, column, column, FIRST_DATE, LAST_DATE)
+
+
+_DAY_ADD = '''
+        INSERT INTO day_totals (day, total_cents, count) SELECT NEW.date, NEW.amount_cents, 1 WHERE %s
+        ON CONFLICT (day) DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;
+        INSERT INTO month_totals (month, total_cents, count) SELECT substr(NEW.date, 1, 7), NEW.amount_cents, 1
+        WHERE %s
+        ON CONFLICT (month) DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;''' % (
+    _on_timeline('NEW.date'), _on_timeline('NEW.date'))
+
+_DAY_REMOVE = '''
+        UPDATE day_totals SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+        WHERE day = OLD.date AND %s;
+        UPDATE month_totals SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+        WHERE month = substr(OLD.date, 1, 7) AND %s;
+        DELETE FROM day_totals WHERE day = OLD.date AND count <= 0;
+        DELETE FROM month_totals WHERE month = substr(OLD.date, 1, 7) AND count <= 0;''' % (
+    _on_timeline('OLD.date'), _on_timeline('OLD.date'))
+
+TRIGGERS = {
+    'days_after_insert':
+        'CREATE TRIGGER IF NOT EXISTS days_after_insert AFTER INSERT ON transactions BEGIN%s\n    END' % _DAY_ADD,
+    'days_after_delete':
+        'CREATE TRIGGER IF NOT EXISTS days_after_delete AFTER DELETE ON transactions BEGIN%s\n    END' % _DAY_REMOVE,
+    'days_after_update':
+        'CREATE TRIGGER IF NOT EXISTS days_after_update AFTER UPDATE OF date, amount_cents ON transactions BEGIN%s%s'
+        '\n    END' % (_DAY_REMOVE, _DAY_ADD),
+    'rollups_after_insert':
+        'CREATE TRIGGER IF NOT EXISTS rollups_after_insert AFTER INSERT ON transactions BEGIN%s\n    END'
+        % _ROLLUP_ADD,
+    'rollups_after_delete':
+        'CREATE TRIGGER IF NOT EXISTS rollups_after_delete AFTER DELETE ON transactions BEGIN%s\n    END'
+        % _ROLLUP_REMOVE,
+    'rollups_after_update':
+        'CREATE TRIGGER IF NOT EXISTS rollups_after_update AFTER UPDATE OF date, amount_cents, category, type '
+        'ON transactions BEGIN%s%s\n    END' % (_ROLLUP_REMOVE, _ROLLUP_ADD),
+}
+
+MERGE_ROLLUP = '''INSERT INTO rollups (month, category, type, total_cents, count, min_cents, max_cents)
+                  VALUES (?, ?, ?, ?, ?, ?, ?)
+                  ON CONFLICT (month, category, type) DO UPDATE SET
+                      total_cents = total_cents + excluded.total_cents,
+                      count = count + excluded.count,
+                      min_cents = MIN(min_cents, excluded.min_cents),
+                      max_cents = MAX(max_cents, excluded.max_cents)'''
+MERGE_DAY = '''INSERT INTO day_totals (day, total_cents, count) VALUES (?, ?, ?)
+               ON CONFLICT (day) DO UPDATE SET
+                   total_cents = total_cents + excluded.total_cents, count = count + excluded.count'''
+MERGE_MONTH = '''INSERT INTO month_totals (month, total_cents, count) VALUES (?, ?, ?)
+                 ON CONFLICT (month) DO UPDATE SET
+                     total_cents = total_cents + excluded.total_cents, count = count + excluded.count'''
+
+REBUILD_ROLLUPS = (
+    'DELETE FROM rollups',
+    '''INSERT INTO rollups (month, category, type, total_cents, count, min_cents, max_cents)
+       SELECT COALESCE(substr(date, 1, 7), ''), COALESCE(category, ''), COALESCE(type, ''),
+              SUM(amount_cents), COUNT(*), MIN(amount_cents), MAX(amount_cents)
+       FROM transactions GROUP BY 1, 2, 3''',
+    'DELETE FROM day_totals',
+    '''INSERT INTO day_totals (day, total_cents, count)
+       SELECT date, SUM(amount_cents), COUNT(*) FROM transactions WHERE %s GROUP BY date''' % _on_timeline('date'),
+    'DELETE FROM month_totals',
+    '''INSERT INTO month_totals (month, total_cents, count)
+       SELECT substr(day, 1, 7), SUM(total_cents), SUM(count) FROM day_totals GROUP BY 1''',
+)
+
+# (category, date) also serves lookups on category alone.
+INDEXES = {
+    'idx_transactions_date': 'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)',
+    'idx_transactions_category_date':
+        'CREATE INDEX IF NOT EXISTS idx_transactions_category_date ON transactions (category, date)',
+}
+
+# Statements are kept as constants so each pooled connection compiles them
+# once and then reuses them from its statement cache.
+SELECT_ROWS = 'SELECT id, date, category, amount_cents, description FROM transactions ORDER BY id'
+SELECT_ROW = 'SELECT date, category, amount_cents, description FROM transactions WHERE id = ?'
+INSERT_TRANSACTION = '''INSERT INTO transactions (date, amount_cents, category, description, type)
+                        VALUES (?, ?, ?, ?, ?)'''
+UPDATE_TRANSACTION = '''UPDATE transactions SET date = ?, category = ?, amount_cents = ?, description = ?
+                        WHERE id = ?'''
+DELETE_TRANSACTION = 'DELETE FROM transactions WHERE id = ?'
+SELECT_NET = 'SELECT COALESCE(SUM(total_cents), 0) FROM rollups'
+SELECT_CATEGORY_TOTALS = 'SELECT category, SUM(total_cents) FROM rollups GROUP BY category'
+SELECT_MONTHLY_TOTALS = 'SELECT month, SUM(total_cents) FROM rollups GROUP BY month ORDER BY month'
+SELECT_MONTH_CATEGORY_TOTALS = 'SELECT category, SUM(total_cents) FROM rollups WHERE month = ? GROUP BY category'
+SELECT_ROLLUPS = '''SELECT month, category, type, total_cents, count, min_cents, max_cents FROM rollups
+                    ORDER BY month, category, type'''
+SELECT_MONTH_ROLLUPS = '''SELECT month, category, type, total_cents, count, min_cents, max_cents FROM rollups
+                          WHERE month = ? ORDER BY category, type'''
+# Balances read the day and month totals: the months before the date's
+# month, then its days up to the date.
+SELECT_TOTAL_THROUGH = '''SELECT
+    (SELECT COALESCE(SUM(total_cents), 0) FROM month_totals WHERE month < substr(?1, 1, 7))
+    + (SELECT COALESCE(SUM(total_cents), 0) FROM day_totals WHERE day >= substr(?1, 1, 7) AND day <= ?1)'''
+SELECT_TOTAL_BEFORE = '''SELECT
+    (SELECT COALESCE(SUM(total_cents), 0) FROM month_totals WHERE month < substr(?1, 1, 7))
+    + (SELECT COALESCE(SUM(total_cents), 0) FROM day_totals WHERE day >= substr(?1, 1, 7) AND day < ?1)'''
+SELECT_DAILY_TOTALS = 'SELECT day, total_cents FROM day_totals WHERE day BETWEEN ? AND ? ORDER BY day'
+SELECT_DATE_SPAN = 'SELECT MIN(day), MAX(day) FROM day_totals'
+UPSERT_BUDGET = 'INSERT OR REPLACE INTO budgets (category, amount_cents) VALUES (?, ?)'
+SELECT_BUDGETS = 'SELECT category, amount_cents FROM budgets'
+
+
+def _cents(amount):
+    # NULL cents would turn the rollup sums NULL, so bad amounts stop here.
+    cents = to_cents(amount)
+    if cents is None:
+        raise ValueError('invalid amount %r' % (amount,))
+    return cents
+
+
+class SQLiteStorage:
+    """Transaction store backed by one SQLite file in WAL mode.
+
+    Calls check a connection out of a bounded pool and hand it back when
+    they return, so readers never wait on a writer, compiled statements
+    survive between calls, and threads that come and go (one per request
+    under a threaded server) don't leave connections behind. Nested calls
+    in one thread share its connection. Offers the same row interface as
+    ledger.Ledger: rows are [date, category, amount, description] lists,
+    with amounts stored as integer cents and returned as dollars.
+    """
+
+    statement_cache_size = 256
+    bulk_cache_kib = 64 * 1024
+    max_connections = 8
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()  # .conn: the connection this thread has checked out
+        self._lock = threading.Lock()
+        self._pool = threading.Condition()
+        self._idle = []
+        self._busy = set()
+        self._retired = set()  # checked out when close() ran; closed as they come back
+        self._open = 0
+        self._schema_ready = False
+        self.listeners = []  # called with [(old row, new row)] after each committed write
+
+    def connect(self):
+        """Opens a new connection with the schema in place; the caller owns it and closes it."""
+        conn = sqlite3.connect(self.path, timeout=30, cached_statements=self.statement_cache_size,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Allows dictionary-style access
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._schema_ready:
+            with self._lock:
+                if not self._schema_ready:
+                    self._create_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _create_schema(self, conn):
+        with conn:
+            # Rows written while a trigger was missing never reached the rollups,
+            # so a database found without all of them gets its rollups recomputed.
+            triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+            migrating = self._tables_in_dollars(conn)
+            if migrating:
+                self._move_aside(conn, migrating)
+            new_rollups = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollups'").fetchone() is None
+            new_rollups = new_rollups or not triggers.issuperset(TRIGGERS)
+            tables = (ROLLUP_TABLE,) + DAY_TABLES
+            for statement in SCHEMA + tuple(INDEXES.values()) + tables + tuple(TRIGGERS.values()):
+                conn.execute(statement)
+            for table in migrating:
+                conn.execute(MIGRATE_TO_CENTS[table])
+                conn.execute('DROP TABLE %s_old' % table)
+            # A NULL amount (written before amounts were checked) makes its group's total NULL.
+            if new_rollups or conn.execute('SELECT 1 FROM rollups WHERE total_cents IS NULL LIMIT 1').fetchone():
+                for statement in REBUILD_ROLLUPS:
+                    conn.execute(statement)
+
+    @contextmanager
+    def connection(self):
+        """Yields a pooled connection for the block; don't keep it, or its cursors, past the block."""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+
+    def _checkout(self):
+        with self._pool:
+            while not self._idle and self._open >= self.max_connections:
+                self._pool.wait()
+            if self._idle:
+                conn = self._idle.pop()
+                self._busy.add(conn)
+                return conn
+            self._open += 1
+        try:
+            conn = self.connect()
+        except BaseException:
+            with self._pool:
+                self._open -= 1
+                self._pool.notify()
+            raise
+        with self._pool:
+            self._busy.add(conn)
+        return conn
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._pool:
+            self._busy.discard(conn)
+            retired = conn in self._retired
+            if retired:
+                self._retired.discard(conn)
+            else:
+                self._idle.append(conn)
+            self._pool.notify()
+        if retired:
+            conn.close()
+
+    @staticmethod
+    def _tables_in_dollars(conn):
+        return [table for table in MIGRATE_TO_CENTS
+                if any(column[1] == 'amount' for column in conn.execute('PRAGMA table_info(%s)' % table))]
+
+    @staticmethod
+    def _move_aside(conn, tables):
+        # Triggers, indexes and rollups all refer to the old columns; they
+        # are recreated with the new tables.
+        for name in TRIGGERS:
+            conn.execute('DROP TRIGGER IF EXISTS %s' % name)
+        for name in INDEXES:
+            conn.execute('DROP INDEX IF EXISTS %s' % name)
+        for table in ('rollups', 'day_totals', 'month_totals'):
+            conn.execute('DROP TABLE IF EXISTS %s' % table)
+        for table in tables:
+            conn.execute('ALTER TABLE %s RENAME TO %s_old' % (table, table))
+
+    @contextmanager
+    def transaction(self):
+        """Yields a pooled connection inside one commit-or-rollback transaction."""
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    def close(self):
+        """Closes the idle connections now and the checked-out ones as they come back."""
+        with self._pool:
+            idle, self._idle = self._idle, []
+            self._retired.update(self._busy)
+            self._open -= len(idle) + len(self._busy)
+            self._busy = set()
+            self._pool.notify_all()
+        for conn in idle:
+            conn.close()
+
+    # --- Reads ---
+
+    @staticmethod
+    def _row(date, category, amount_cents, description):
+        return [date, category, from_cents(amount_cents), description]
+
+    def _scanned(self, rows):
+        metrics.inc('finance_rows_scanned_total', len(rows), source='sqlite')
+        return rows
+
+    def _fetch(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _fetch_one(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def rows(self):
+        return self._scanned([self._row(*row[1:]) for row in self._fetch(SELECT_ROWS)])
+
+    def items(self):
+        return self._scanned([(row[0], self._row(*row[1:])) for row in self._fetch(SELECT_ROWS)])
+
+    def records(self):
+        return self._scanned([Transaction(row[0], *self._row(*row[1:]))
+                              for row in self._fetch(SELECT_ROWS)])
+
+    def page(self, cursor=None, limit=50, start_date=None, end_date=None, category=None):
+        """Returns up to `limit` (id, row) pairs, newest first by (date, id).
+
+        cursor is the (date, id) of the last row of the previous page; the
+        query seeks straight to it through the date or (category, date)
+        index instead of counting past an OFFSET.
+        """
+        clauses, params = [], []
+        if cursor is not None:
+            clauses.append('(date, id) < (?, ?)')
+            params.extend(cursor)
+        if start_date is not None:
+            clauses.append('date >= ?')
+            params.append(start_date)
+        if end_date is not None:
+            clauses.append('date <= ?')
+            params.append(end_date)
+        if category is not None:
+            clauses.append('category = ?')
+            params.append(category)
+        sql = 'SELECT id, date, category, amount_cents, description FROM transactions'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY date DESC, id DESC LIMIT ?'
+        params.append(limit)
+        return [(row[0], self._row(*row[1:])) for row in self._fetch(sql, params)]
+
+    def get(self, txn_id):
+        row = self._fetch_one(SELECT_ROW, (txn_id,))
+        return self._row(*row) if row is not None else None
+
+    def net(self):
+        return from_cents(self._fetch_one(SELECT_NET)[0])
+
+    def category_totals(self):
+        return {row[0]: from_cents(row[1]) for row in self._fetch(SELECT_CATEGORY_TOTALS)}
+
+    def monthly_totals(self):
+        """Returns {'YYYY-MM': net amount} in month order."""
+        return {row[0]: from_cents(row[1]) for row in self._fetch(SELECT_MONTHLY_TOTALS)}
+
+    def month_category_totals(self, month):
+        """Returns {category: net amount} for one 'YYYY-MM' month."""
+        rows = self._fetch(SELECT_MONTH_CATEGORY_TOTALS, (month,))
+        return {row[0]: from_cents(row[1]) for row in rows}
+
+    def rollups(self, month=None):
+        """Returns the rollup rows as dicts (amounts in cents), for one 'YYYY-MM' month or all of them."""
+        if month is None:
+            rows = self._fetch(SELECT_ROLLUPS)
+        else:
+            rows = self._fetch(SELECT_MONTH_ROLLUPS, (month,))
+        return [dict(row) for row in rows]
+
+    def balance_through(self, date):
+        """Returns the net amount of the rows dated on or before a YYYY-MM-DD `date`."""
+        return from_cents(self._fetch_one(SELECT_TOTAL_THROUGH, (date,))[0])
+
+    def total_between(self, start_date, end_date):
+        """Returns the net amount of the rows dated from `start_date` to `end_date`, inclusive."""
+        if end_date < start_date:
+            return 0.0
+        with self.connection() as conn:
+            through = conn.execute(SELECT_TOTAL_THROUGH, (end_date,)).fetchone()[0]
+            before = conn.execute(SELECT_TOTAL_BEFORE, (start_date,)).fetchone()[0]
+        return from_cents(through - before)
+
+    def date_span(self):
+        """Returns the (first, last) YYYY-MM-DD dates that have rows on the timeline, or None."""
+        first, last = self._fetch_one(SELECT_DATE_SPAN)
+        return (first, last) if first is not None else None
+
+    def daily_balances(self, start_date=None, end_date=None):
+        """Returns [(date, net amount through that day)] for every day in the range.
+
+        The range defaults to the first and last days that have rows. The
+        day totals in the range fill in the days after the first.
+        """
+        with self.connection() as conn:
+            if start_date is None or end_date is None:
+                first, last = conn.execute(SELECT_DATE_SPAN).fetchone()
+                if first is None:
+                    return []
+                start_date, end_date = start_date or first, end_date or last
+            totals = dict(conn.execute(SELECT_DAILY_TOTALS, (start_date, end_date)).fetchall())
+            running = conn.execute(SELECT_TOTAL_BEFORE, (start_date,)).fetchone()[0]
+        balances = []
+        for ordinal in range(date_ordinal(start_date), date_ordinal(end_date) + 1):
+            date = date_text(ordinal)
+            running += totals.get(date, 0)
+            balances.append((date, from_cents(running)))
+        return balances
+
+    def budgets(self):
+        return {row[0]: from_cents(row[1]) for row in self._fetch(SELECT_BUDGETS)}
+
+    # --- Writes ---
+
+    def _notify(self, touched):
+        # The write is committed by now: a failing listener is logged, not raised to the writer.
+        for listener in self.listeners:
+            try:
+                listener(touched)
+            except Exception:
+                log.exception('storage listener %r failed', listener)
+
+    def _current(self, conn, txn_id):
+        # Rows about to change are only read back when someone is listening.
+        if not self.listeners:
+            return None
+        row = conn.execute(SELECT_ROW, (txn_id,)).fetchone()
+        return self._row(*row) if row is not None else None
+
+    def append(self, row, type_=''):
+        date, category, amount, description = row
+        with self.transaction() as conn:
+            txn_id = conn.execute(INSERT_TRANSACTION, (date, _cents(amount), category, description, type_)).lastrowid
+        self._notify([(None, list(row))])
+        return txn_id
+
+    def count_hint(self):
+        """Cheap upper bound on the number of stored transactions."""
+        return self._fetch_one('SELECT COALESCE(MAX(id), 0) FROM transactions')[0]
+
+    def append_many(self, batches, rebuild_indexes=False):
+        """Inserts batches of (date, amount_cents, category, description, type) tuples in one transaction.
+
+        Rollups and day totals are reduced per batch over int64 arrays and
+        merged once at the end instead of firing the triggers for every row.
+        With rebuild_indexes the secondary indexes are also dropped for the
+        load and rebuilt at the end of the same transaction, which beats
+        updating them row by row when the load is large compared to the table.
+        Listeners are not called for bulk loads.
+        """
+        count = 0
+        rollups = {}
+        days = {}
+        with self.connection() as conn:
+            cache_size = conn.execute('PRAGMA cache_size').fetchone()[0]
+            conn.execute('PRAGMA cache_size = %d' % -self.bulk_cache_kib)
+            try:
+                with self.transaction() as conn:
+                    # sqlite3 runs DDL outside any transaction unless one is open, so
+                    # open it first: the drops below then commit or roll back with the
+                    # rows, and other connections keep their triggers and indexes.
+                    conn.execute('BEGIN IMMEDIATE')
+                    for name in TRIGGERS:
+                        conn.execute('DROP TRIGGER IF EXISTS %s' % name)
+                    if rebuild_indexes:
+                        for name in INDEXES:
+                            conn.execute('DROP INDEX IF EXISTS %s' % name)
+                    for batch in batches:
+                        conn.executemany(INSERT_TRANSACTION, batch)
+                        count += len(batch)
+                        keys = [(date[:7] if date else '', category or '', type_ or '')
+                                for date, _, category, _, type_ in batch]
+                        for key, (total, n, low, high) in group_cents(keys, [row[1] for row in batch]).items():
+                            group = rollups.get(key)
+                            if group is None:
+                                rollups[key] = [total, n, low, high]
+                            else:
+                                group[0] += total
+                                group[1] += n
+                                group[2] = min(group[2], low)
+                                group[3] = max(group[3], high)
+                        dated = [row for row in batch if on_timeline(date_ordinal(row[0]))]
+                        for day, (total, n, _, _) in group_cents([row[0] for row in dated],
+                                                                 [row[1] for row in dated]).items():
+                            group = days.setdefault(day, [0, 0])
+                            group[0] += total
+                            group[1] += n
+                    conn.executemany(MERGE_ROLLUP, [key + tuple(group) for key, group in rollups.items()])
+                    months = {}
+                    for day, (total, n) in days.items():
+                        group = months.setdefault(day[:7], [0, 0])
+                        group[0] += total
+                        group[1] += n
+                    conn.executemany(MERGE_DAY, [(day,) + tuple(group) for day, group in days.items()])
+                    conn.executemany(MERGE_MONTH, [(month,) + tuple(group) for month, group in months.items()])
+                    statements = tuple(TRIGGERS.values())
+                    if rebuild_indexes:
+                        statements += tuple(INDEXES.values())
+                    for statement in statements:
+                        conn.execute(statement)
+            finally:
+                conn.execute('PRAGMA cache_size = %d' % cache_size)
+        return count
+
+    def update(self, txn_id, row):
+        date, category, amount, description = row
+        with self.transaction() as conn:
+            old = self._current(conn, txn_id)
+            cursor = conn.execute(UPDATE_TRANSACTION, (date, category, _cents(amount), description, txn_id))
+            updated = cursor.rowcount > 0
+        if updated:
+            self._notify([(old, list(row))])
+        return updated
+
+    def delete(self, txn_id):
+        with self.transaction() as conn:
+            old = self._current(conn, txn_id)
+            deleted = conn.execute(DELETE_TRANSACTION, (txn_id,)).rowcount > 0
+        if deleted:
+            self._notify([(old, None)])
+        return deleted
+
+    def apply_batch(self, creates=(), updates=(), deletes=()):
+        """Creates, updates ((id, row) pairs) and deletes rows in one transaction.
+
+        Returns the new ids. Raises KeyError and rolls everything back if an
+        update or delete names an id that does not exist, and ValueError if
+        an amount isn't a finite number.
+        """
+        touched = []
+        with self.transaction() as conn:
+            for txn_id, row in updates:
+                date, category, amount, description = row
+                old = self._current(conn, txn_id)
+                params = (date, category, _cents(amount), description, txn_id)
+                if conn.execute(UPDATE_TRANSACTION, params).rowcount == 0:
+                    raise KeyError(txn_id)
+                touched.append((old, list(row)))
+            for txn_id in deletes:
+                old = self._current(conn, txn_id)
+                if conn.execute(DELETE_TRANSACTION, (txn_id,)).rowcount == 0:
+                    raise KeyError(txn_id)
+                touched.append((old, None))
+            created = []
+            for row in creates:
+                date, category, amount, description = row
+                params = (date, _cents(amount), category, description, '')
+                created.append(conn.execute(INSERT_TRANSACTION, params).lastrowid)
+                touched.append((None, list(row)))
+        self._notify(touched)
+        return created
+
+    def rebuild_rollups(self):
+        """Recomputes the rollup, day and month tables from scratch."""
+        with self.transaction() as conn:
+            for statement in REBUILD_ROLLUPS:
+                conn.execute(statement)
+
+    def set_budget(self, category, amount):
+        with self.transaction() as conn:
+            conn.execute(UPSERT_BUDGET, (category, _cents(amount)))
@@ -0,0 +1,170 @@
+# app/tenants.py
+"""Per-user ledgers, each kept in a shard directory of its own.
+
+USERS_DIR/<user>/ holds everything of one user: transactions.csv (the CSV
+ledger), finance.db (SQLite transactions and budgets) and
+initial_balance.txt. Users share no files and no locks, so one user's
+import or report never waits on another's.
+
+A ShardPool keeps at most `max_open` shards open, least recently used
+first out. Open means its stores are loaded and it has its own caches
+(the recurring-charge detector, the budget engine). Work on a shard pins
+it, and pinned shards are never closed under a request. When every open
+shard is pinned the pool runs over its bound until some are released.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ledger import Ledger
+from storage import SQLiteStorage
+
+MAX_OPEN = int(os.environ.get('FINANCE_MAX_OPEN_LEDGERS', 64))
+USER_NAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,63}')
+
+
+class InvalidUser(ValueError):
+    pass
+
+
+def check_user(user):
+    """Returns `user` if it is a usable shard name (letters, digits, '_', '.', '-'), or raises InvalidUser."""
+    if not isinstance(user, str) or not USER_NAME.fullmatch(user):
+        raise InvalidUser('invalid user %r' % (user,))
+    return user
+
+
+class Shard:
+    """One user's stores and caches, opened lazily."""
+
+    def __init__(self, user, directory):
+        self.user = user
+        self.directory = directory
+        self.initial_balance_file = os.path.join(directory, 'initial_balance.txt')
+        self.cache = {}  # per-shard singletons, see core._singleton
+        self.lock = threading.RLock()
+        self.pins = 0
+        self._ledger = None
+        self._sqlite = None
+
+    def _ensure_directory(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def ledger(self):
+        with self.lock:
+            if self._ledger is None:
+                self._ensure_directory()
+                self._ledger = Ledger(os.path.join(self.directory, 'transactions.csv'))
+            return self._ledger
+
+    def sqlite_storage(self):
+        with self.lock:
+            if self._sqlite is None:
+                self._ensure_directory()
+                self._sqlite = SQLiteStorage(os.path.join(self.directory, 'finance.db'))
+            return self._sqlite
+
+    def close(self):
+        """Closes the stores and drops the caches; each step runs even if one before it fails."""
+        with self.lock:
+            ledger, sqlite = self._ledger, self._sqlite
+            self._ledger = self._sqlite = None
+            self.cache.clear()
+            try:
+                if ledger is not None:
+                    ledger.close()
+            finally:
+                if sqlite is not None:
+                    # Connections other threads have checked out are closed as they come back.
+                    sqlite.close()
+
+
+def _close_all(shards):
+    # Closes every shard, then raises the first error if any close failed.
+    error = None
+    for shard in shards:
+        try:
+            shard.close()
+        except Exception as failure:
+            error = error or failure
+    if error is not None:
+        raise error
+
+
+class ShardPool:
+    """Bounded LRU of open shards under one directory."""
+
+    def __init__(self, directory, max_open=MAX_OPEN):
+        self.directory = directory
+        self.max_open = max_open
+        self._open = OrderedDict()  # user -> Shard, least recently used first
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._open)
+
+    @contextmanager
+    def pinned(self, user):
+        """Yields `user`'s shard, which stays open until the block ends."""
+        shard = self._acquire(check_user(user))
+        try:
+            yield shard
+        finally:
+            self._release(shard)
+
+    def _acquire(self, user):
+        with self._lock:
+            shard = self._open.get(user)
+            if shard is None:
+                shard = self._open[user] = Shard(user, os.path.join(self.directory, user))
+                self.opened += 1
+            else:
+                self._open.move_to_end(user)
+            shard.pins += 1
+            closing = self._evict()
+        try:
+            _close_all(closing)
+        except BaseException:
+            self._release(shard)
+            raise
+        return shard
+
+    def _release(self, shard):
+        with self._lock:
+            shard.pins -= 1
+            closing = self._evict()
+        _close_all(closing)
+
+    def _evict(self):
+        # Called with self._lock held; the caller closes what comes back, outside the lock.
+        closing = []
+        if len(self._open) <= self.max_open:
+            return closing
+        for user, shard in list(self._open.items()):
+            if len(self._open) <= self.max_open:
+                break
+            if not shard.pins:
+                del self._open[user]
+                closing.append(shard)
+        self.evicted += len(closing)
+        return closing
+
+    def users(self):
+        """Returns the users that have a shard on disk, sorted."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names
+                      if USER_NAME.fullmatch(name) and os.path.isdir(os.path.join(self.directory, name)))
+
+    def close(self):
+        with self._lock:
+            closing = list(self._open.values())
+            self._open.clear()
+        _close_all(closing)
@@ -1,14 +1,79 @@
 # app/web.py
 
-from flask import Flask, request, render_template_string, send_file
+from urllib.parse import urlencode
+
+from flask import Flask, Response, request, render_template_string, abort, g
 import core
+import metrics
+import tenants
+from money import to_cents
 
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend for server environments
-import matplotlib.pyplot as plt
-import io
+# Charts are drawn with matplotlib's Figure API, which needs no GUI backend;
+# charts imports matplotlib only when (and where) a chart is rendered.
+import charts
+from api import api
 
 app = Flask(__name__)
+app.register_blueprint(api)
+metrics.instrument(app)
+chart_cache = charts.ChartCache()
+
+@metrics.collect
+def chart_cache_samples():
+    return [
+        ('finance_chart_cache_hits_total', 'counter', {}, chart_cache.hits),
+        ('finance_chart_cache_misses_total', 'counter', {}, chart_cache.misses),
+    ]
+
+@metrics.collect
+def shard_samples():
+    shards = core.get_shards()
+    return [
+        ('finance_open_ledgers', 'gauge', {}, len(shards)),
+        ('finance_ledgers_opened_total', 'counter', {}, shards.opened),
+        ('finance_ledgers_evicted_total', 'counter', {}, shards.evicted),
+    ]
+
+# Budget alerts are raised as writes happen, so start listening before the first one.
+core.get_budget_engine()
+
+# --- Users ---
+# A request works on the ledger of the user named by the X-Finance-User header,
+# ?user= (remembered in a cookie) or that cookie, and on the shared ledger if
+# none is given. This only picks the ledger; put authentication in front of it.
+
+USER_HEADER = 'X-Finance-User'
+USER_COOKIE = 'finance_user'
+
+@app.before_request
+def select_user():
+    user = request.headers.get(USER_HEADER) or request.args.get('user') or request.cookies.get(USER_COOKIE)
+    if not user:
+        return None
+    try:
+        tenants.check_user(user)
+    except tenants.InvalidUser as error:
+        return str(error), 400
+    g.finance_user = user
+    g.finance_shard = core.use_user(user)
+    g.finance_shard.__enter__()
+    core.get_budget_engine()
+    return None
+
+@app.after_request
+def remember_user(response):
+    user = request.args.get('user')
+    if user and g.get('finance_user') == user:
+        response.set_cookie(USER_COOKIE, user, samesite='Lax')
+    return response
+
+@app.teardown_request
+def release_user(error=None):
+    shard = g.pop('finance_shard', None)
+    if shard is not None:
+        shard.__exit__(None, None, None)
+
+PAGE_SIZE = 50
 
 TEMPLATE = """
 <!doctype html>
@@ -37,13 +102,14 @@ TEMPLATE = """
   <input type="submit" value="Set">
 </form>
 <h2>Add Transaction</h2>
-<form method=post>
+{% if error %}<p style="color: #b00020;">{{ error }}</p>{% endif %}
+<form method="post" action="/">
   Date: <input name="date" type="text" placeholder="YYYY-MM-DD" value="{{ edit_data.date if edit_data else '' }}"><br>
   Category: <input name="category" type="text" value="{{ edit_data.category if edit_data else '' }}"><br>
   Amount: <input name="amount" type="number" step="0.01" value="{{ edit_data.amount if edit_data else '' }}"><br>
   Description: <input name="description" type="text" value="{{ edit_data.description if edit_data else '' }}"><br>
-  {% if edit_index is not none %}
-    <input type="hidden" name="edit_index" value="{{ edit_index }}">
+  {% if edit_id is not none %}
+    <input type="hidden" name="edit_id" value="{{ edit_id }}">
     <input type=submit value="Update">
     <a href="/" class="action-btn">Cancel</a>
   {% else %}
@@ -53,6 +119,13 @@ TEMPLATE = """
 <h2>Initial Balance: ${{ "{:,.2f}".format(initial_balance) }}</h2>
 <h2>Net Savings: ${{ "{:,.2f}".format(net) }}</h2>
 <h2>Transactions</h2>
+<form method="get" action="/">
+  From: <input name="start" type="text" placeholder="YYYY-MM-DD" value="{{ filters.start or '' }}">
+  To: <input name="end" type="text" placeholder="YYYY-MM-DD" value="{{ filters.end or '' }}">
+  Category: <input name="category" type="text" value="{{ filters.category or '' }}">
+  <input type="submit" value="Filter">
+  <a href="/" class="action-btn">Clear</a>
+</form>
 <table>
   <tr><th>Date</th><th>Category</th><th>Amount</th><th>Description</th><th>Actions</th></tr>
   {% for t in transactions %}
@@ -63,21 +136,68 @@ TEMPLATE = """
       <td>{{ t[3] }}</td>
       <td>
         <form method="post" action="/delete" style="display:inline;">
-          <input type="hidden" name="index" value="{{ loop.index0 }}">
+          <input type="hidden" name="id" value="{{ t[4] }}">
           <button type="submit" class="action-btn">Delete</button>
         </form>
         <form method="get" action="/edit" style="display:inline;">
-          <input type="hidden" name="index" value="{{ loop.index0 }}">
+          <input type="hidden" name="id" value="{{ t[4] }}">
           <button type="submit" class="action-btn">Edit</button>
         </form>
       </td>
     </tr>
   {% endfor %}
 </table>
+<p>
+  {% if first_query is not none %}<a href="/?{{ first_query }}" class="action-btn">First page</a>{% endif %}
+  {% if next_query is not none %}<a href="/?{{ next_query }}" class="action-btn">Next page</a>{% endif %}
+</p>
 <h2>Spending Report</h2>
 <img src="/report.png">
 """
 
+def parse_cursor(value):
+    # Cursors look like "<date>:<id>", the sort key of the last row shown.
+    date, _, txn_id = (value or '').rpartition(':')
+    try:
+        return (date, int(txn_id)) if date else None
+    except ValueError:
+        return None
+
+def render_page(edit_data=None, edit_id=None, error=None):
+    filters = {name: request.args.get(name) or None for name in ('start', 'end', 'category')}
+    cursor = parse_cursor(request.args.get('cursor'))
+    # One extra row tells us whether there is a next page.
+    page = core.page_transactions(cursor, PAGE_SIZE + 1, filters['start'], filters['end'], filters['category'])
+    query = {name: value for name, value in filters.items() if value}
+    next_query = None
+    if len(page) > PAGE_SIZE:
+        page = page[:PAGE_SIZE]
+        last_id, last = page[-1]
+        next_query = urlencode(dict(query, cursor='%s:%d' % (last[0], last_id)))
+    net = core.calculate_net_savings()
+    initial_balance = core.get_initial_balance()
+    # Format amounts as currency strings
+    formatted_transactions = []
+    for i, t in page:
+        try:
+            amount_str = "${:,.2f}".format(float(t[2]))
+        except (TypeError, ValueError, IndexError):
+            amount_str = t[2]
+        formatted_transactions.append([t[0], t[1], amount_str, t[3], i])
+    with metrics.timer('finance_template_render_seconds', template='index'):
+        return render_template_string(
+            TEMPLATE,
+            net=net,
+            transactions=formatted_transactions,
+            edit_data=edit_data,
+            edit_id=edit_id,
+            error=error,
+            initial_balance=initial_balance,
+            filters=filters,
+            next_query=next_query,
+            first_query=urlencode(query) if cursor else None
+        )
+
 @app.route('/set_balance', methods=['POST'])
 def set_balance():
     try:
@@ -89,64 +209,58 @@ def set_balance():
 
 @app.route('/delete', methods=['POST'])
 def delete():
-    index = int(request.form['index'])
-    core.delete_transaction(index)
+    txn_id = int(request.form['id'])
+    core.delete_transaction(txn_id)
     return '', 303, {'Location': '/'}
 
 @app.route('/edit', methods=['GET'])
 def edit():
-    index = int(request.args['index'])
-    transactions = core.get_transactions()
-    t = transactions[index]
+    txn_id = int(request.args['id'])
+    t = core.get_transaction(txn_id)
+    if t is None:
+        abort(404)
     edit_data = {
         'date': t[0],
         'category': t[1],
         'amount': t[2],
         'description': t[3]
     }
-    net = core.calculate_net_savings()
-    initial_balance = core.get_initial_balance()
-    # Format amounts as currency strings
-    formatted_transactions = []
-    for i, t in enumerate(transactions):
-        try:
-            amount_str = "${:,.2f}".format(float(t[2]))
-        except (ValueError, IndexError):
-            amount_str = t[2]
-        formatted_transactions.append([t[0], t[1], amount_str, t[3]])
-    return render_template_string(
-        TEMPLATE,
-        net=net,
-        transactions=formatted_transactions,
-        edit_data=edit_data,
-        edit_index=index,
-        initial_balance=initial_balance
-    )
+    return render_page(edit_data=edit_data, edit_id=txn_id)
+
+def render_chart(func, *args):
+    with metrics.timer('finance_chart_render_seconds', chart=func.__name__):
+        return charts.render(func, *args)
 
 @app.route('/report.png')
 def report():
-    # Generate pie chart using category totals
+    # Generate pie chart using category totals; it is only redrawn when they change
     category_totals = core.get_category_totals()
-    fig, ax = plt.subplots()
-    if category_totals:
-        ax.pie(category_totals.values(), labels=category_totals.keys(), autopct='%1.1f%%', startangle=90)
-        ax.set_title("Spending by Category")
+    etag = charts.data_etag('category_pie', sorted(category_totals.items()))
+    if etag in request.if_none_match:
+        png = b''
     else:
-        ax.text(0.5, 0.5, "No data", ha='center', va='center')
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close(fig)
-    return send_file(buf, mimetype='image/png')
+        try:
+            png = chart_cache.get_or_render(etag, lambda: render_chart(charts.render_category_pie, category_totals))
+        except charts.ChartBusy:
+            return 'Too many charts rendering, try again shortly', 503, {'Retry-After': '1'}
+    response = Response(png, mimetype='image/png')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # revalidate, which is cheap
+    return response.make_conditional(request)
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        edit_index = request.form.get('edit_index')
-        if edit_index is not None and edit_index != '':
+        edit_id = request.form.get('edit_id')
+        if to_cents(request.form['amount']) is None:
+            # Show the form again with what was typed, rather than storing an amount nothing can add up.
+            edit_data = {name: request.form[name] for name in ('date', 'category', 'amount', 'description')}
+            error = 'Invalid amount %r' % request.form['amount']
+            return render_page(edit_data=edit_data, edit_id=int(edit_id) if edit_id else None, error=error), 400
+        if edit_id is not None and edit_id != '':
             # Edit transaction
             core.edit_transaction(
-                int(edit_index),
+                int(edit_id),
                 request.form['date'],
                 request.form['category'],
                 request.form['amount'],
@@ -160,25 +274,7 @@ def index():
                 request.form['amount'],
                 request.form['description']
             )
-    net = core.calculate_net_savings()
-    initial_balance = core.get_initial_balance()
-    transactions = core.get_transactions()
-    # Format amounts as currency strings
-    formatted_transactions = []
-    for t in transactions:
-        try:
-            amount_str = "${:,.2f}".format(float(t[2]))
-        except (ValueError, IndexError):
-            amount_str = t[2]
-        formatted_transactions.append([t[0], t[1], amount_str, t[3]])
-    return render_template_string(
-        TEMPLATE,
-        net=net,
-        transactions=formatted_transactions,
-        edit_data=None,
-        edit_index=None,
-        initial_balance=initial_balance
-    )
+    return render_page()
 
 if __name__ == '__main__':
     app.run(debug=True)
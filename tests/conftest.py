@@ -0,0 +1,5 @@
+# The app's modules import each other as siblings, as they do when run from app/.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
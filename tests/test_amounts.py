@@ -0,0 +1,86 @@
+# tests/test_amounts.py
+"""Amounts that aren't numbers, or don't fit in int64 cents, are refused at every way in."""
+
+import pytest
+from flask import Flask
+
+import api
+import cli
+import core
+from ledger import Ledger
+from money import MAX_CENTS, to_cents
+from scan import scan_totals
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # core keeps its files under data/ relative to the working directory.
+    (tmp_path / 'data').mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(core, 'STORAGE_BACKEND', 'csv')
+    return tmp_path / 'data'
+
+
+@pytest.mark.parametrize('value', ['', 'abc', 'nan', 'inf', '-inf', None, 1e17, '-1e17', '92233720368547758.08'])
+def test_to_cents_refuses(value):
+    assert to_cents(value) is None
+
+
+def test_to_cents_edges():
+    assert to_cents('1e3') == 100000
+    assert to_cents(' 5') == 500
+    assert to_cents('-12345.675') == -1234568
+    assert abs(to_cents('-9.2e16')) <= MAX_CENTS
+
+
+def test_api_batch_refuses_out_of_range_amount(data_dir):
+    app = Flask(__name__)
+    app.register_blueprint(api.api)
+    client = app.test_client()
+    body = {'create': [{'date': '2024-01-01', 'category': 'Food', 'amount': 1e17, 'description': 'x'}]}
+    response = client.post('/api/transactions/batch', json=body)
+    assert response.status_code == 400
+    assert 'invalid amount' in response.json['error']
+    assert len(core.get_transactions()) == 0
+
+
+def test_cli_add_refuses_out_of_range_amount(data_dir, capsys):
+    assert cli.main(['add', '2024-01-01', 'Food', '1e17', 'x']) == 1
+    assert 'invalid amount' in capsys.readouterr().err
+    assert len(core.get_transactions()) == 0
+
+
+def test_cli_import_reports_out_of_range_amount(data_dir, tmp_path, capsys):
+    source = tmp_path / 'rows.ndjson'
+    source.write_text('{"date": "2024-01-01", "category": "Food", "amount": "1e17", "description": "x"}\n'
+                      '{"date": "2024-01-02", "category": "Food", "amount": "-3", "description": "y"}\n')
+    assert cli.main(['import', '--format', 'ndjson', str(source)]) == 1
+    assert 'rejected 1' in capsys.readouterr().err
+    assert [list(row) for row in core.get_transactions()] == [['2024-01-02', 'Food', '-3.00', 'y']]
+
+
+def test_ledger_refuses_before_writing(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    ledger = Ledger(path)
+    txn_id = ledger.append(['2024-01-01', 'Food', '-1', 'x'])
+    for amount in (1e17, '', 'nan'):
+        with pytest.raises(ValueError):
+            ledger.append(['2024-01-01', 'Food', amount, 'x'])
+        with pytest.raises(ValueError):
+            ledger.update(txn_id, ['2024-01-01', 'Food', amount, 'x'])
+    assert open(path, encoding='utf-8').read().count('\n') == 1
+
+
+def test_journal_with_out_of_range_rows_still_loads(tmp_path):
+    # Written before amounts were range-checked: such rows load, but count for nothing.
+    path = tmp_path / 'transactions.csv'
+    path.write_text('2024-01-01,Food,-5,a\n'
+                    '0,2024-01-01,Food,100000000000000000.00,x\n'
+                    '2024-01-02,Rent,1e17,y\n'
+                    '2024-01-03,Rent,-2,z\n')
+    ledger = Ledger(str(path))
+    assert len(ledger.records()) == 3
+    assert ledger.net() == -2.0
+    assert ledger.category_totals() == {'Rent': -2.0}
+    assert scan_totals(str(path)) == {'rows': 3, 'net': -200, 'category_totals': {'Rent': -200},
+                                      'monthly_totals': {'2024-01': -200}}
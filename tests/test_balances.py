@@ -0,0 +1,128 @@
+# tests/test_balances.py
+"""Balances from the DailyTotals Fenwick tree and SQLite's day totals against summing the rows by hand."""
+
+import random
+
+import pytest
+
+from balances import FIRST_DATE, FIRST_DAY, LAST_DATE, LAST_DAY, DailyTotals
+from money import from_cents, to_cents
+from records import date_ordinal, date_text
+from storage import SQLiteStorage
+
+# Off the timeline, not a date, or not written YYYY-MM-DD: none of these count.
+OFF_TIMELINE = ['1899-12-31', '2200-01-01', '0024-01-05', '2024-02-30', '2024-1-05', '', 'soon']
+
+
+def random_rows(seed, count=300):
+    rng = random.Random(seed)
+    days = [FIRST_DAY, FIRST_DAY + 1, LAST_DAY - 1, LAST_DAY]
+    days += [rng.randrange(date_ordinal('2019-01-01'), date_ordinal('2025-01-01')) for _ in range(count)]
+    rows = [[date_text(day), 'Food', '%.2f' % rng.uniform(-200, 200), 'row'] for day in days]
+    rows += [[date, 'Food', '-1000.00', 'off'] for date in OFF_TIMELINE]
+    rng.shuffle(rows)
+    return rows
+
+
+def brute_through(rows, date):
+    return sum(to_cents(row[2]) for row in rows if date_ordinal(row[0]) and FIRST_DATE <= row[0] <= date
+               and row[0] <= LAST_DATE)
+
+
+def probe_dates(seed):
+    rng = random.Random(seed)
+    dates = [FIRST_DATE, LAST_DATE, date_text(FIRST_DAY + 1), date_text(LAST_DAY - 1), '1899-12-31', '2200-01-01',
+             '2024-01-01', '2024-01-31', '2024-02-29']
+    return dates + [date_text(rng.randrange(date_ordinal('2018-06-01'), date_ordinal('2025-06-01')))
+                    for _ in range(60)]
+
+
+# --- DailyTotals ---
+
+def fitted(rows):
+    totals = DailyTotals()
+    totals.fit([date_ordinal(row[0]) for row in rows], [to_cents(row[2]) for row in rows])
+    return totals
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_fenwick_prefix_sums_match_brute_force(seed):
+    rows = random_rows(seed)
+    totals = fitted(rows)
+    for date in probe_dates(seed):
+        assert totals.through(date_ordinal(date)) == brute_through(rows, date), date
+    assert totals.span() == (FIRST_DAY, LAST_DAY)
+
+
+def test_fenwick_after_adds_and_removes(seed=4):
+    rng = random.Random(seed)
+    rows = random_rows(seed, count=50)
+    totals = fitted(rows[:10])
+    for row in rows[10:]:
+        totals.add(date_ordinal(row[0]), to_cents(row[2]))
+    for row in rng.sample(rows, 20):
+        totals.add(date_ordinal(row[0]), -to_cents(row[2]), -1)
+        rows.remove(row)
+    for date in probe_dates(seed):
+        assert totals.through(date_ordinal(date)) == brute_through(rows, date), date
+    first, last = date_ordinal('2020-03-01'), date_ordinal('2020-04-15')
+    assert totals.curve(first, last) == [brute_through(rows, date_text(day)) for day in range(first, last + 1)]
+
+
+def test_fenwick_edges_of_the_timeline():
+    totals = DailyTotals()
+    totals.add(FIRST_DAY, 100)
+    totals.add(LAST_DAY, 250)
+    totals.add(FIRST_DAY - 1, 999)
+    totals.add(LAST_DAY + 1, 999)
+    assert totals.through(FIRST_DAY - 1) == 0
+    assert totals.through(FIRST_DAY) == 100
+    assert totals.through(LAST_DAY - 1) == 100
+    assert totals.through(LAST_DAY) == 350
+    assert totals.between(FIRST_DAY, LAST_DAY) == 350
+    assert totals.span() == (FIRST_DAY, LAST_DAY)
+
+
+# --- SQLite day and month totals ---
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'finance.db'))
+    yield storage
+    storage.close()
+
+
+def check_storage(storage, rows, seed):
+    for date in probe_dates(seed):
+        assert storage.balance_through(date) == from_cents(brute_through(rows, date)), date
+    assert storage.total_between('2020-01-15', '2023-11-30') == from_cents(
+        brute_through(rows, '2023-11-30') - brute_through(rows, '2020-01-14'))
+    assert storage.total_between('2023-01-01', '2022-01-01') == 0
+    assert storage.date_span() == (FIRST_DATE, LAST_DATE)
+    first, last = '2020-02-20', '2020-03-10'
+    assert storage.daily_balances(first, last) == [
+        (date_text(day), from_cents(brute_through(rows, date_text(day))))
+        for day in range(date_ordinal(first), date_ordinal(last) + 1)]
+
+
+def test_sqlite_balances_through_triggers(storage, seed=5):
+    rows = random_rows(seed, count=100)
+    ids = [storage.append(row) for row in rows]
+    rng = random.Random(seed)
+    for index in rng.sample(range(len(rows)), 15):
+        storage.delete(ids[index])
+        rows[index] = None
+    for index in rng.sample([i for i, row in enumerate(rows) if row is not None], 15):
+        moved = [date_text(rng.randrange(date_ordinal('2019-01-01'), date_ordinal('2025-01-01'))), 'Food', '7.25', 'm']
+        storage.update(ids[index], moved)
+        rows[index] = moved
+    check_storage(storage, [row for row in rows if row is not None], seed)
+
+
+def test_sqlite_balances_after_bulk_load_and_rebuild(storage, seed=6):
+    rows = random_rows(seed)
+    storage.append(rows[0])
+    storage.append_many([[(row[0], to_cents(row[2]), row[1], row[3], '') for row in rows[1:]]])
+    check_storage(storage, rows, seed)
+    storage.rebuild_rollups()
+    check_storage(storage, rows, seed)
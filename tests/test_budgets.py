@@ -0,0 +1,110 @@
+# tests/test_budgets.py
+"""Budget vs. actual and the 80%/100% threshold alerts raised as the ledger is written to."""
+
+import pytest
+from flask import Flask
+
+import api
+import core
+from budgets import BudgetEngine
+from ledger import Ledger
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def engine(tmp_path):
+    ledger = Ledger(str(tmp_path / 'transactions.csv'))
+    budget_store = SQLiteStorage(str(tmp_path / 'finance.db'))
+    engine = BudgetEngine(ledger, budget_store)
+    engine.set_budget('Food', 100)
+    yield engine
+    budget_store.close()
+
+
+def spend(engine, day, amount, category='Food'):
+    return engine.storage.append(['2024-03-%02d' % day, category, '-%.2f' % amount, 'shop'])
+
+
+def thresholds(engine):
+    return [(alert['month'], alert['category'], alert['threshold']) for alert in engine.recent_alerts()]
+
+
+# --- Threshold crossing ---
+
+def test_no_alert_below_80_percent(engine):
+    spend(engine, 1, 50)
+    spend(engine, 2, 29.99)
+    assert engine.recent_alerts() == []
+
+
+def test_alert_at_exactly_80_percent(engine):
+    spend(engine, 1, 80)
+    assert thresholds(engine) == [('2024-03', 'Food', 0.8)]
+    assert engine.recent_alerts()[0]['spent'] == 80.0
+
+
+def test_one_write_crossing_both_thresholds_raises_two_alerts(engine):
+    spend(engine, 1, 10)
+    spend(engine, 2, 95)
+    assert thresholds(engine) == [('2024-03', 'Food', 0.8), ('2024-03', 'Food', 1.0)]
+
+
+def test_each_threshold_alerts_once_on_the_way_up(engine):
+    for day in range(1, 8):
+        spend(engine, day, 20)  # 20, 40, ... 140
+    assert thresholds(engine) == [('2024-03', 'Food', 0.8), ('2024-03', 'Food', 1.0)]
+
+
+def test_falling_back_and_crossing_again_alerts_again(engine):
+    txn_id = spend(engine, 1, 85)
+    engine.storage.update(txn_id, ['2024-03-01', 'Food', '-50.00', 'refunded'])
+    spend(engine, 2, 40)
+    assert thresholds(engine) == [('2024-03', 'Food', 0.8), ('2024-03', 'Food', 0.8)]
+
+
+def test_unbudgeted_categories_and_other_months_are_separate(engine):
+    spend(engine, 1, 500, category='Rent')
+    engine.storage.append(['2024-02-28', 'Food', '-70.00', 'shop'])
+    spend(engine, 1, 70)
+    assert engine.recent_alerts() == []
+    spend(engine, 2, 10)
+    assert thresholds(engine) == [('2024-03', 'Food', 0.8)]
+
+
+def test_subscribers_get_each_alert(engine):
+    seen = []
+    engine.subscribers.append(seen.append)
+    spend(engine, 1, 100)
+    assert [alert['threshold'] for alert in seen] == [0.8, 1.0]
+
+
+# --- Budget vs. actual ---
+
+def test_status(engine):
+    spend(engine, 1, 30)
+    spend(engine, 2, 12.5)
+    assert engine.status('2024-03') == [
+        {'category': 'Food', 'budget': 100.0, 'spent': 42.5, 'remaining': 57.5, 'used': 0.425},
+    ]
+
+
+def test_budget_set_elsewhere_is_seen(engine, tmp_path):
+    other = SQLiteStorage(str(tmp_path / 'finance.db'))
+    other.set_budget('Rent', 400)
+    other.close()
+    spend(engine, 1, 400, category='Rent')
+    assert thresholds(engine) == [('2024-03', 'Rent', 0.8), ('2024-03', 'Rent', 1.0)]
+
+
+# --- POST /api/budgets ---
+
+@pytest.mark.parametrize('amount', ['abc', 'nan', 'inf', 1e17, None])
+def test_api_refuses_invalid_budget(tmp_path, monkeypatch, amount):
+    (tmp_path / 'data').mkdir()
+    monkeypatch.chdir(tmp_path)
+    app = Flask(__name__)
+    app.register_blueprint(api.api)
+    response = app.test_client().post('/api/budgets', json={'category': 'Food', 'amount': amount})
+    assert response.status_code == 400
+    assert 'invalid amount' in response.json['error']
+    assert core.get_sqlite_storage().budgets() == {}
@@ -0,0 +1,111 @@
+# tests/test_columnar.py
+"""The Parquet mirror of a CSV: incremental syncs, rebuilds, and what readers see while a sync runs."""
+
+import json
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import columnar  # noqa: E402
+from columnar import MANIFEST, ColumnarStore  # noqa: E402
+
+FORMAT = '%d-%m-%Y'
+
+
+def write_csv(path, rows, mode='w'):
+    with open(path, mode) as f:
+        if mode == 'w':
+            f.write('date,amount,category,description\n')
+        for row in rows:
+            f.write(','.join(row) + '\n')
+
+
+def rows_for(month, count, amount='-1.5'):
+    return [['%02d-%02d-2024' % (day % 28 + 1, month), amount, 'Food', 'row %d' % day] for day in range(count)]
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'finance_data.csv')
+    write_csv(path, rows_for(1, 5) + rows_for(2, 3))
+    return path
+
+
+def listed_files(store):
+    with open(os.path.join(store.root, MANIFEST)) as f:
+        return json.load(f)['files']
+
+
+def test_sync_then_append(tmp_path, source):
+    store = ColumnarStore(str(tmp_path / 'columnar'))
+    store.sync_from_csv(source, FORMAT)
+    assert store.partitions() == ['2024-01', '2024-02']
+    assert len(store.read()) == 8
+    write_csv(source, rows_for(2, 2) + rows_for(3, 4), mode='a')
+    store.sync_from_csv(source, FORMAT)
+    assert store.partitions() == ['2024-01', '2024-02', '2024-03']
+    assert len(store.read()) == 14
+    assert len(store.read('2024-02', '2024-02')) == 5
+    assert len(listed_files(store)['2024-02']) == 2
+
+
+def test_many_appends_fold_into_one_file(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(columnar, 'MAX_FILES_PER_PARTITION', 3)
+    store = ColumnarStore(str(tmp_path / 'columnar'))
+    store.sync_from_csv(source, FORMAT)
+    for _ in range(3):  # the fourth file for January goes past the limit
+        write_csv(source, rows_for(1, 1), mode='a')
+        store.sync_from_csv(source, FORMAT)
+    assert len(store.read('2024-01', '2024-01')) == 8
+    names = listed_files(store)['2024-01']
+    assert len(names) == 1
+    assert sorted((tmp_path / 'columnar' / 'month=2024-01').iterdir()) == [
+        tmp_path / 'columnar' / 'month=2024-01' / names[0]]
+
+
+def test_rewritten_source_is_rebuilt(tmp_path, source):
+    store = ColumnarStore(str(tmp_path / 'columnar'))
+    store.sync_from_csv(source, FORMAT)
+    write_csv(source, rows_for(6, 2, amount='-9'))
+    store.sync_from_csv(source, FORMAT)
+    assert store.partitions() == ['2024-06']
+    assert store.read()['amount'].tolist() == [-9.0, -9.0]
+    assert sorted(path.name for path in (tmp_path / 'columnar').iterdir()) == sorted([MANIFEST, 'month=2024-06'])
+
+
+def test_unlisted_files_are_not_read(tmp_path, source):
+    # What an interrupted sync leaves behind: files written but never published.
+    store = ColumnarStore(str(tmp_path / 'columnar'))
+    store.sync_from_csv(source, FORMAT)
+    stray = store.read('2024-01', '2024-01')
+    stray.to_parquet(str(tmp_path / 'columnar' / 'month=2024-01' / 'part-stray.parquet'), index=False)
+    (tmp_path / 'columnar' / 'month=2024-05').mkdir()
+    stray.to_parquet(str(tmp_path / 'columnar' / 'month=2024-05' / 'part-stray.parquet'), index=False)
+    assert len(store.read()) == 8
+    assert store.partitions() == ['2024-01', '2024-02']
+
+
+def test_store_without_file_list_is_rebuilt(tmp_path, source):
+    store = ColumnarStore(str(tmp_path / 'columnar'))
+    store.sync_from_csv(source, FORMAT)
+    manifest = json.loads((tmp_path / 'columnar' / MANIFEST).read_text())
+    del manifest['files']
+    (tmp_path / 'columnar' / MANIFEST).write_text(json.dumps(manifest))
+    assert store.read().empty
+    store.sync_from_csv(source, FORMAT)
+    assert len(store.read()) == 8
+
+
+def test_concurrent_syncs_add_each_row_once(tmp_path, source):
+    store = ColumnarStore(str(tmp_path / 'columnar'))
+    store.sync_from_csv(source, FORMAT)
+    write_csv(source, rows_for(3, 10), mode='a')
+    threads = [threading.Thread(target=store.sync_from_csv, args=(source, FORMAT)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(store.read()) == 18
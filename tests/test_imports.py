@@ -0,0 +1,15 @@
+# tests/test_imports.py
+"""The everyday paths stay free of the heavy report and chart dependencies (see bench.py imports)."""
+
+import bench
+
+# Import times vary a lot between machines; the budgets are enforced by
+# `bench.py imports`, and this only catches a heavy module creeping in.
+SLACK = 10
+
+
+def test_everyday_paths_load_no_heavy_modules(capsys):
+    failed = bench.check_imports(slack=SLACK)
+    report = capsys.readouterr().out
+    assert 'loads ' not in report, report
+    assert failed == [], report
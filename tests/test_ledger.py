@@ -0,0 +1,213 @@
+# tests/test_ledger.py
+"""Regression tests for the CSV journal format, compaction, the row index and scan.scan_totals()."""
+
+import pytest
+
+from ledger import Ledger
+from money import from_cents
+from scan import scan_totals
+
+# Legacy rows (ids 0-3 by position), id records replacing and adding rows, a
+# tombstone, and fields csv has to unquote: commas, doubled quotes, newlines.
+MIXED = (
+    '2024-01-03,Groceries,-12.50,Weekly shop\n'
+    '2024-01-05,"Dining, out",-30,"Pizza, ""large"""\n'
+    '2024-01-20,Salary,1e3,January\n'
+    '2024-02-01,Rent, 5,"two\nlines"\n'
+    '1,2024-01-05,"Dining, out",-31.25,"Pizza, edited"\n'
+    '7,2024-02-14,Gifts,-40,Flowers\n'
+    '0\n'
+    '2024-03-01,Groceries,-8.75,"quoted ""a,b""\nand a newline"\n'
+)
+
+
+def write_file(path, text):
+    path.write_bytes(text.encode('utf-8'))
+    return str(path)
+
+
+def loaded_totals(path):
+    ledger = Ledger(path)
+    ledger.records()  # load every row, so the totals below come from the load
+    return {
+        'rows': len(ledger.rows()),
+        'net': ledger.net(),
+        'category_totals': ledger.category_totals(),
+        'monthly_totals': ledger.monthly_totals(),
+    }
+
+
+def in_dollars(scanned):
+    return {
+        'rows': scanned['rows'],
+        'net': from_cents(scanned['net']),
+        'category_totals': {name: from_cents(cents) for name, cents in scanned['category_totals'].items()},
+        'monthly_totals': {month: from_cents(cents) for month, cents in scanned['monthly_totals'].items()},
+    }
+
+
+# --- scan.scan_totals() against a full load ---
+
+def test_scan_matches_load_on_mixed_journal(tmp_path):
+    path = write_file(tmp_path / 'transactions.csv', MIXED)
+    scanned = scan_totals(path)
+    assert scanned is not None
+    assert in_dollars(scanned) == loaded_totals(path)
+
+
+def test_scan_reads_exponent_and_padded_amounts(tmp_path):
+    path = write_file(tmp_path / 'transactions.csv', '2024-01-20,Salary,1e3,x\n2024-02-01,Rent, 5,y\n')
+    scanned = scan_totals(path)
+    assert scanned['category_totals'] == {'Salary': 100000, 'Rent': 500}
+    assert in_dollars(scanned) == loaded_totals(path)
+
+
+def test_scan_resolves_edits_and_tombstones(tmp_path):
+    path = write_file(tmp_path / 'transactions.csv', MIXED)
+    scanned = scan_totals(path)
+    # Row 0 is deleted, row 1 replaced and row 7 added after the legacy rows.
+    assert scanned['rows'] == 5
+    assert scanned['category_totals']['Dining, out'] == -3125
+    assert 'Groceries' in scanned['category_totals']
+    assert scanned['category_totals']['Groceries'] == -875
+
+
+@pytest.mark.parametrize('block_bytes', [16, 40, 64, 100])
+def test_scan_block_splits_agree(tmp_path, block_bytes):
+    # Small blocks put cuts inside quoted newlines and between a row and its later edit.
+    path = write_file(tmp_path / 'transactions.csv', MIXED * 3)
+    whole = scan_totals(path)
+    split = scan_totals(path, block_bytes=block_bytes)
+    assert split == whole
+    assert in_dollars(split) == loaded_totals(path)
+
+
+def test_scan_of_empty_file(tmp_path):
+    path = write_file(tmp_path / 'transactions.csv', '')
+    assert scan_totals(path) == {'rows': 0, 'net': 0, 'category_totals': {}, 'monthly_totals': {}}
+
+
+# --- Journal replay and compaction ---
+
+def make_journal(path):
+    ledger = Ledger(path)
+    ids = [ledger.append(['2024-01-%02d' % day, 'Food', '-%d.00' % day, 'row %d' % day]) for day in range(1, 6)]
+    ledger.update(ids[1], ['2024-01-02', 'Food', '-20.00', 'edited'])
+    ledger.delete(ids[3])
+    return ledger, ids
+
+
+def test_journal_replays_into_a_new_ledger(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    ledger, ids = make_journal(path)
+    reopened = Ledger(path)
+    assert reopened.items() == ledger.items()
+    assert reopened.get(ids[1]) == ['2024-01-02', 'Food', '-20.00', 'edited']
+    assert reopened.get(ids[3]) is None
+    assert reopened.net() == ledger.net() == -1 - 20 - 3 - 5
+
+
+def test_journal_records_on_disk(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    _, ids = make_journal(path)
+    lines = open(path, encoding='utf-8').read().splitlines()
+    assert lines[-2] == '%d,2024-01-02,Food,-20.00,edited' % ids[1]
+    assert lines[-1] == str(ids[3])
+
+
+def test_compaction_keeps_live_rows_and_ids(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    ledger, ids = make_journal(path)
+    before = ledger.items()
+    assert ledger.compact()
+    lines = open(path, encoding='utf-8').read().splitlines()
+    assert len(lines) == 4  # the live rows only, each under its id
+    assert Ledger(path).items() == before
+    assert ledger.items() == before
+
+
+def test_compaction_never_reuses_the_last_id(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    ledger, ids = make_journal(path)
+    ledger.delete(ids[-1])
+    assert ledger.compact()
+    assert open(path, encoding='utf-8').read().splitlines()[-1] == str(ids[-1])
+    assert Ledger(path).append(['2024-02-01', 'Food', '-1', 'new']) == ids[-1] + 1
+
+
+def test_writes_after_compaction_replay(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    ledger, ids = make_journal(path)
+    ledger.compact()
+    new_id = ledger.append(['2024-02-01', 'Rent', '-500', 'Feb'])
+    ledger.update(ids[0], ['2024-01-01', 'Food', '-1.50', 'after compaction'])
+    assert Ledger(path).items() == ledger.items()
+    assert Ledger(path).get(new_id) == ['2024-02-01', 'Rent', '-500.00', 'Feb']
+
+
+# --- The row index ---
+
+def test_row_index_lookup_after_compaction(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    ledger, ids = make_journal(path)
+    assert ledger.index.lookup(ids[1]) == ['2024-01-02', 'Food', '-20.00', 'edited']
+    ledger.compact()
+    index = Ledger(path).index
+    for txn_id, row in ledger.items():
+        assert index.lookup(txn_id) == row
+    assert index.lookup(ids[3]) is None
+    assert index.lookup(ids[-1] + 1) is None
+    assert index.lookup(-1) is None
+
+
+def test_row_index_catches_up_on_appends_after_compaction(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    ledger, ids = make_journal(path)
+    ledger.compact()
+    new_id = ledger.append(['2024-03-01', 'Travel', '-99.99', 'train, return'])
+    ledger.delete(ids[0])
+    index = Ledger(path).index
+    assert index.lookup(new_id) == ['2024-03-01', 'Travel', '-99.99', 'train, return']
+    assert index.lookup(ids[0]) is None
+
+
+def test_row_index_reads_legacy_rows(tmp_path):
+    path = write_file(tmp_path / 'transactions.csv', MIXED)
+    index = Ledger(path).index
+    assert index.lookup(0) is None
+    assert index.lookup(1) == ['2024-01-05', 'Dining, out', '-31.25', 'Pizza, edited']
+    assert index.lookup(3) == ['2024-02-01', 'Rent', ' 5', 'two\nlines']
+    assert index.lookup(8) == ['2024-03-01', 'Groceries', '-8.75', 'quoted "a,b"\nand a newline']
+
+
+def test_row_index_notes_a_group_commit(tmp_path):
+    path = str(tmp_path / 'transactions.csv')
+    ledger = Ledger(path)
+    ledger.append(['2024-01-01', 'Food', '-1', 'first'])
+    ledger.index.lookup(0)  # bring the index current, so the batch below is noted in place
+    created = ledger.apply_batch(creates=[['2024-01-%02d' % day, 'Food', '-2', 'batch'] for day in range(2, 6)],
+                                 updates=[(0, ['2024-01-01', 'Food', '-1.50', 'edited'])])
+    with open(ledger.index.path, 'rb') as index_file:
+        header = ledger.index._read_header(index_file)
+    assert header[1:] == (len(open(path, 'rb').read()), created[-1] + 1)
+    assert ledger.index.lookup(0) == ['2024-01-01', 'Food', '-1.50', 'edited']
+    assert ledger.index.lookup(created[2]) == ['2024-01-04', 'Food', '-2.00', 'batch']
+
+
+# --- Listeners ---
+
+def test_failing_listener_does_not_fail_the_write(tmp_path, caplog):
+    path = str(tmp_path / 'transactions.csv')
+    ledger = Ledger(path)
+    heard = []
+
+    def broken(touched):
+        raise RuntimeError('listener bug')
+
+    ledger.listeners.extend([broken, heard.append])
+    txn_id = ledger.append(['2024-01-01', 'Food', '-1', 'x'])
+    assert ledger.update(txn_id, ['2024-01-01', 'Food', '-2', 'y'])
+    assert heard == [[(None, ['2024-01-01', 'Food', '-1.00', 'x'])],
+                     [(['2024-01-01', 'Food', '-1.00', 'x'], ['2024-01-01', 'Food', '-2.00', 'y'])]]
+    assert Ledger(path).get(txn_id) == ['2024-01-01', 'Food', '-2.00', 'y']
+    assert 'listener bug' in caplog.text
@@ -0,0 +1,94 @@
+# tests/test_recurring.py
+"""Recurring-charge detection, fitted in one pass and kept current as the ledger is written to."""
+
+import datetime
+
+from ledger import Ledger
+from recurring import RecurringDetector, normalize_merchant
+
+AS_OF = datetime.date(2024, 6, 20)
+
+
+def monthly(merchant, amount, months, day=5, category='Subscriptions'):
+    return [['2024-%02d-%02d' % (month, day), category, '%.2f' % amount,
+             '%s %02d/%02d #%d' % (merchant, month, day, month)] for month in months]
+
+
+def found(detector, **kwargs):
+    return {(series['merchant'], series['period'], series['occurrences']) for series in
+            detector.series(as_of=AS_OF, **kwargs)}
+
+
+def test_normalize_merchant():
+    assert normalize_merchant('NETFLIX.COM 12/05 #8841') == 'netflix com'
+    assert normalize_merchant('Spotify  AB stockholm se extra words') == 'spotify ab stockholm se'
+
+
+def test_finds_weekly_monthly_and_annual_series():
+    rows = monthly('NETFLIX.COM', -15.49, range(1, 7))
+    rows += [[(datetime.date(2024, 4, 1) + datetime.timedelta(weeks=week)).isoformat(), 'Food', '-12.00', 'Bakery']
+             for week in range(6)]
+    rows += [['%d-03-10' % year, 'Insurance', '-480.00', 'Home cover'] for year in (2022, 2023, 2024)]
+    detector = RecurringDetector()
+    detector.fit_rows(rows)
+    assert found(detector) == {('netflix com', 'monthly', 6), ('bakery', 'weekly', 6),
+                               ('home cover', 'annual', 3)}
+
+
+def test_series_details():
+    detector = RecurringDetector()
+    detector.fit_rows(monthly('NETFLIX.COM', -15.49, range(1, 7)))
+    [series] = detector.series(as_of=AS_OF)
+    assert series['category'] == 'Subscriptions'
+    assert series['amount'] == -15.49
+    assert (series['first_date'], series['last_date'], series['next_date']) == ('2024-01-05', '2024-06-05',
+                                                                                '2024-07-05')
+    assert series['monthly_cost'] == -15.49
+    assert series['active']
+    assert not detector.series(as_of=datetime.date(2024, 8, 1))[0]['active']
+
+
+def test_too_few_irregular_or_changing_charges_are_not_recurring():
+    rows = monthly('Gym', -30, range(1, 3))  # only two charges
+    rows += [['2024-01-02', 'Food', '-9', 'Cafe'], ['2024-01-20', 'Food', '-9', 'Cafe'],
+             ['2024-03-01', 'Food', '-9', 'Cafe'], ['2024-03-04', 'Food', '-9', 'Cafe']]
+    rows += monthly('Power', -50, range(1, 3)) + monthly('Power', -95, range(3, 5))
+    detector = RecurringDetector()
+    detector.fit_rows(rows)
+    assert found(detector) == set()
+    assert found(detector, min_occurrences=2) == {('gym', 'monthly', 2), ('power', 'monthly', 2)}
+
+
+def test_small_price_change_keeps_the_series():
+    detector = RecurringDetector()
+    detector.fit_rows(monthly('Spotify', -9.99, range(1, 4)) + monthly('Spotify', -10.99, range(4, 7)))
+    assert found(detector) == {('spotify', 'monthly', 6)}
+
+
+def test_incremental_adds_match_a_fit():
+    rows = monthly('NETFLIX.COM', -15.49, range(1, 7)) + monthly('Gym', -30, range(2, 7), day=12)
+    rows.sort()
+    incremental = RecurringDetector()
+    for row in rows:
+        assert incremental.add(row)
+    fitted = RecurringDetector()
+    fitted.fit_rows(rows)
+    assert incremental.series(as_of=AS_OF) == fitted.series(as_of=AS_OF)
+
+
+def test_follows_ledger_writes(tmp_path):
+    ledger = Ledger(str(tmp_path / 'transactions.csv'))
+    detector = RecurringDetector(ledger.rows)
+    ledger.listeners.append(detector.changed)
+    ids = [ledger.append(row) for row in monthly('NETFLIX.COM', -15.49, range(1, 4))]
+    assert found(detector) == {('netflix com', 'monthly', 3)}
+    ledger.append(monthly('NETFLIX.COM', -15.49, [4])[0])
+    assert not detector.stale
+    assert found(detector) == {('netflix com', 'monthly', 4)}
+    # Deletes and back-dated rows can't be applied in place: the next query refits.
+    ledger.delete(ids[1])
+    assert detector.stale
+    assert found(detector) == set()
+    ledger.append(monthly('NETFLIX.COM', -15.49, [2])[0])
+    assert found(detector) == {('netflix com', 'monthly', 4)}
+    assert not detector.stale